@@ -1,141 +1,74 @@
 import time
 import tkinter as tk
+import tkinter.font
 import tkinter.messagebox
 import typing as t
-import random
+import threading
+import PuzzleBoard
+import PuzzlePatternDB
+import PuzzleSolver
+# The game logic doesn't need Tk, it lives in PuzzleCore
+from PuzzleCore import BOARD_SIZE, GameState
 
-# In the game all values belong to this interval
-NUMBER_LIMITS = [1, 15]
-BOARD_SIZE = 4
+# The player can choose another size than the default BOARD_SIZE
+MIN_BOARD_SIZE = 2
+MAX_BOARD_SIZE = 30
+# Optimal solutions of larger boards take too long to find
+MAX_SOLVER_BOARD_SIZE = 4
 # From which cell the game grid starts
 GAME_GRID_ROW = 1
 GAME_GRID_COLUMN = 0
-
-class GameRequest(t.NamedTuple):
-    button_idx: int
-    new_grid_row: int
-    new_grid_column: int
-
-class GameState():
-    ''' The Puzzle 15 stat.
-    Keeps track of the game cells
-    '''
-    def __init__(self, val_lst: t.List[int]):
-        assert(len(val_lst) == BOARD_SIZE * BOARD_SIZE - 1)
-        self.cells = []
-        # A button doesn't change its value
-        # Keep the dict to find button by value fast
-        self.val_to_button_idx = {}
-        for row in range(BOARD_SIZE):
-            cell_row = []
-            for column in range(BOARD_SIZE):
-                if row * BOARD_SIZE + column < BOARD_SIZE * BOARD_SIZE - 1:
-                    cell_row.append(val_lst[row * BOARD_SIZE + column])
-                    self.val_to_button_idx[val_lst[row * BOARD_SIZE + column]] = \
-                        row * BOARD_SIZE + column
-                else:
-                    # 0 indicates lack of the element
-                    cell_row.append(0)
-            self.cells.append(cell_row)
-        self.cells[BOARD_SIZE - 1][BOARD_SIZE - 1] = 0
-        # Track the location of the empty space on the board
-        self.empty_loc = (BOARD_SIZE - 1, BOARD_SIZE - 1)
-
-    def is_win(self) -> bool:
-        ''' Has the player won the game?
-        '''
-        if self.empty_loc[0] != BOARD_SIZE - 1 \
-           or self.empty_loc[1] != BOARD_SIZE - 1:
-            return False
-        for row in range(BOARD_SIZE):
-            for column in range(BOARD_SIZE):
-                if row * BOARD_SIZE + column < BOARD_SIZE * BOARD_SIZE - 1:
-                    if self.cells[row][column] != row * BOARD_SIZE + column + 1:
-                        return False
-        return True
-
-    def get_button_by_value(self, val: int) -> int:
-        ''' Given the value of a button label,
-        find the button index in array
-        '''
-        assert(val > 0 and val < BOARD_SIZE * BOARD_SIZE)
-        return self.val_to_button_idx[val]
-
-    def move_cell(self, row_idx: int, column_idx: int) -> GameRequest:
-        ''' In the game request
-        Results:
-            Game request, with the grid position relative to 
-            the cell start
-        '''
-        assert(row_idx >= 0 and row_idx < BOARD_SIZE)
-        assert(column_idx >= 0 and column_idx < BOARD_SIZE)
-        cell_val = self.cells[row_idx][column_idx]
-        # The cell neighbors the empty space
-        if abs(self.empty_loc[0] - row_idx) + \
-           abs(self.empty_loc[1] - column_idx) == 1:
-            # Swap the cell and the empty space
-            empty_loc_row = self.empty_loc[0]
-            empty_loc_column = self.empty_loc[1]
-            self.empty_loc = (row_idx, column_idx)
-            self.cells[row_idx][column_idx] = 0
-            self.cells[empty_loc_row][empty_loc_column] = cell_val
-            return GameRequest(button_idx=self.get_button_by_value(cell_val),
-                               new_grid_row = empty_loc_row,
-                               new_grid_column = empty_loc_column)
-        return None
-
-class BoardButton(tk.Button):
-    ''' Initialize a button with a numerical label.
-    It will belong to a puzzle board
-    '''
-    def __init__(self, number: int, row_idx: int, column_idx: int,
-                 handler: t.Callable[[int, int], None],
-                 master=None):
-        ''' Handler requires two arguments: row_idx and column_idx 
-        '''
-        # The number must be in the limits
-        assert(number >= NUMBER_LIMITS[0] and number <= NUMBER_LIMITS[1])
-        MAX_DIGITS_IN_NUMBER = 2
-        # Constants for defining the button's design
-        WIDTH_MULTIPLIER = 3
-        WIDTH_TO_HEIGHT_RATIO = 2
-        super().__init__(master, text=str(number),command=self.on_click)
-        self.grid(row=row_idx, column=column_idx, sticky=tk.N+tk.S+tk.E+tk.W)
-        self['width'] = MAX_DIGITS_IN_NUMBER * WIDTH_MULTIPLIER
-        self['height'] = self['width'] // WIDTH_TO_HEIGHT_RATIO
-        # Auxiliary buttons occupy the first level of grid
-        self.row_idx = row_idx - GAME_GRID_ROW
-        self.column_idx = column_idx - GAME_GRID_COLUMN
-        self.handler = handler
-
-    def update_grid(self, new_row_idx, new_column_idx):
-        self.row_idx = new_row_idx
-        self.column_idx = new_column_idx
-        self.grid(row=new_row_idx + GAME_GRID_ROW, 
-                  column=new_column_idx + GAME_GRID_COLUMN,
-                  sticky=tk.N+tk.S+tk.E+tk.W)
-
-    def on_click(self):
-        self.handler(self.row_idx, self.column_idx)
+# The initial canvas size in pixels, the board is scaled with the window
+BOARD_CANVAS_SIZE = 480
+TILE_PADDING = 1
+TILE_COLOR = '#d9d9d9'
+TILE_OUTLINE_COLOR = '#808080'
+BOARD_COLOR = '#ffffff'
+# Random walk length from the goal, None means a uniformly random board
+DIFFICULTY_SHUFFLE_MOVES = {'Easy': 20, 'Medium': 80, 'Hard': None}
+DEFAULT_DIFFICULTY = 'Hard'
+# How often to check whether the solver has finished
+SOLVER_POLL_MS = 50
+# Seconds the solver may search before giving up. Without the pattern
+# database some 4x4 boards take minutes
+SOLVER_TIME_LIMIT = 10.0
+# Delay between the moves when the solution is played
+SOLUTION_MOVE_DELAY_MS = 200
 
 
 class GameFrame(tk.Frame):
 
     def __init__(self, master=None):
         super().__init__(master)
+        # Don't start another search while one is running or played
+        self.is_solving = False
+        # The player's clicks would break the played solution
+        self.is_playing = False
+        # The running solver, a new game cancels it
+        self.solver = None
+        # Built with PuzzlePatternDB.py, the solver is much faster with it
+        self.pattern_db = PuzzlePatternDB.load_database(BOARD_SIZE)
+        # Canvas items of every tile: the rectangle and the label.
+        # The items are reused by the next games, the pool only grows
+        # up to the largest board played
+        self.tile_items = []
+        self.shown_tile_count = 0
+        # The board side in pixels follows the canvas size
+        self.board_pixels = BOARD_CANVAS_SIZE
+        self.tile_size = BOARD_CANVAS_SIZE / BOARD_SIZE
         self.grid(sticky=tk.N+tk.S+tk.E+tk.W)
         self.create_widgets()
 
     def create_widgets(self):
         BUTTON_WIDTH = 10
         BUTTON_HEIGHT = 1
+        CONTROL_COLUMNS = 6
         top = self.winfo_toplevel()
         # Enable scaling
         top.rowconfigure(0, weight=1)
         top.columnconfigure(0, weight=1)
-        for row_idx in range(BOARD_SIZE+1):
-            self.rowconfigure(row_idx, weight=1)
-        for column_idx in range(BOARD_SIZE):
+        self.rowconfigure(GAME_GRID_ROW, weight=1)
+        for column_idx in range(CONTROL_COLUMNS):
             self.columnconfigure(column_idx, weight=1)
 
         self.quit_button = tk.Button(self, text='Quit', width=BUTTON_WIDTH,
@@ -143,29 +76,127 @@ class GameFrame(tk.Frame):
         self.new_button = tk.Button(self, text='New',
                                     width=BUTTON_WIDTH, height=BUTTON_HEIGHT,
                                     command=self.generate_board)
-        self.new_button.grid(row=0, column=0, columnspan=2, sticky=tk.N+tk.S)
+        self.size_var = tk.IntVar(value=BOARD_SIZE)
+        self.size_spinbox = tk.Spinbox(self, from_=MIN_BOARD_SIZE,
+                                       to=MAX_BOARD_SIZE, width=4,
+                                       textvariable=self.size_var)
+        self.difficulty_var = tk.StringVar(value=DEFAULT_DIFFICULTY)
+        self.difficulty_menu = tk.OptionMenu(self, self.difficulty_var,
+                                             *DIFFICULTY_SHUFFLE_MOVES)
+        self.hint_button = tk.Button(self, text='Hint',
+                                     width=BUTTON_WIDTH, height=BUTTON_HEIGHT,
+                                     command=self.on_click_hint)
+        self.solve_button = tk.Button(self, text='Solve',
+                                      width=BUTTON_WIDTH, height=BUTTON_HEIGHT,
+                                      command=self.on_click_solve)
+        self.new_button.grid(row=0, column=0, sticky=tk.N+tk.S)
+        self.size_spinbox.grid(row=0, column=1)
+        self.difficulty_menu.grid(row=0, column=2)
+        self.hint_button.grid(row=0, column=3, sticky=tk.N+tk.S)
+        self.solve_button.grid(row=0, column=4, sticky=tk.N+tk.S)
+        self.quit_button.grid(row=0, column=5, sticky=tk.N+tk.S)
 
-        self.quit_button.grid(row=0, column=2, columnspan=2, sticky=tk.N+tk.S)
+        # All tiles are items of one canvas, a move doesn't
+        # need the geometry manager
+        self.board_canvas = tk.Canvas(self, bg=BOARD_COLOR,
+                                      width=BOARD_CANVAS_SIZE,
+                                      height=BOARD_CANVAS_SIZE,
+                                      highlightthickness=0)
+        self.board_canvas.grid(row=GAME_GRID_ROW, column=GAME_GRID_COLUMN,
+                               columnspan=CONTROL_COLUMNS,
+                               sticky=tk.N+tk.S+tk.E+tk.W)
+        # One named font for all labels, so scaling the board
+        # resizes every number with a single call
+        self.tile_font = tkinter.font.Font(self, font="TkDefaultFont")
+        self.board_canvas.bind("<Button-1>", self.on_click_board)
+        self.board_canvas.bind("<Configure>", self.on_resize_board)
         self.generate_board()
 
+    def get_board_size(self) -> int:
+        ''' The size chosen by the player, clamped to the limits
+        '''
+        try:
+            size = self.size_var.get()
+        except tk.TclError:
+            size = BOARD_SIZE
+        return max(MIN_BOARD_SIZE, min(MAX_BOARD_SIZE, size))
+
     def generate_board(self):
         ''' Generate a new game board.
-        Fill it with numbers (1..15) in random order
+        Fill it with numbers (1..N*N-1) in random solvable order
+        '''
+        if self.solver is not None:
+            # Its board is gone, don't let it take the CPU any longer
+            self.solver.cancel()
+            self.solver = None
+        # A played solution stops at its next move, the new board is free
+        self.is_playing = False
+        size = self.get_board_size()
+        shuffle_moves = DIFFICULTY_SHUFFLE_MOVES[self.difficulty_var.get()]
+        while True:
+            val_lst = PuzzleBoard.random_values(size, shuffle_moves)
+            self.game_state = GameState(val_lst, size)
+            # A short walk may end up in the goal
+            if not self.game_state.is_win():
+                break
+        self.tile_size = self.board_pixels / size
+        self.update_tile_font()
+        while len(self.tile_items) < len(val_lst):
+            rectangle = self.board_canvas.create_rectangle(
+                0, 0, 0, 0, fill=TILE_COLOR, outline=TILE_OUTLINE_COLOR,
+                tags=("tile",))
+            label = self.board_canvas.create_text(0, 0, font=self.tile_font,
+                                                  tags=("tile",))
+            self.tile_items.append((rectangle, label))
+        for button_idx, val in enumerate(val_lst):
+            # Leave the corner empty
+            row_idx, column_idx = divmod(button_idx, size)
+            left = column_idx * self.tile_size
+            top = row_idx * self.tile_size
+            rectangle, label = self.tile_items[button_idx]
+            self.board_canvas.coords(rectangle,
+                                     left + TILE_PADDING, top + TILE_PADDING,
+                                     left + self.tile_size - TILE_PADDING,
+                                     top + self.tile_size - TILE_PADDING)
+            self.board_canvas.coords(label, left + self.tile_size / 2,
+                                     top + self.tile_size / 2)
+            self.board_canvas.itemconfigure(label, text=str(val))
+        # Show the tiles hidden by a smaller board, hide the unused ones
+        for button_idx in range(self.shown_tile_count, len(val_lst)):
+            for item in self.tile_items[button_idx]:
+                self.board_canvas.itemconfigure(item, state=tk.NORMAL)
+        for button_idx in range(len(val_lst), self.shown_tile_count):
+            for item in self.tile_items[button_idx]:
+                self.board_canvas.itemconfigure(item, state=tk.HIDDEN)
+        self.shown_tile_count = len(val_lst)
+
+    def update_tile_font(self):
+        ''' The numbers take a third of the tile, negative size is in pixels
+        '''
+        self.tile_font.configure(size=-max(1, int(self.tile_size / 3)))
+
+    def on_resize_board(self, event):
+        ''' Scale the board with the window
+        '''
+        new_board_pixels = min(event.width, event.height)
+        if new_board_pixels <= 1 or new_board_pixels == self.board_pixels:
+            return
+        scale = new_board_pixels / self.board_pixels
+        self.board_canvas.scale("tile", 0, 0, scale, scale)
+        self.board_pixels = new_board_pixels
+        self.tile_size = new_board_pixels / self.game_state.size
+        self.update_tile_font()
+
+    def on_click_board(self, event):
+        ''' Find the clicked cell by the coordinates
         '''
-        val_lst = list(range(1, 16))
-        random.shuffle(val_lst)
-        self.numeric_buttons = []
-        for row_idx in range(4):
-            for column_idx in range(4):
-                # Leave the corner empty
-                if row_idx * 4 + column_idx < 15:
-                    self.numeric_buttons.append(
-                        BoardButton(val_lst[row_idx * 4 + column_idx],
-                                    row_idx=row_idx + GAME_GRID_ROW,
-                                    column_idx=column_idx + GAME_GRID_COLUMN,
-                                    master=self,
-                                    handler=self.on_click_game_button))
-        self.game_state = GameState(val_lst)
+        if self.is_playing:
+            return
+        row_idx = int(event.y // self.tile_size)
+        column_idx = int(event.x // self.tile_size)
+        if 0 <= row_idx < self.game_state.size and \
+           0 <= column_idx < self.game_state.size:
+            self.on_click_game_button(row_idx, column_idx)
 
     def on_click_game_button(self, row_idx: int, column_idx: int):
         ''' Change a game state after the player clicked on button
@@ -175,13 +206,107 @@ class GameFrame(tk.Frame):
         if game_request is None:
             # Can't move the button
             return (row_idx, column_idx)
-        self.numeric_buttons[game_request.button_idx].update_grid(game_request.new_grid_row,
-                                                                  game_request.new_grid_column)
+        x_offset = (game_request.new_grid_column - column_idx) * self.tile_size
+        y_offset = (game_request.new_grid_row - row_idx) * self.tile_size
+        # Move items by id: no tag search over the whole canvas
+        for item in self.tile_items[game_request.button_idx]:
+            self.board_canvas.move(item, x_offset, y_offset)
         if self.game_state.is_win():
             tk.messagebox.showinfo("Congratulations!", "You won!")
             self.generate_board()
 
+    def on_click_hint(self):
+        ''' Make the first move of the optimal solution
+        '''
+        self.start_solver(play_all=False)
+
+    def on_click_solve(self):
+        ''' Play the whole optimal solution
+        '''
+        self.start_solver(play_all=True)
+
+    def start_solver(self, play_all: bool):
+        ''' Search in the background thread, so the window
+        stays responsive. Tk must be used only from the main thread,
+        so the result is picked up by polling
+        '''
+        if self.is_solving:
+            return
+        size = self.game_state.size
+        if size > MAX_SOLVER_BOARD_SIZE:
+            tk.messagebox.showinfo("Too large",
+                                   "Only boards up to "
+                                   f"{MAX_SOLVER_BOARD_SIZE}x"
+                                   f"{MAX_SOLVER_BOARD_SIZE} can be solved")
+            return
+        pattern_db = self.pattern_db
+        if pattern_db is not None and pattern_db.size != size:
+            pattern_db = None
+        self.is_solving = True
+        board = self.game_state.board.to_list()
+        packed_board = self.game_state.board.packed
+        result = {}
+        solver = PuzzleSolver.IDAStarSolver(size, pattern_db=pattern_db,
+                                            time_limit=SOLVER_TIME_LIMIT)
+        self.solver = solver
+
+        def search():
+            result['solution'] = solver.solve(board)
+
+        solver_thread = threading.Thread(target=search, daemon=True)
+        solver_thread.start()
+        self.after(SOLVER_POLL_MS, self.poll_solver, solver_thread, result,
+                   self.game_state, packed_board, play_all)
+
+    def poll_solver(self, solver_thread: threading.Thread, result: dict,
+                    game_state: GameState, packed_board: int,
+                    play_all: bool):
+        if solver_thread.is_alive():
+            self.after(SOLVER_POLL_MS, self.poll_solver, solver_thread,
+                       result, game_state, packed_board, play_all)
+            return
+        self.is_solving = False
+        self.solver = None
+        # The player has moved or started a new game meanwhile
+        if game_state is not self.game_state or \
+           packed_board != game_state.board.packed:
+            return
+        solution = result['solution']
+        if solution.status == PuzzleSolver.BUDGET_EXCEEDED:
+            message = f"No solution found in {SOLVER_TIME_LIMIT:g} seconds."
+            if self.pattern_db is None:
+                message += " Build the pattern database with " \
+                           "PuzzlePatternDB.py to solve much faster."
+            tk.messagebox.showinfo("Too hard", message)
+            return
+        moves = solution.moves
+        if moves is None:
+            tk.messagebox.showinfo("No solution", "This board can't be solved")
+            return
+        if not play_all:
+            moves = moves[:1]
+        self.is_solving = True
+        self.is_playing = True
+        self.play_solution(moves, game_state, packed_board)
+
+    def play_solution(self, moves: t.List[PuzzleSolver.Move],
+                      game_state: GameState, packed_board: int):
+        ''' Click the solution cells one by one.
+        The moves were found for packed_board, they don't fit any other
+        '''
+        # Stop if the game was won or restarted
+        if not moves or game_state is not self.game_state or \
+           packed_board != game_state.board.packed:
+            self.is_solving = False
+            self.is_playing = False
+            return
+        row_idx, column_idx = moves[0]
+        self.on_click_game_button(row_idx, column_idx)
+        self.after(SOLUTION_MOVE_DELAY_MS, self.play_solution, moves[1:],
+                   game_state, game_state.board.packed)
+
 
-game_frame = GameFrame()
-game_frame.master.title('15 Puzzle')
-game_frame.mainloop()
+if __name__ == "__main__":
+    game_frame = GameFrame()
+    game_frame.master.title('15 Puzzle')
+    game_frame.mainloop()
@@ -0,0 +1,239 @@
+''' Headless simulator stepping many boards at once with NumPy.
+
+The boards are rows of one (K, N*N) array, the empty space positions
+are a separate vector. A step takes a vector of K moves, each one
+a direction the empty space goes to; illegal moves leave their board
+unchanged and are reported in the mask.
+'''
+import argparse
+import random
+import time
+import typing as t
+
+import numpy as np
+
+import PuzzleBoard
+
+# Directions of the empty space
+UP = 0
+DOWN = 1
+LEFT = 2
+RIGHT = 3
+DIRECTION_COUNT = 4
+
+
+class BatchTables():
+    ''' Per-size lookup tables, indexed with whole vectors
+    '''
+    def __init__(self, size: int):
+        cell_count = size * size
+        self.size = size
+        self.cell_count = cell_count
+        self.dtype = np.uint8 if cell_count <= 256 else np.uint16
+        positions = np.arange(cell_count)
+        rows, columns = np.divmod(positions, size)
+        # Where the empty space goes from the position in the direction,
+        # -1 if it would leave the board
+        self.target = np.full((cell_count, DIRECTION_COUNT), -1,
+                              dtype=np.int32)
+        self.target[rows > 0, UP] = positions[rows > 0] - size
+        self.target[rows < size - 1, DOWN] = positions[rows < size - 1] + size
+        self.target[columns > 0, LEFT] = positions[columns > 0] - 1
+        self.target[columns < size - 1, RIGHT] = \
+            positions[columns < size - 1] + 1
+        self.legal = self.target >= 0
+        # Manhattan distance of the value at the position,
+        # the empty space costs nothing
+        goal = positions - 1
+        goal_rows, goal_columns = np.divmod(goal, size)
+        self.distance = (np.abs(rows[None, :] - goal_rows[:, None]) +
+                         np.abs(columns[None, :] - goal_columns[:, None]))
+        self.distance[0, :] = 0
+        self.distance = self.distance.astype(np.int32)
+        # Whether the value stands in its goal position
+        self.in_place = np.zeros((cell_count, cell_count), dtype=np.int32)
+        self.in_place[positions[1:], positions[1:] - 1] = 1
+        self.flat_distance = self.distance.reshape(-1)
+        self.flat_in_place = self.in_place.reshape(-1)
+
+
+_tables_cache: t.Dict[int, BatchTables] = {}
+
+
+def get_tables(size: int) -> BatchTables:
+    tables = _tables_cache.get(size)
+    if tables is None:
+        tables = BatchTables(size)
+        _tables_cache[size] = tables
+    return tables
+
+
+class BatchBoards():
+    ''' K boards of the same size.
+    The Manhattan distance and the number of tiles in place are kept
+    per board and updated on every step
+    '''
+    def __init__(self, boards: np.ndarray, size: int):
+        ''' Boards is (K, N*N) array of flat row-major boards,
+        0 is the empty space
+        '''
+        self.tables = get_tables(size)
+        assert(boards.ndim == 2 and boards.shape[1] == self.tables.cell_count)
+        self.size = size
+        self.boards = np.ascontiguousarray(boards, dtype=self.tables.dtype)
+        # Offsets of the boards in the flattened array
+        self.row_starts = np.arange(len(self.boards)) * \
+            self.tables.cell_count
+        self.blank = np.argmin(self.boards, axis=1).astype(np.int32)
+        positions = np.arange(self.tables.cell_count)
+        values = self.boards.astype(np.intp)
+        self.manhattan = self.tables.distance[values, positions].sum(axis=1)
+        self.in_place = self.tables.in_place[values, positions].sum(axis=1)
+
+    @classmethod
+    def from_goal(cls, count: int, size: int) -> 'BatchBoards':
+        goal = list(range(1, size * size)) + [0]
+        return cls(np.tile(np.array(goal), (count, 1)), size)
+
+    @classmethod
+    def from_lists(cls, boards: t.Sequence[t.Sequence[int]],
+                   size: int) -> 'BatchBoards':
+        return cls(np.array(boards), size)
+
+    def __len__(self) -> int:
+        return len(self.boards)
+
+    def is_win(self) -> np.ndarray:
+        return self.in_place == self.tables.cell_count - 1
+
+    def legal_moves(self) -> np.ndarray:
+        ''' (K, 4) mask of the directions the empty space can go to
+        '''
+        return self.tables.legal[self.blank]
+
+    def step(self, moves: np.ndarray) \
+            -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        ''' Move the empty space of every board in the given direction.
+        Results:
+            (legal, is_win, manhattan) vectors
+        '''
+        moves = np.asarray(moves)
+        assert(moves.shape == self.blank.shape)
+        target = self.tables.target[self.blank, moves]
+        legal = target >= 0
+        if legal.all():
+            # Policies usually pick legal moves only, skip the masking
+            row_starts = self.row_starts
+            blank = self.blank
+        else:
+            row_starts = self.row_starts[legal]
+            blank = self.blank[legal]
+            target = target[legal]
+        # Flat indices are cheaper than the 2D fancy indexing
+        flat_boards = self.boards.reshape(-1)
+        values = flat_boards[row_starts + target]
+        flat_boards[row_starts + blank] = values
+        flat_boards[row_starts + target] = 0
+        # The tables are flat too: value * N*N + position
+        value_starts = values.astype(np.intp) * self.tables.cell_count
+        delta_manhattan = self.tables.flat_distance[value_starts + blank] - \
+            self.tables.flat_distance[value_starts + target]
+        delta_in_place = self.tables.flat_in_place[value_starts + blank] - \
+            self.tables.flat_in_place[value_starts + target]
+        if blank is self.blank:
+            self.blank = target.astype(np.int32)
+            self.manhattan += delta_manhattan
+            self.in_place += delta_in_place
+        else:
+            self.blank[legal] = target
+            self.manhattan[legal] += delta_manhattan
+            self.in_place[legal] += delta_in_place
+        return legal, self.is_win(), self.manhattan
+
+    def random_moves(self, rng: np.random.Generator) -> np.ndarray:
+        ''' A uniformly random legal direction for every board
+        '''
+        legal = self.legal_moves()
+        # Random keys, the illegal directions never win the argmax
+        keys = rng.random(legal.shape)
+        keys[~legal] = -1
+        return np.argmax(keys, axis=1)
+
+
+def check_equivalence(count: int, steps: int, size: int, seed: int) -> bool:
+    ''' Step the batch and the same boards one by one with PackedBoard,
+    the GameState backend, and compare everything after every step
+    '''
+    rng = np.random.default_rng(seed)
+    py_rng = random.Random(seed)
+    boards = [PuzzleBoard.random_values(size, rng=py_rng) + [0]
+              for _ in range(count)]
+    batch = BatchBoards.from_lists(boards, size)
+    packed_boards = [PuzzleBoard.PackedBoard(board, size) for board in boards]
+    tables = batch.tables
+    for _ in range(steps):
+        # Illegal directions are included on purpose
+        moves = rng.integers(0, DIRECTION_COUNT, size=count)
+        legal, is_win, manhattan = batch.step(moves)
+        for board_idx, packed_board in enumerate(packed_boards):
+            target = int(tables.target[packed_board.blank, moves[board_idx]])
+            moved = target >= 0 and packed_board.move(target) != 0
+            if moved != legal[board_idx] or \
+               packed_board.is_win() != is_win[board_idx]:
+                return False
+            if packed_board.to_list() != batch.boards[board_idx].tolist():
+                return False
+            expected_manhattan = sum(
+                int(tables.distance[val, pos])
+                for pos, val in enumerate(packed_board.to_list()))
+            if expected_manhattan != manhattan[board_idx]:
+                return False
+    return True
+
+
+def measure_throughput(count: int, steps: int, size: int, seed: int) \
+        -> t.Tuple[float, float]:
+    ''' Results:
+        Moves per second of the batch and of PackedBoard in a loop
+    '''
+    rng = np.random.default_rng(seed)
+    batch = BatchBoards.from_goal(count, size)
+    start = time.perf_counter()
+    for _ in range(steps):
+        batch.step(batch.random_moves(rng))
+    batch_rate = count * steps / (time.perf_counter() - start)
+
+    py_rng = random.Random(seed)
+    packed_boards = [PuzzleBoard.PackedBoard(list(range(1, size * size)) +
+                                             [0], size)
+                     for _ in range(count)]
+    start = time.perf_counter()
+    for _ in range(steps):
+        for packed_board in packed_boards:
+            packed_board.move(py_rng.choice(packed_board.movable_cells()))
+            packed_board.is_win()
+    loop_rate = count * steps / (time.perf_counter() - start)
+    return batch_rate, loop_rate
+
+
+def main(argv: t.Optional[t.List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description='Check and measure the batch simulator')
+    parser.add_argument('--size', type=int, default=4)
+    parser.add_argument('--boards', type=int, default=10000)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if not check_equivalence(min(args.boards, 100), args.steps, args.size,
+                             args.seed):
+        print("The batch simulator differs from PackedBoard")
+        return 1
+    batch_rate, loop_rate = measure_throughput(args.boards, args.steps,
+                                               args.size, args.seed)
+    print(f"batch: {batch_rate:.0f} moves/s, loop: {loop_rate:.0f} moves/s, "
+          f"speedup {batch_rate / loop_rate:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,151 @@
+''' Solve a file of puzzle instances in parallel.
+
+Every line of the input holds one board in the layout GameState accepts:
+N*N - 1 tile values row by row, the empty space is in the bottom right
+corner. A full N*N line with 0 for the empty space is accepted too.
+Empty lines and lines starting with '#' are skipped.
+
+The results are printed as JSON lines in the order the instances finish.
+No Tk window is opened, the module doesn't import the game.
+'''
+import argparse
+import json
+import math
+import multiprocessing
+import sys
+import time
+import typing as t
+
+import PuzzlePatternDB
+import PuzzleSolver
+
+# Set in every worker by the pool initializer
+_worker_solvers: t.Dict[int, PuzzleSolver.IDAStarSolver] = {}
+_worker_options: t.Dict[str, t.Any] = {}
+
+
+class Instance(t.NamedTuple):
+    line_idx: int
+    board: t.Optional[t.List[int]]
+    size: int
+    # Why the line couldn't be parsed
+    error: t.Optional[str] = None
+
+
+def parse_instance(line_idx: int, line: str) -> Instance:
+    ''' Accepts values separated by spaces or commas
+    '''
+    try:
+        values = [int(val) for val in line.replace(',', ' ').split()]
+    except ValueError:
+        return Instance(line_idx, None, 0, "not a number")
+    if 0 in values:
+        board = values
+    else:
+        # The GameState layout: the corner is empty
+        board = values + [0]
+    size = math.isqrt(len(board))
+    if size * size != len(board):
+        return Instance(line_idx, None, 0, "not a square board")
+    if sorted(board) != list(range(size * size)):
+        return Instance(line_idx, None, 0, "not a permutation")
+    return Instance(line_idx, board, size)
+
+
+def read_instances(lines: t.Iterable[str]) -> t.Iterator[Instance]:
+    for line_idx, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        yield parse_instance(line_idx, line)
+
+
+def init_worker(options: t.Dict[str, t.Any]):
+    ''' The pattern database is mapped, not read,
+    so all workers share its pages
+    '''
+    _worker_options.update(options)
+    _worker_solvers.clear()
+
+
+def get_solver(size: int) -> PuzzleSolver.IDAStarSolver:
+    solver = _worker_solvers.get(size)
+    if solver is None:
+        pattern_db = None
+        if _worker_options['use_pattern_db'] and size == 4:
+            pattern_db = PuzzlePatternDB.load_database(
+                size, directory=_worker_options['pattern_db_directory'])
+        solver = PuzzleSolver.IDAStarSolver(
+            size, node_limit=_worker_options['node_limit'],
+            pattern_db=pattern_db,
+            time_limit=_worker_options['time_limit'])
+        _worker_solvers[size] = solver
+    return solver
+
+
+def solve_instance(instance: Instance) -> t.Dict[str, t.Any]:
+    record = {'line': instance.line_idx}
+    if instance.board is None:
+        record['status'] = 'invalid'
+        record['error'] = instance.error
+        return record
+    start = time.perf_counter()
+    result = get_solver(instance.size).solve(instance.board)
+    record['status'] = result.status
+    record['length'] = len(result.moves) if result.moves is not None \
+        else None
+    record['nodes'] = result.nodes_expanded
+    record['time'] = round(time.perf_counter() - start, 6)
+    if _worker_options['print_moves'] and result.moves is not None:
+        record['moves'] = [list(move) for move in result.moves]
+    return record
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Solve puzzle instances in parallel, '
+                    'print the results as JSON lines')
+    parser.add_argument('instances', nargs='?', default='-',
+                        help='instance file, "-" for stdin')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes, all CPUs by default')
+    parser.add_argument('--chunk-size', type=int, default=1,
+                        help='instances handed to a worker at once; keep it '
+                             'small so hard instances do not hold back others')
+    parser.add_argument('--node-limit', type=int, default=None,
+                        help='expanded nodes allowed per instance')
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help='seconds allowed per instance')
+    parser.add_argument('--no-pattern-db', action='store_true',
+                        help='use linear conflicts even if the pattern '
+                             'database is built')
+    parser.add_argument('--pattern-db-directory',
+                        default=PuzzlePatternDB.DEFAULT_DIRECTORY)
+    parser.add_argument('--moves', action='store_true',
+                        help='print the solution moves as well')
+    args = parser.parse_args(argv)
+
+    options = {
+        'node_limit': args.node_limit,
+        'time_limit': args.time_limit,
+        'use_pattern_db': not args.no_pattern_db,
+        'pattern_db_directory': args.pattern_db_directory,
+        'print_moves': args.moves,
+    }
+    if args.instances == '-':
+        instance_file = sys.stdin
+    else:
+        instance_file = open(args.instances)
+    with instance_file, multiprocessing.Pool(
+            args.jobs, initializer=init_worker,
+            initargs=(options,)) as pool:
+        # Results come back as soon as any worker finishes its chunk
+        for record in pool.imap_unordered(solve_instance,
+                                          read_instances(instance_file),
+                                          chunksize=args.chunk_size):
+            print(json.dumps(record), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,290 @@
+''' Benchmarks of the game state operations.
+
+    python PuzzleBench.py run -o results.json
+    python PuzzleBench.py compare old.json new.json
+
+Every benchmark is seeded, so two runs do the same work. Timed
+benchmarks are repeated and the best repeat is reported, which is the
+least noisy estimate. The new game benchmark creates the canvas items
+only if a display is available.
+'''
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import typing as t
+
+import PuzzleBoard
+from PuzzleCore import BOARD_SIZE, GameState
+
+DEFAULT_SEED = 15
+DEFAULT_WALK_MOVES = 10 ** 6
+DEFAULT_REPEATS = 3
+# Relative change treated as a regression by compare
+DEFAULT_THRESHOLD = 0.1
+
+
+class BenchResult(t.NamedTuple):
+    value: float
+    unit: str
+    higher_is_better: bool
+
+
+def best_time(func: t.Callable[[], None], repeats: int) -> float:
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def random_clicks(size: int, count: int, seed: int) \
+        -> t.List[t.Tuple[int, int]]:
+    ''' Cells to click on, prepared in advance so the benchmark
+    measures the game state only. Most of them neighbor the empty space,
+    the rest are illegal clicks the game must reject
+    '''
+    rng = random.Random(seed)
+    board = PuzzleBoard.PackedBoard(list(range(1, size * size)) + [0], size)
+    clicks = []
+    for _ in range(count):
+        if rng.random() < 0.9:
+            pos = rng.choice(board.movable_cells())
+            board.move(pos)
+        else:
+            pos = rng.randrange(size * size)
+        clicks.append(divmod(pos, size))
+    return clicks
+
+
+def bench_move_cell(size: int, moves: int, seed: int,
+                    repeats: int) -> BenchResult:
+    clicks = random_clicks(size, moves, seed)
+
+    def walk():
+        game_state = GameState(list(range(1, size * size)), size)
+        move_cell = game_state.move_cell
+        for row_idx, column_idx in clicks:
+            move_cell(row_idx, column_idx)
+
+    return BenchResult(moves / best_time(walk, repeats), 'moves/s', True)
+
+
+def bench_is_win(size: int, calls: int, seed: int,
+                 repeats: int) -> BenchResult:
+    game_state = GameState(PuzzleBoard.random_values(
+        size, rng=random.Random(seed)), size)
+
+    def check():
+        is_win = game_state.is_win
+        for _ in range(calls):
+            is_win()
+
+    return BenchResult(calls / best_time(check, repeats), 'calls/s', True)
+
+
+def bench_get_button_by_value(size: int, calls: int, seed: int,
+                              repeats: int) -> BenchResult:
+    rng = random.Random(seed)
+    game_state = GameState(PuzzleBoard.random_values(size, rng=rng), size)
+    values = [rng.randrange(1, size * size) for _ in range(calls)]
+
+    def find():
+        get_button_by_value = game_state.get_button_by_value
+        for val in values:
+            get_button_by_value(val)
+
+    return BenchResult(calls / best_time(find, repeats), 'calls/s', True)
+
+
+def bench_new_state(size: int, games: int, seed: int,
+                    repeats: int) -> BenchResult:
+    ''' Generating the board and the game state, no widgets
+    '''
+    def new_games():
+        rng = random.Random(seed)
+        for _ in range(games):
+            GameState(PuzzleBoard.random_values(size, rng=rng), size)
+
+    return BenchResult(best_time(new_games, repeats) / games, 's', False)
+
+
+def bench_state_memory(size: int, states: int, seed: int) -> BenchResult:
+    rng = random.Random(seed)
+    values = [PuzzleBoard.random_values(size, rng=rng) for _ in range(states)]
+    # Shared per-size tables are built before the measurement
+    GameState(values[0], size)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept_states = [GameState(val_lst, size) for val_lst in values]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert(len(kept_states) == states)
+    return BenchResult((after - before) / states, 'bytes', False)
+
+
+def load_game_module():
+    ''' 15Puzzle.py can't be imported by name
+    '''
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '15Puzzle.py')
+    spec = importlib.util.spec_from_file_location('puzzle15', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_new_game_widgets(size: int, games: int, seed: int,
+                           repeats: int) -> t.Optional[BenchResult]:
+    ''' GameFrame.generate_board with the canvas items of the size x size
+    board.
+    Results:
+        None if there is no display
+    '''
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    try:
+        game_module = load_game_module()
+        game_frame = game_module.GameFrame(root)
+        # The next games take the size from the spinbox
+        game_frame.size_var.set(size)
+        root.update()
+
+        def new_games():
+            random.seed(seed)
+            for _ in range(games):
+                game_frame.generate_board()
+                # Let Tk draw the board
+                root.update()
+
+        return BenchResult(best_time(new_games, repeats) / games, 's', False)
+    finally:
+        root.destroy()
+
+
+def run_benchmarks(size: int, walk_moves: int, seed: int,
+                   repeats: int) -> t.Dict[str, t.Any]:
+    results = {
+        'move_cell': bench_move_cell(size, walk_moves, seed, repeats),
+        'is_win': bench_is_win(size, walk_moves, seed, repeats),
+        'get_button_by_value': bench_get_button_by_value(size, walk_moves,
+                                                         seed, repeats),
+        'new_state': bench_new_state(size, 1000, seed, repeats),
+        'state_memory': bench_state_memory(size, 1000, seed),
+    }
+    widgets_result = bench_new_game_widgets(size, 100, seed, repeats)
+    if widgets_result is not None:
+        results['new_game_widgets'] = widgets_result
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'board_size': size,
+            'walk_moves': walk_moves,
+            'seed': seed,
+            'repeats': repeats,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {name: result._asdict()
+                    for name, result in results.items()},
+    }
+
+
+def compare_results(old: t.Dict[str, t.Any], new: t.Dict[str, t.Any],
+                    threshold: float) -> t.List[t.Dict[str, t.Any]]:
+    ''' Results:
+        One entry per benchmark of the old run,
+        'regression' is set if it got worse by more than the threshold.
+        'missing' is set if the new run doesn't have it
+        (e.g. new_game_widgets without a display), 'new' is None then
+    '''
+    changes = []
+    for name, old_result in old['results'].items():
+        new_result = new['results'].get(name)
+        if new_result is None:
+            changes.append({
+                'name': name,
+                'old': old_result['value'],
+                'new': None,
+                'unit': old_result['unit'],
+                'change': None,
+                'regression': False,
+                'missing': True,
+            })
+            continue
+        if old_result['value'] == 0:
+            continue
+        ratio = new_result['value'] / old_result['value']
+        # Positive change is always an improvement
+        change = ratio - 1 if old_result['higher_is_better'] else 1 - ratio
+        changes.append({
+            'name': name,
+            'old': old_result['value'],
+            'new': new_result['value'],
+            'unit': old_result['unit'],
+            'change': change,
+            'regression': change < -threshold,
+            'missing': False,
+        })
+    return changes
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the 15 Puzzle game state')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('-o', '--output', default='-',
+                            help='JSON file, "-" for stdout')
+    run_parser.add_argument('--size', type=int, default=BOARD_SIZE)
+    run_parser.add_argument('--moves', type=int, default=DEFAULT_WALK_MOVES)
+    run_parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    run_parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    compare_parser = subparsers.add_parser(
+        'compare', help='compare two runs, exit with 1 on regressions')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float,
+                                default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        report = run_benchmarks(args.size, args.moves, args.seed,
+                                args.repeats)
+        if args.output == '-':
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.output, 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+        return 0
+
+    with open(args.old) as old_file, open(args.new) as new_file:
+        changes = compare_results(json.load(old_file), json.load(new_file),
+                                  args.threshold)
+    for change in changes:
+        if change['missing']:
+            print(f"{change['name']:24} {change['old']:14.6g} -> "
+                  f"{'missing':>14} {change['unit']:8} {'':7} MISSING")
+            continue
+        mark = 'REGRESSION' if change['regression'] else 'ok'
+        print(f"{change['name']:24} {change['old']:14.6g} -> "
+              f"{change['new']:14.6g} {change['unit']:8} "
+              f"{change['change']:+7.1%} {mark}")
+    return 1 if any(change['regression'] for change in changes) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
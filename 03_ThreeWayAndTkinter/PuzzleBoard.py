@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import random
+
+# PuzzleCore imports this module and keeps away from typing
+# to start fast, the annotations below are never evaluated
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import typing as t
+
+# Zobrist keys are derived from the fixed seed,
+# so the hashes are the same in every process
+ZOBRIST_SEED = 15
+ZOBRIST_MASK = (1 << 64) - 1
+# Larger boards compute the keys on the fly instead of keeping
+# a table of (N*N)^2 keys
+ZOBRIST_TABLE_MAX_CELLS = 256
+
+
+def bits_per_cell(size: int) -> int:
+    ''' Enough bits to store any value of the board
+    '''
+    return (size * size - 1).bit_length()
+
+
+def splitmix64(seed: int) -> int:
+    seed = (seed + 0x9e3779b97f4a7c15) & ZOBRIST_MASK
+    seed = ((seed ^ (seed >> 30)) * 0xbf58476d1ce4e5b9) & ZOBRIST_MASK
+    seed = ((seed ^ (seed >> 27)) * 0x94d049bb133111eb) & ZOBRIST_MASK
+    return seed ^ (seed >> 31)
+
+
+class BoardTables():
+    ''' Per-size constants shared by all boards of this size
+    '''
+    def __init__(self, size: int):
+        cell_count = size * size
+        self.size = size
+        self.cell_count = cell_count
+        self.bits = bits_per_cell(size)
+        self.mask = (1 << self.bits) - 1
+        self.zobrist = None
+        if cell_count <= ZOBRIST_TABLE_MAX_CELLS:
+            self.zobrist = [[self.zobrist_key(val, pos)
+                             for pos in range(cell_count)]
+                            for val in range(cell_count)]
+        self.neighbors = []
+        for pos in range(cell_count):
+            row, column = divmod(pos, size)
+            pos_neighbors = []
+            if row > 0:
+                pos_neighbors.append(pos - size)
+            if row < size - 1:
+                pos_neighbors.append(pos + size)
+            if column > 0:
+                pos_neighbors.append(pos - 1)
+            if column < size - 1:
+                pos_neighbors.append(pos + 1)
+            self.neighbors.append(tuple(pos_neighbors))
+
+    def zobrist_key(self, val: int, pos: int) -> int:
+        ''' The empty space isn't hashed:
+        its position follows from the tile positions
+        '''
+        if val == 0:
+            return 0
+        if self.zobrist is not None:
+            return self.zobrist[val][pos]
+        return splitmix64(ZOBRIST_SEED * self.cell_count * self.cell_count
+                          + val * self.cell_count + pos)
+
+
+_tables_cache: t.Dict[int, BoardTables] = {}
+
+
+def get_tables(size: int) -> BoardTables:
+    tables = _tables_cache.get(size)
+    if tables is None:
+        tables = BoardTables(size)
+        _tables_cache[size] = tables
+    return tables
+
+
+class PackedBoard():
+    ''' The board packed into a single integer, bits_per_cell bits
+    per cell in row-major order (64 bits for 4x4).
+    The empty space position, the Zobrist hash and the number
+    of tiles standing in place are updated on every move,
+    so the win check and hashing take constant time
+    '''
+    __slots__ = ('tables', 'packed', 'blank', 'hash', 'in_place')
+
+    def __init__(self, board: t.List[int], size: int):
+        ''' Board is the flat row-major list, 0 is the empty space
+        '''
+        assert(len(board) == size * size)
+        self.tables = get_tables(size)
+        bits = self.tables.bits
+        self.packed = 0
+        self.hash = 0
+        self.in_place = 0
+        for pos, val in enumerate(board):
+            self.packed |= val << (pos * bits)
+            self.hash ^= self.tables.zobrist_key(val, pos)
+            if val == pos + 1:
+                self.in_place += 1
+        self.blank = board.index(0)
+
+    @property
+    def size(self) -> int:
+        return self.tables.size
+
+    def value_at(self, pos: int) -> int:
+        return (self.packed >> (pos * self.tables.bits)) & self.tables.mask
+
+    def movable_cells(self) -> t.Tuple[int, ...]:
+        ''' Positions of the tiles that can slide into the empty space
+        '''
+        return self.tables.neighbors[self.blank]
+
+    def move(self, pos: int) -> int:
+        ''' Slide the tile at pos into the empty space.
+        Results:
+            The moved value, or 0 if the tile doesn't neighbor
+            the empty space
+        '''
+        if pos not in self.tables.neighbors[self.blank]:
+            return 0
+        tables = self.tables
+        blank = self.blank
+        val = (self.packed >> (pos * tables.bits)) & tables.mask
+        # The empty space is 0, so xor moves the value
+        self.packed ^= (val << (pos * tables.bits)) ^ \
+            (val << (blank * tables.bits))
+        zobrist = tables.zobrist
+        if zobrist is not None:
+            self.hash ^= zobrist[val][pos] ^ zobrist[val][blank]
+        else:
+            self.hash ^= tables.zobrist_key(val, pos) ^ \
+                tables.zobrist_key(val, blank)
+        self.in_place += (blank == val - 1) - (pos == val - 1)
+        self.blank = pos
+        return val
+
+    def is_win(self) -> bool:
+        # All tiles in place leave the last cell for the empty space
+        return self.in_place == self.tables.cell_count - 1
+
+    def copy(self) -> 'PackedBoard':
+        board = PackedBoard.__new__(PackedBoard)
+        board.tables = self.tables
+        board.packed = self.packed
+        board.blank = self.blank
+        board.hash = self.hash
+        board.in_place = self.in_place
+        return board
+
+    def to_list(self) -> t.List[int]:
+        return [self.value_at(pos) for pos in range(self.tables.cell_count)]
+
+    def __hash__(self) -> int:
+        return self.hash
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PackedBoard) and \
+            self.tables is other.tables and self.packed == other.packed
+
+    def __repr__(self) -> str:
+        return f"PackedBoard({self.to_list()}, {self.size})"
+
+
+def permutation_parity(values: t.List[int]) -> int:
+    ''' Parity of the permutation of distinct values 1..len(values),
+    found by counting cycles in linear time
+    '''
+    visited = [False] * len(values)
+    parity = 0
+    for start in range(len(values)):
+        if visited[start]:
+            continue
+        cycle_len = 0
+        idx = start
+        while not visited[idx]:
+            visited[idx] = True
+            idx = values[idx] - 1
+            cycle_len += 1
+        parity ^= (cycle_len - 1) & 1
+    return parity
+
+
+def random_values(size: int, shuffle_moves: t.Optional[int] = None,
+                  rng: random.Random = random) -> t.List[int]:
+    ''' Tile values of a random solvable board with the empty space
+    in the bottom right corner, the layout GameState accepts.
+    Without shuffle_moves the board is uniformly random:
+    with the corner empty, only even permutations are solvable,
+    so an odd one is fixed by swapping two tiles.
+    Otherwise the empty space walks shuffle_moves random steps
+    from the goal (never straight back) and then returns to the corner
+    '''
+    cell_count = size * size
+    if shuffle_moves is None:
+        values = list(range(1, cell_count))
+        rng.shuffle(values)
+        if permutation_parity(values) == 1:
+            values[0], values[1] = values[1], values[0]
+        return values
+    neighbors = get_tables(size).neighbors
+    board = list(range(1, cell_count)) + [0]
+    blank = cell_count - 1
+    prev_blank = -1
+    for _ in range(shuffle_moves):
+        pos = rng.choice([pos for pos in neighbors[blank]
+                          if pos != prev_blank])
+        board[blank], board[pos] = board[pos], 0
+        prev_blank, blank = blank, pos
+    # Bring the empty space back: right, then down
+    while blank % size != size - 1:
+        board[blank], board[blank + 1] = board[blank + 1], 0
+        blank += 1
+    while blank != cell_count - 1:
+        board[blank], board[blank + size] = board[blank + size], 0
+        blank += size
+    return board[:-1]
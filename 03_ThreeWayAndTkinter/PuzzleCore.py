@@ -0,0 +1,113 @@
+''' The 15 Puzzle game logic without any Tk dependency.
+
+Solver workers and tests import this module, so it must stay cheap
+to import: only the standard library and PuzzleBoard.
+Run it to check the import time against IMPORT_TIME_BUDGET_MS.
+'''
+from __future__ import annotations
+
+import collections
+
+import PuzzleBoard
+
+# typing alone takes most of the import time,
+# the annotations below are never evaluated
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import typing as t
+
+# The default board is 4x4
+BOARD_SIZE = 4
+# Cumulative import time of this module in a fresh interpreter
+IMPORT_TIME_BUDGET_MS = 15
+
+
+GameRequest = collections.namedtuple(
+    'GameRequest', ['button_idx', 'new_grid_row', 'new_grid_column'])
+
+class GameState():
+    ''' The Puzzle 15 stat.
+    Keeps track of the game cells.
+    The cells are stored in PuzzleBoard.PackedBoard,
+    so a move and the win check take constant time
+    '''
+    def __init__(self, val_lst: t.List[int], size: int = BOARD_SIZE):
+        assert(len(val_lst) == size * size - 1)
+        self.size = size
+        # A button doesn't change its value
+        # Keep the dict to find button by value fast
+        self.val_to_button_idx = {}
+        for button_idx, val in enumerate(val_lst):
+            self.val_to_button_idx[val] = button_idx
+        # 0 indicates lack of the element, it is in the corner
+        self.board = PuzzleBoard.PackedBoard(list(val_lst) + [0], size)
+
+    @property
+    def empty_loc(self) -> t.Tuple[int, int]:
+        ''' The location of the empty space on the board
+        '''
+        return divmod(self.board.blank, self.size)
+
+    @property
+    def cells(self) -> t.List[t.List[int]]:
+        ''' The board as a list of rows
+        '''
+        board_lst = self.board.to_list()
+        return [board_lst[row * self.size:(row + 1) * self.size]
+                for row in range(self.size)]
+
+    def is_win(self) -> bool:
+        ''' Has the player won the game?
+        '''
+        return self.board.is_win()
+
+    def get_button_by_value(self, val: int) -> int:
+        ''' Given the value of a button label,
+        find the button index in array
+        '''
+        assert(val > 0 and val < self.size * self.size)
+        return self.val_to_button_idx[val]
+
+    def move_cell(self, row_idx: int, column_idx: int) -> GameRequest:
+        ''' In the game request
+        Results:
+            Game request, with the grid position relative to 
+            the cell start
+        '''
+        assert(row_idx >= 0 and row_idx < self.size)
+        assert(column_idx >= 0 and column_idx < self.size)
+        empty_loc_row, empty_loc_column = self.empty_loc
+        # Nothing moves unless the cell neighbors the empty space
+        cell_val = self.board.move(row_idx * self.size + column_idx)
+        if cell_val == 0:
+            return None
+        return GameRequest(button_idx=self.get_button_by_value(cell_val),
+                           new_grid_row = empty_loc_row,
+                           new_grid_column = empty_loc_column)
+
+
+def measure_import_time() -> float:
+    ''' Import the module in a fresh interpreter.
+    Results:
+        Cumulative import time in milliseconds, as -X importtime reports
+    '''
+    import os
+    import subprocess
+    import sys
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import PuzzleCore'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True)
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == 'PuzzleCore':
+            return int(fields[1]) / 1000
+    raise RuntimeError("PuzzleCore import wasn't reported")
+
+
+if __name__ == "__main__":
+    import_time = measure_import_time()
+    print(f"PuzzleCore import: {import_time:.1f} ms "
+          f"(budget {IMPORT_TIME_BUDGET_MS} ms)")
+    raise SystemExit(0 if import_time <= IMPORT_TIME_BUDGET_MS else 1)
@@ -0,0 +1,313 @@
+''' Disjoint additive pattern databases for the puzzle.
+
+Every pattern is a group of tiles. Its table stores, for every placement
+of the group tiles, the number of moves of these tiles needed to bring
+them home. The other tiles are indistinguishable and their moves are free,
+so the values of disjoint patterns can be added up.
+
+The table entry index packs the tile positions, BITS_PER_CELL bits each,
+so the search can update it with one addition per move.
+The tables are plain byte files loaded with mmap.
+'''
+import array
+import mmap
+import os
+import struct
+import sys
+import typing as t
+
+import PuzzleBoard
+
+# Korf & Felner style 5-5-5 partition of the 4x4 board
+DEFAULT_PARTITION = ((1, 2, 3, 5, 6), (4, 7, 8, 11, 12), (9, 10, 13, 14, 15))
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'pdb')
+# Not reached yet
+UNKNOWN = 255
+MAGIC = b'PDB15\0'
+VERSION = 1
+# Magic, version, board size, tile count; the tiles follow
+HEADER_FORMAT = '<6sHHH'
+# Fixed header length, so the table starts at the aligned offset
+HEADER_SIZE = 64
+
+
+def pattern_filename(size: int, tiles: t.Sequence[int]) -> str:
+    return f"pdb{size}x{size}_" + '-'.join(str(tile) for tile in tiles) + \
+           ".bin"
+
+
+def _pack_header(size: int, tiles: t.Sequence[int]) -> bytes:
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, size, len(tiles))
+    header += bytes(tiles)
+    assert(len(header) <= HEADER_SIZE)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def _write_atomic(path: str, chunks: t.Iterable[bytes]):
+    ''' Write to the temporary file and rename it,
+    so a crash never leaves a half-written file behind
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as tmp_file:
+        for chunk in chunks:
+            tmp_file.write(chunk)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _save_checkpoint(path: str, header: bytes, depth: int,
+                     visited: bytearray, table: bytearray,
+                     frontier: array.array):
+    _write_atomic(path, [header, struct.pack('<IQ', depth, len(frontier)),
+                         frontier.tobytes(), table, visited])
+
+
+def _load_checkpoint(path: str, header: bytes, visited_size: int,
+                     table_size: int):
+    ''' Results:
+        (depth, visited, table, frontier) or None if there is nothing
+        to resume from
+    '''
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as checkpoint_file:
+        if checkpoint_file.read(HEADER_SIZE) != header:
+            return None
+        depth, frontier_len = struct.unpack('<IQ', checkpoint_file.read(12))
+        frontier = array.array('Q')
+        frontier.fromfile(checkpoint_file, frontier_len)
+        table = bytearray(checkpoint_file.read(table_size))
+        visited = bytearray(checkpoint_file.read(visited_size))
+    if len(table) != table_size or len(visited) != visited_size:
+        return None
+    return depth, visited, table, frontier
+
+
+def build_pattern_table(size: int, tiles: t.Sequence[int], path: str,
+                        progress: t.Optional[t.Callable[[int, int], None]]
+                        = None):
+    ''' Breadth-first search over abstract states: the group tile
+    positions plus the empty space position. Moving a group tile costs 1,
+    moving any other tile costs 0, so every layer is closed under the free
+    moves before the next one starts.
+    The search state is saved after every layer to path + '.partial',
+    an interrupted build continues from there. The search order is fixed,
+    so the same arguments always produce the same file.
+    Handler progress gets the finished depth and the reached state count
+    '''
+    cell_count = size * size
+    assert(all(0 < tile < cell_count for tile in tiles))
+    assert(len(set(tiles)) == len(tiles))
+    bits = PuzzleBoard.bits_per_cell(size)
+    mask = (1 << bits) - 1
+    shifts = [bits * slot for slot in range(len(tiles))]
+    # Index without and with the empty space in the lowest bits
+    table_size = 1 << (bits * len(tiles))
+    visited_size = table_size << bits
+    header = _pack_header(size, tiles)
+    checkpoint_path = path + '.partial'
+    neighbors = PuzzleBoard.get_tables(size).neighbors
+
+    resumed = _load_checkpoint(checkpoint_path, header, visited_size,
+                               table_size)
+    if resumed is not None:
+        depth, visited, table, frontier = resumed
+        frontier = list(frontier)
+    else:
+        visited = bytearray([UNKNOWN]) * visited_size
+        table = bytearray([UNKNOWN]) * table_size
+        # Tile value v goes to the position v - 1
+        goal_index = 0
+        for tile, shift in zip(tiles, shifts):
+            goal_index |= (tile - 1) << shift
+        start = (goal_index << bits) | (cell_count - 1)
+        visited[start] = 0
+        depth = 0
+        frontier = [start]
+
+    while frontier:
+        next_frontier = []
+        reached = 0
+        # Free moves append to the layer being processed
+        state_idx = 0
+        while state_idx < len(frontier):
+            state = frontier[state_idx]
+            state_idx += 1
+            if visited[state] != depth:
+                # Reached for free later, already handled
+                continue
+            reached += 1
+            blank = state & mask
+            index = state >> bits
+            if table[index] == UNKNOWN:
+                table[index] = depth
+            positions = [(index >> shift) & mask for shift in shifts]
+            for pos in neighbors[blank]:
+                if pos in positions:
+                    shift = shifts[positions.index(pos)]
+                    new_state = ((index + ((blank - pos) << shift)) << bits) \
+                        | pos
+                    if visited[new_state] == UNKNOWN:
+                        visited[new_state] = depth + 1
+                        next_frontier.append(new_state)
+                else:
+                    new_state = (index << bits) | pos
+                    if visited[new_state] > depth:
+                        visited[new_state] = depth
+                        frontier.append(new_state)
+        depth += 1
+        frontier = next_frontier
+        _save_checkpoint(checkpoint_path, header, depth, visited, table,
+                         array.array('Q', frontier))
+        if progress is not None:
+            progress(depth - 1, reached)
+
+    _write_atomic(path, [header, table])
+    os.remove(checkpoint_path)
+
+
+class PatternTable():
+    ''' Memory-mapped table of one pattern.
+    The pages are shared by all processes using the same file
+    '''
+    def __init__(self, path: str):
+        with open(path, 'rb') as table_file:
+            self.mapping = mmap.mmap(table_file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        magic, version, size, tile_count = struct.unpack_from(
+            HEADER_FORMAT, self.mapping)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a pattern database")
+        tiles_offset = struct.calcsize(HEADER_FORMAT)
+        self.size = size
+        self.tiles = tuple(self.mapping[tiles_offset:
+                                        tiles_offset + tile_count])
+        bits = PuzzleBoard.bits_per_cell(size)
+        expected_len = HEADER_SIZE + (1 << (bits * tile_count))
+        if len(self.mapping) != expected_len:
+            raise ValueError(f"{path} is truncated")
+        # Slicing from the offset would copy, so the offset is
+        # added to the index instead
+        self.offset = HEADER_SIZE
+
+    def lookup(self, index: int) -> int:
+        return self.mapping[self.offset + index]
+
+    def close(self):
+        self.mapping.close()
+
+
+class PatternDatabase():
+    ''' Disjoint patterns covering all tiles of the board.
+    The heuristic value is the sum of the pattern values
+    '''
+    def __init__(self, size: int, tables: t.List[PatternTable]):
+        self.size = size
+        self.tables = tables
+        cell_count = size * size
+        bits = PuzzleBoard.bits_per_cell(size)
+        # Which pattern the tile belongs to and where its position
+        # is stored in the pattern index
+        self.tile_pattern = [-1] * cell_count
+        self.tile_shift = [0] * cell_count
+        for pattern_idx, table in enumerate(tables):
+            assert(table.size == size)
+            for slot, tile in enumerate(table.tiles):
+                assert(self.tile_pattern[tile] == -1)
+                self.tile_pattern[tile] = pattern_idx
+                self.tile_shift[tile] = bits * slot
+        assert(all(pattern_idx >= 0
+                   for pattern_idx in self.tile_pattern[1:]))
+        # Entry offsets are included in the index
+        # so the search does one memory access per lookup
+        self.offsets = [table.offset for table in tables]
+        self.mappings = [table.mapping for table in tables]
+
+    def index_board(self, board: t.List[int]) -> t.List[int]:
+        ''' Table indices of every pattern for the flat board,
+        the table offsets included
+        '''
+        indices = list(self.offsets)
+        for pos, val in enumerate(board):
+            if val != 0:
+                indices[self.tile_pattern[val]] += pos << self.tile_shift[val]
+        return indices
+
+    def heuristic(self, board: t.List[int]) -> int:
+        return sum(mapping[index] for mapping, index
+                   in zip(self.mappings, self.index_board(board)))
+
+    def close(self):
+        for table in self.tables:
+            table.close()
+
+
+def build_database(size: int = 4,
+                   partition: t.Sequence[t.Sequence[int]] = DEFAULT_PARTITION,
+                   directory: str = DEFAULT_DIRECTORY,
+                   progress: t.Optional[t.Callable[[str, int, int], None]]
+                   = None):
+    ''' Build the missing tables of the partition.
+    Finished tables are kept, so the build can be restarted any time
+    '''
+    os.makedirs(directory, exist_ok=True)
+    for tiles in partition:
+        path = os.path.join(directory, pattern_filename(size, tiles))
+        if os.path.exists(path):
+            continue
+        pattern_progress = None
+        if progress is not None:
+            def pattern_progress(depth, reached, path=path):
+                progress(path, depth, reached)
+        build_pattern_table(size, tiles, path, pattern_progress)
+
+
+def load_database(size: int = 4,
+                  partition: t.Sequence[t.Sequence[int]] = DEFAULT_PARTITION,
+                  directory: str = DEFAULT_DIRECTORY) \
+        -> t.Optional[PatternDatabase]:
+    ''' Map the built tables.
+    Results:
+        The database or None if some table was not built
+    '''
+    paths = [os.path.join(directory, pattern_filename(size, tiles))
+             for tiles in partition]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    return PatternDatabase(size, [PatternTable(path) for path in paths])
+
+
+def parse_partition(text: str) -> t.List[t.List[int]]:
+    ''' "1,2,3/4,5,6" -> [[1, 2, 3], [4, 5, 6]]
+    '''
+    return [[int(tile) for tile in group.split(',')]
+            for group in text.split('/')]
+
+
+def main(argv: t.Optional[t.List[str]] = None):
+    # Solver workers import this module, only the builder needs argparse
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Build the additive pattern database for the puzzle')
+    parser.add_argument('--size', type=int, default=4)
+    parser.add_argument('--partition', type=parse_partition, default=None,
+                        help='tile groups, e.g. "1,2,3,5,6/4,7,8,11,12/..."')
+    parser.add_argument('--directory', default=DEFAULT_DIRECTORY)
+    args = parser.parse_args(argv)
+    partition = args.partition
+    if partition is None:
+        if args.size != 4:
+            parser.error('--partition is required for this size')
+        partition = DEFAULT_PARTITION
+
+    def report(path, depth, reached):
+        print(f"{os.path.basename(path)}: depth {depth}, {reached} states",
+              file=sys.stderr)
+
+    build_database(args.size, partition, args.directory, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import time
+import typing as t
+
+import PuzzleBoard
+
+# The solver works with the same board layout as the game:
+# a square board in row-major order, 0 marks the empty space,
+# and the goal is 1, 2, ..., N*N - 1 with the empty space last
+
+# A move is the (row, column) of the cell the player clicks on,
+# i.e. the cell that slides into the empty space
+Move = t.Tuple[int, int]
+
+# Returned by the search when the goal was reached
+FOUND = -1
+# The time budget is checked once per this many nodes
+TIME_CHECK_NODES = 4096
+
+# Solve statuses
+SOLVED = 'solved'
+UNSOLVABLE = 'unsolvable'
+BUDGET_EXCEEDED = 'budget_exceeded'
+
+
+class SolveResult(t.NamedTuple):
+    # None if the board is unsolvable or the budget ran out
+    moves: t.Optional[t.List[Move]]
+    nodes_expanded: int
+    status: str = SOLVED
+
+
+def flatten_cells(cells: t.List[t.List[int]]) -> t.List[int]:
+    ''' Convert the game cells (list of rows) to a flat board
+    '''
+    return [val for cell_row in cells for val in cell_row]
+
+
+def is_solvable(board: t.List[int], size: int) -> bool:
+    ''' Check the permutation parity of the flat board.
+    The goal has the empty space in the bottom right corner
+    '''
+    assert(len(board) == size * size)
+    # The inversion count has the parity of the permutation
+    parity = PuzzleBoard.permutation_parity([val for val in board
+                                             if val != 0])
+    if size % 2 == 1:
+        return parity == 0
+    # For even sizes the row of the empty space counts as well
+    empty_row = board.index(0) // size
+    return (parity + size - 1 - empty_row) % 2 == 0
+
+
+def _longest_increasing_len(values: t.List[int]) -> int:
+    ''' The line has at most N values, so the quadratic version will do
+    '''
+    best = [1] * len(values)
+    for idx in range(len(values)):
+        for prev_idx in range(idx):
+            if values[prev_idx] < values[idx] and best[prev_idx] >= best[idx]:
+                best[idx] = best[prev_idx] + 1
+    return max(best, default=0)
+
+
+class IDAStarSolver():
+    ''' Finds the optimal solution with IDA*.
+    The heuristic is the Manhattan distance plus linear conflicts.
+    The search changes one board in place and undoes every move,
+    both heuristic parts are updated incrementally.
+    With the pattern database (see PuzzlePatternDB) its additive value
+    is used instead
+    '''
+    def __init__(self, size: int, node_limit: t.Optional[int] = None,
+                 pattern_db=None, time_limit: t.Optional[float] = None):
+        ''' Limits are the budget of one solve() call:
+        expanded nodes and seconds
+        '''
+        self.size = size
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.deadline = None
+        # Set by cancel() from another thread
+        self.is_cancelled = False
+        self.pattern_db = pattern_db
+        if pattern_db is not None:
+            assert(pattern_db.size == size)
+        self.nodes_expanded = 0
+        cell_count = size * size
+        # Goal position of every value, the empty space goes last
+        goal_pos = [cell_count - 1] + list(range(cell_count - 1))
+        # Manhattan distance of the value standing at the position
+        self.distance = [[0] * cell_count for _ in range(cell_count)]
+        for val in range(1, cell_count):
+            for pos in range(cell_count):
+                self.distance[val][pos] = \
+                    abs(pos // size - goal_pos[val] // size) + \
+                    abs(pos % size - goal_pos[val] % size)
+        self.goal_pos = goal_pos
+        # Positions the empty space can go to
+        self.neighbors = PuzzleBoard.get_tables(size).neighbors
+        # Conflict values depend only on the line contents,
+        # so cache them for every row and column separately
+        self.row_cache = [{} for _ in range(size)]
+        self.column_cache = [{} for _ in range(size)]
+
+    def row_conflicts(self, board: t.List[int], row: int) -> int:
+        line = tuple(board[row * self.size:(row + 1) * self.size])
+        cache = self.row_cache[row]
+        conflicts = cache.get(line)
+        if conflicts is None:
+            # Tiles that belong to this row, in their goal order
+            goal_columns = [self.goal_pos[val] % self.size for val in line
+                            if val != 0
+                            and self.goal_pos[val] // self.size == row]
+            conflicts = 2 * (len(goal_columns) -
+                             _longest_increasing_len(goal_columns))
+            cache[line] = conflicts
+        return conflicts
+
+    def column_conflicts(self, board: t.List[int], column: int) -> int:
+        line = tuple(board[column::self.size])
+        cache = self.column_cache[column]
+        conflicts = cache.get(line)
+        if conflicts is None:
+            goal_rows = [self.goal_pos[val] // self.size for val in line
+                         if val != 0
+                         and self.goal_pos[val] % self.size == column]
+            conflicts = 2 * (len(goal_rows) -
+                             _longest_increasing_len(goal_rows))
+            cache[line] = conflicts
+        return conflicts
+
+    def heuristic(self, board: t.List[int]) -> int:
+        ''' Full (non-incremental) heuristic value of the board
+        '''
+        value = sum(self.distance[val][pos] for pos, val in enumerate(board))
+        for line_idx in range(self.size):
+            value += self.row_conflicts(board, line_idx)
+            value += self.column_conflicts(board, line_idx)
+        return value
+
+    def solve(self, board: t.List[int]) -> SolveResult:
+        ''' Find the shortest move sequence for the flat board.
+        The board is left unchanged
+        '''
+        size = self.size
+        assert(len(board) == size * size)
+        self.nodes_expanded = 0
+        if self.time_limit is not None:
+            self.deadline = time.perf_counter() + self.time_limit
+        # Checked after the deadline is set: a cancel() coming
+        # in between is seen either here or by the deadline check
+        if self.is_cancelled:
+            return SolveResult(moves=None, nodes_expanded=0,
+                               status=BUDGET_EXCEEDED)
+        if not is_solvable(board, size):
+            return SolveResult(moves=None, nodes_expanded=0,
+                               status=UNSOLVABLE)
+        board = list(board)
+        path = []
+        if self.pattern_db is not None:
+            search, h = self.pattern_db_search(board, path)
+        else:
+            search, h = self.linear_conflict_search(board, path)
+        blank = board.index(0)
+        bound = h
+        try:
+            while True:
+                result = search(blank, -1, 0, h, bound)
+                if result == FOUND:
+                    break
+                if result is None:
+                    # No moves at all, only possible on 1x1 board
+                    return SolveResult(moves=None,
+                                       nodes_expanded=self.nodes_expanded,
+                                       status=UNSOLVABLE)
+                bound = result
+        except _BudgetExceeded:
+            return SolveResult(moves=None, nodes_expanded=self.nodes_expanded,
+                               status=BUDGET_EXCEEDED)
+        moves = [divmod(pos, size) for pos in path]
+        return SolveResult(moves=moves, nodes_expanded=self.nodes_expanded)
+
+    def cancel(self):
+        ''' Stop solve() running in another thread, it returns
+        as if the budget ran out. The search notices it only
+        with the time budget set, by the next time check
+        '''
+        self.is_cancelled = True
+        self.deadline = 0.0
+
+    def count_node(self):
+        self.nodes_expanded += 1
+        if self.node_limit is not None and \
+           self.nodes_expanded > self.node_limit:
+            raise _BudgetExceeded()
+        if self.deadline is not None and \
+           self.nodes_expanded % TIME_CHECK_NODES == 0 and \
+           time.perf_counter() > self.deadline:
+            raise _BudgetExceeded()
+
+    def linear_conflict_search(self, board: t.List[int], path: t.List[int]):
+        ''' The depth-first search with the Manhattan distance
+        and linear conflicts
+        Results:
+            The search function and the heuristic value of the board
+        '''
+        size = self.size
+        distance = self.distance
+        neighbors = self.neighbors
+        row_lc = [self.row_conflicts(board, row) for row in range(size)]
+        column_lc = [self.column_conflicts(board, column)
+                     for column in range(size)]
+        row_conflicts = self.row_conflicts
+        column_conflicts = self.column_conflicts
+        count_node = self.count_node
+
+        def search(blank: int, prev_blank: int, g: int, h: int,
+                   bound: int) -> int:
+            f = g + h
+            if f > bound:
+                return f
+            if h == 0:
+                return FOUND
+            count_node()
+            min_exceeding = None
+            for pos in neighbors[blank]:
+                if pos == prev_blank:
+                    continue
+                # Slide the tile from pos to the empty space
+                val = board[pos]
+                board[blank] = val
+                board[pos] = 0
+                new_h = h + distance[val][blank] - distance[val][pos]
+                if pos // size == blank // size:
+                    # Horizontal move: the tile changes its column
+                    lc, update = column_lc, column_conflicts
+                    first, second = pos % size, blank % size
+                else:
+                    lc, update = row_lc, row_conflicts
+                    first, second = pos // size, blank // size
+                old_first, old_second = lc[first], lc[second]
+                lc[first] = update(board, first)
+                lc[second] = update(board, second)
+                new_h += lc[first] + lc[second] - old_first - old_second
+                path.append(pos)
+                result = search(pos, blank, g + 1, new_h, bound)
+                if result == FOUND:
+                    return FOUND
+                path.pop()
+                # Undo the move
+                lc[first], lc[second] = old_first, old_second
+                board[pos] = val
+                board[blank] = 0
+                if min_exceeding is None or result < min_exceeding:
+                    min_exceeding = result
+            return min_exceeding
+
+        return search, self.heuristic(board)
+
+    def pattern_db_search(self, board: t.List[int], path: t.List[int]):
+        ''' The depth-first search with the additive pattern database.
+        A move changes the index of one pattern only
+        Results:
+            The search function and the heuristic value of the board
+        '''
+        neighbors = self.neighbors
+        pattern_db = self.pattern_db
+        tile_pattern = pattern_db.tile_pattern
+        tile_shift = pattern_db.tile_shift
+        mappings = pattern_db.mappings
+        indices = pattern_db.index_board(board)
+        count_node = self.count_node
+
+        def search(blank: int, prev_blank: int, g: int, h: int,
+                   bound: int) -> int:
+            f = g + h
+            if f > bound:
+                return f
+            if h == 0:
+                return FOUND
+            count_node()
+            min_exceeding = None
+            for pos in neighbors[blank]:
+                if pos == prev_blank:
+                    continue
+                val = board[pos]
+                pattern = tile_pattern[val]
+                mapping = mappings[pattern]
+                old_index = indices[pattern]
+                new_index = old_index + ((blank - pos) << tile_shift[val])
+                new_h = h - mapping[old_index] + mapping[new_index]
+                board[blank] = val
+                board[pos] = 0
+                indices[pattern] = new_index
+                path.append(pos)
+                result = search(pos, blank, g + 1, new_h, bound)
+                if result == FOUND:
+                    return FOUND
+                path.pop()
+                # Undo the move
+                indices[pattern] = old_index
+                board[pos] = val
+                board[blank] = 0
+                if min_exceeding is None or result < min_exceeding:
+                    min_exceeding = result
+            return min_exceeding
+
+        return search, pattern_db.heuristic(board)
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+def solve(cells: t.List[t.List[int]],
+          node_limit: t.Optional[int] = None,
+          pattern_db=None) -> t.Optional[t.List[Move]]:
+    ''' Optimal solution for the game cells (list of rows).
+    Results:
+        Cells to click on one after another,
+        or None if the board can't be solved
+    '''
+    solver = IDAStarSolver(len(cells), node_limit=node_limit,
+                           pattern_db=pattern_db)
+    return solver.solve(flatten_cells(cells)).moves
+
+
+def hint(cells: t.List[t.List[int]],
+         pattern_db=None) -> t.Optional[Move]:
+    ''' The first move of an optimal solution
+    '''
+    moves = solve(cells, pattern_db=pattern_db)
+    if not moves:
+        return None
+    return moves[0]
@@ -0,0 +1,128 @@
+''' Spatial index over the figure bounding boxes.
+
+The canvas area is split into square cells. A figure is stored in every
+cell its box touches, so a point query looks into one cell and a
+rectangle query into the cells the rectangle covers, whatever the number
+of figures. Figures are identified by their keys, the caller decides
+which of the found figures is on top.
+'''
+import math
+import typing as t
+
+# Side of a grid cell in canvas units
+GRID_CELL_SIZE = 64
+# Figures covering more cells are kept in a separate list,
+# so a huge figure doesn't fill thousands of cells
+MAX_FIGURE_CELLS = 256
+
+# Left, top, right, bottom
+BoundingBox = t.Tuple[float, float, float, float]
+
+
+def normalized_box(coords: t.Sequence[float]) -> BoundingBox:
+    ''' The box of two corner points given in any order
+    '''
+    return (min(coords[0], coords[2]), min(coords[1], coords[3]),
+            max(coords[0], coords[2]), max(coords[1], coords[3]))
+
+
+def boxes_intersect(first: BoundingBox, second: BoundingBox) -> bool:
+    return first[0] <= second[2] and second[0] <= first[2] and \
+        first[1] <= second[3] and second[1] <= first[3]
+
+
+class GridIndex():
+    ''' Uniform grid over the figure bounding boxes.
+    A figure is registered in every cell its box touches,
+    so a point query looks into one cell only
+    '''
+    def __init__(self, cell_size: float = GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        # Cell (column, row) -> keys of the figures touching it
+        self.cells: t.Dict[t.Tuple[int, int], t.Set[int]] = {}
+        self.boxes: t.Dict[int, BoundingBox] = {}
+        self.large_figures: t.Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.boxes
+
+    def cell_range(self, box: BoundingBox) \
+            -> t.Tuple[int, int, int, int]:
+        return (math.floor(box[0] / self.cell_size),
+                math.floor(box[1] / self.cell_size),
+                math.floor(box[2] / self.cell_size),
+                math.floor(box[3] / self.cell_size))
+
+    def insert(self, key: int, box: BoundingBox):
+        assert(key not in self.boxes)
+        self.boxes[key] = box
+        first_column, first_row, last_column, last_row = self.cell_range(box)
+        if (last_column - first_column + 1) * (last_row - first_row + 1) > \
+           MAX_FIGURE_CELLS:
+            self.large_figures.add(key)
+            return
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                cell = self.cells.get((column, row))
+                if cell is None:
+                    cell = set()
+                    self.cells[(column, row)] = cell
+                cell.add(key)
+
+    def remove(self, key: int):
+        box = self.boxes.pop(key, None)
+        if box is None:
+            return
+        if key in self.large_figures:
+            self.large_figures.discard(key)
+            return
+        first_column, first_row, last_column, last_row = self.cell_range(box)
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                cell = self.cells[(column, row)]
+                cell.discard(key)
+                if not cell:
+                    del self.cells[(column, row)]
+
+    def update(self, key: int, box: BoundingBox):
+        if self.boxes.get(key) == box:
+            return
+        self.remove(key)
+        self.insert(key, box)
+
+    def query_point(self, point_x: float, point_y: float) -> t.List[int]:
+        ''' Keys of the figures whose boxes contain the point
+        '''
+        cell = self.cells.get((math.floor(point_x / self.cell_size),
+                               math.floor(point_y / self.cell_size)), ())
+        found = []
+        for key in list(cell) + list(self.large_figures):
+            box = self.boxes[key]
+            if box[0] <= point_x <= box[2] and box[1] <= point_y <= box[3]:
+                found.append(key)
+        return found
+
+    def query_box(self, box: BoundingBox) -> t.Set[int]:
+        ''' Keys of the figures whose boxes intersect the box
+        '''
+        found = set()
+        first_column, first_row, last_column, last_row = self.cell_range(box)
+        if (last_column - first_column + 1) * (last_row - first_row + 1) > \
+           len(self.cells):
+            # The box is larger than the occupied area, walk the cells
+            candidates = (key for cell in self.cells.values() for key in cell)
+        else:
+            candidates = (key
+                          for column in range(first_column, last_column + 1)
+                          for row in range(first_row, last_row + 1)
+                          for key in self.cells.get((column, row), ()))
+        for key in candidates:
+            if key not in found and boxes_intersect(self.boxes[key], box):
+                found.add(key)
+        for key in self.large_figures:
+            if boxes_intersect(self.boxes[key], box):
+                found.add(key)
+        return found
@@ -0,0 +1,771 @@
+''' Figure text format.
+
+Every line describes one figure:
+
+    oval <10.0 20.0 110.0 70.0> 1.0 #000000 #ffffff
+    rectangle <10.0 20.0 110.0 70.0> 2.0 #000000 #ffff00
+    polygon <0.0 0.0 50.0 0.0 25.0 40.0> 1.0 #000000 #00ff00
+    line <0.0 0.0 100.0 100.0> 3.0 #ff0000
+    text <10.0 10.0> 12.0 #000000 "Some words"
+
+The type name, the points in angle brackets, then the type parameters.
+A line is cut into these parts with str.partition, so parsing never
+backtracks. New figure types are added with register_figure_type,
+parsing and printing both go through the registry.
+
+parse_document reads the oval and rectangle lines in columns with NumPy.
+That is fast for the numbers text_from_figure writes: plain decimals
+like -12.5 of up to 19 digits (15 where NumPy has no x87 extended
+precision). Other numbers, such as 1e-05 or longer decimals, are read
+several times slower, and other figure types are parsed line by line.
+The result is the same either way, run this module to check it:
+
+    python FigureParser.py --lines 100000
+'''
+import argparse
+import itertools
+import math
+import random
+import re
+import sys
+import time
+import typing as t
+
+import numpy as np
+
+
+class FigureInfo(t.NamedTuple):
+    figure_type: str
+    # Points coordinates, x and y of every point.
+    # Ovals and rectangles have two points: the opposite corners
+    coords: t.List[float]
+    border_size: float
+    border_color: str
+    fill_color: str
+    # Only the text figures have it
+    text: str = ''
+
+
+class ParseError(t.NamedTuple):
+    # Numbered from 1, like the text widget lines
+    line_idx: int
+    # Where the invalid part of the line starts
+    column: int
+    message: str
+
+
+class FigureSyntaxError(ValueError):
+    pass
+
+
+class FigureType(t.NamedTuple):
+    name: str
+    min_points: int
+    # None if any number of points is accepted
+    max_points: t.Optional[int]
+    # Text after the points -> (border_size, border_color, fill_color, text),
+    # raises FigureSyntaxError
+    parse_params: t.Callable[[str], t.Tuple[float, str, str, str]]
+    # Figure -> the text after the points
+    format_params: t.Callable[[FigureInfo], str]
+
+
+COLOR_PATTERN = re.compile('#[0-9a-f]{6}')
+
+FIGURE_TYPES: t.Dict[str, FigureType] = {}
+# Colors seen so far. Drawings use few colors, so most of them
+# are checked with one lookup and all figures share the same strings
+_known_colors: t.Dict[str, str] = {}
+_new_figure = tuple.__new__
+# Text is parsed in columns by pieces of about this many bytes
+PARSE_PART_SIZE = 1 << 18
+# Figures parsed in columns are made by this many lines at once
+ITER_LINES = 1 << 14
+COLOR_LENGTH = len('#000000')
+# Longer type names are parsed line by line
+MAX_TYPE_NAME_LENGTH = 16
+# Byte kinds of the lines parsed in columns
+KIND_NEWLINE = 1
+KIND_OPEN = 2
+KIND_CLOSE = 3
+KIND_COLOR = 4
+KIND_SPACE = 5
+KIND_OTHER_SPACE = 6
+BYTE_KINDS = np.zeros(256, dtype=np.uint8)
+BYTE_KINDS[ord('\n')] = KIND_NEWLINE
+BYTE_KINDS[ord('<')] = KIND_OPEN
+BYTE_KINDS[ord('>')] = KIND_CLOSE
+BYTE_KINDS[ord('#')] = KIND_COLOR
+BYTE_KINDS[ord(' ')] = KIND_SPACE
+for _space in '\t\r\x0b\x0c':
+    BYTE_KINDS[ord(_space)] = KIND_OTHER_SPACE
+# Besides '<' and '>' the special bytes are all up to '#'.
+# Other bytes found there get kind 0, so their lines are not fast
+LAST_SPECIAL_LOW_BYTE = ord('#')
+# 'oval <1.0 2.0 3.0 4.0> 1.0 #000000 #ffffff\n'
+FAST_LINE_KINDS = np.array([KIND_SPACE, KIND_OPEN, KIND_SPACE, KIND_SPACE,
+                            KIND_SPACE, KIND_CLOSE, KIND_SPACE, KIND_SPACE,
+                            KIND_COLOR, KIND_SPACE, KIND_COLOR, KIND_NEWLINE],
+                           dtype=np.uint8)
+# Four coordinates and the border size
+FAST_LINE_NUMBERS = 5
+# Positions of the specials the numbers of the line start after
+# and end at
+NUMBER_STARTS = [1, 2, 3, 4, 6]
+NUMBER_ENDS = [2, 3, 4, 5, 7]
+# Decimals are exact integers divided by an exact power of ten.
+# The x87 extended precision holds 64-bit integers, so decimals of up to
+# 19 digits (all that repr writes) are divided there and rounded
+# to double once more. That second rounding differs from float() only
+# for the quotients exactly halfway between two doubles: the 11 bits
+# of the extended mantissa that the double drops are 10000000000.
+# These are left to parse_numbers. Without the extended precision
+# the digits must fit the double mantissa to be rounded once
+IS_EXTENDED_PRECISION = np.finfo(np.longdouble).nmant == 63 and \
+    np.dtype(np.longdouble).itemsize == 16 and sys.byteorder == 'little'
+DECIMAL_FLOAT = np.longdouble if IS_EXTENDED_PRECISION else np.float64
+MAX_DECIMAL_DIGITS = 19 if IS_EXTENDED_PRECISION else 15
+MAX_DECIMAL_LENGTH = MAX_DECIMAL_DIGITS + len('-.')
+# Digits are put together by four, so a number takes whole fours of rows
+DECIMAL_ROWS = -(-MAX_DECIMAL_LENGTH // 4) * 4
+# Up to 10**22 the powers are exact doubles
+POWERS_OF_TEN = (10.0 ** np.arange(MAX_DECIMAL_DIGITS + 1)).astype(
+    DECIMAL_FLOAT)
+DOUBLE_DROPPED_BITS = np.uint64(0x7ff)
+HALFWAY_DROPPED_BITS = np.uint64(0x400)
+# The digit value of the dot byte
+DOT_DIGIT = np.uint8((ord('.') - ord('0')) % 256)
+# The line bytes are padded on both sides to read the fixed-length
+# parts around them
+PADDING_LENGTH = max(MAX_TYPE_NAME_LENGTH, DECIMAL_ROWS)
+
+
+def register_figure_type(figure_type: FigureType):
+    FIGURE_TYPES[figure_type.name] = figure_type
+
+
+def parse_size(text: str) -> float:
+    try:
+        size = float(text)
+    except ValueError:
+        raise FigureSyntaxError(f"{text} is not a number")
+    # Also rejects nan
+    if not 0 <= size < math.inf:
+        raise FigureSyntaxError(f"{text} is not a size")
+    return size
+
+
+def parse_color(text: str) -> str:
+    color = _known_colors.get(text)
+    if color is None:
+        if COLOR_PATTERN.fullmatch(text) is None:
+            raise FigureSyntaxError(f"{text} is not a color")
+        color = _known_colors.setdefault(text, text)
+    return color
+
+
+def parse_outlined_params(params: str) -> t.Tuple[float, str, str, str]:
+    ''' Border size, border color, fill color
+    '''
+    values = params.split()
+    if len(values) != 3:
+        raise FigureSyntaxError("expected border size and two colors")
+    return (parse_size(values[0]), parse_color(values[1]),
+            parse_color(values[2]), '')
+
+
+def format_outlined_params(figure: FigureInfo) -> str:
+    return f"{figure.border_size} {figure.border_color} {figure.fill_color}"
+
+
+def parse_line_params(params: str) -> t.Tuple[float, str, str, str]:
+    ''' Width, color
+    '''
+    values = params.split()
+    if len(values) != 2:
+        raise FigureSyntaxError("expected width and color")
+    return parse_size(values[0]), parse_color(values[1]), '', ''
+
+
+def format_line_params(figure: FigureInfo) -> str:
+    return f"{figure.border_size} {figure.border_color}"
+
+
+def parse_text_params(params: str) -> t.Tuple[float, str, str, str]:
+    ''' Font size, color, the text in double quotes
+    '''
+    values = params.split(None, 2)
+    if len(values) != 3:
+        raise FigureSyntaxError("expected font size, color and text")
+    text = values[2].rstrip()
+    if len(text) < 2 or text[0] != '"' or text[-1] != '"':
+        raise FigureSyntaxError("the text must be in double quotes")
+    return parse_size(values[0]), parse_color(values[1]), '', text[1:-1]
+
+
+def format_text_params(figure: FigureInfo) -> str:
+    return f"{figure.border_size} {figure.border_color} \"{figure.text}\""
+
+
+register_figure_type(FigureType("oval", 2, 2, parse_outlined_params,
+                                format_outlined_params))
+register_figure_type(FigureType("rectangle", 2, 2, parse_outlined_params,
+                                format_outlined_params))
+register_figure_type(FigureType("polygon", 3, None, parse_outlined_params,
+                                format_outlined_params))
+register_figure_type(FigureType("line", 2, None, parse_line_params,
+                                format_line_params))
+register_figure_type(FigureType("text", 1, 1, parse_text_params,
+                                format_text_params))
+
+
+def parse_figure(line: str) -> FigureInfo:
+    ''' Raises:
+        FigureSyntaxError with the column of the invalid part
+        as the second argument
+    '''
+    head, bracket, rest = line.partition('<')
+    coords_text, closing_bracket, params = rest.partition('>')
+    figure_type = FIGURE_TYPES.get(head.strip())
+    if figure_type is None or not closing_bracket:
+        name = head.split(None, 1)[0] if head.strip() else ''
+        if name not in FIGURE_TYPES:
+            raise FigureSyntaxError("unknown figure type",
+                                    len(head) - len(head.lstrip()))
+        raise FigureSyntaxError("expected points in angle brackets",
+                                len(head) - len(head.lstrip()) + len(name))
+    try:
+        coords = list(map(float, coords_text.split()))
+    except ValueError:
+        raise FigureSyntaxError("point coordinate is not a number",
+                                len(head) + 1)
+    # float() takes inf and nan, no figure can be drawn or indexed there
+    if not all(map(math.isfinite, coords)):
+        raise FigureSyntaxError("point coordinate is not finite",
+                                len(head) + 1)
+    point_count = len(coords) // 2
+    if len(coords) % 2 != 0 or point_count < figure_type.min_points or \
+       (figure_type.max_points is not None and
+            point_count > figure_type.max_points):
+        raise FigureSyntaxError("wrong number of points", len(head) + 1)
+    try:
+        border_size, border_color, fill_color, text = \
+            figure_type.parse_params(params)
+    except FigureSyntaxError as error:
+        raise FigureSyntaxError(error.args[0], len(line) - len(params))
+    # The generated __new__ of the named tuple is a Python function,
+    # skipping it makes parsing noticeably faster
+    return _new_figure(FigureInfo, (figure_type.name, coords, border_size,
+                                    border_color, fill_color, text))
+
+
+def figure_from_text(line: str) -> t.Optional[FigureInfo]:
+    try:
+        return parse_figure(line)
+    except FigureSyntaxError:
+        return None
+
+
+def text_from_figure(figure: FigureInfo) -> str:
+    ''' Print a figure to the text
+    '''
+    coords_text = ' '.join(str(coord) for coord in figure.coords)
+    params = FIGURE_TYPES[figure.figure_type].format_params(figure)
+    return f"{figure.figure_type} <{coords_text}> {params}"
+
+
+def name_code(names: t.List[str], codes: t.Dict[str, int],
+              name: str) -> int:
+    ''' Number of the name in names, the new names are appended.
+    Colors and type names of the figure columns are stored this way
+    '''
+    code = codes.get(name)
+    if code is None:
+        code = len(names)
+        names.append(name)
+        codes[name] = code
+    return code
+
+
+class ParsedFigures(t.Sequence[t.Optional[FigureInfo]]):
+    ''' Figure of every parsed line, None for the lines without one.
+    Figures parsed together are kept in columns and made into FigureInfo
+    only when asked for, the others are kept as they are
+    '''
+    def __init__(self, line_count: int):
+        self.line_count = line_count
+        # Line -> row of the columns, -1 for the other lines
+        self.line_rows = np.full(line_count, -1, dtype=np.intp)
+        self.type_names: t.List[str] = []
+        self.type_name_codes: t.Dict[str, int] = {}
+        self.type_codes = np.zeros(0, dtype=np.uint8)
+        self.coords = np.zeros((0, 4))
+        self.border_sizes = np.zeros(0)
+        self.colors: t.List[str] = []
+        self.color_codes: t.Dict[str, int] = {}
+        self.border_colors = np.zeros(0, dtype=np.int32)
+        self.fill_colors = np.zeros(0, dtype=np.int32)
+        # Line -> figure parsed line by line
+        self.other_figures: t.Dict[int, FigureInfo] = {}
+
+    def __len__(self) -> int:
+        return self.line_count
+
+    def type_code(self, type_name: str) -> int:
+        return name_code(self.type_names, self.type_name_codes, type_name)
+
+    def color_code(self, color: str) -> int:
+        return name_code(self.colors, self.color_codes, color)
+
+    def row_figure(self, row: int) -> FigureInfo:
+        return _new_figure(FigureInfo, (
+            self.type_names[self.type_codes[row]], self.coords[row].tolist(),
+            float(self.border_sizes[row]),
+            self.colors[self.border_colors[row]],
+            self.colors[self.fill_colors[row]], ''))
+
+    def __getitem__(self, line_idx):
+        if isinstance(line_idx, slice):
+            first, end, step = line_idx.indices(len(self))
+            if step == 1:
+                return self.line_figures(first, end)
+            return [self[idx] for idx in range(first, end, step)]
+        row = self.line_rows[line_idx]
+        if row >= 0:
+            return self.row_figure(row)
+        if line_idx < 0:
+            line_idx += self.line_count
+        return self.other_figures.get(line_idx)
+
+    def line_figures(self, first: int, end: int) \
+            -> t.List[t.Optional[FigureInfo]]:
+        ''' Figures of the lines first..end-1, the columns are turned
+        into Python values for all of them at once
+        '''
+        end = min(end, self.line_count)
+        figures: t.List[t.Optional[FigureInfo]] = [None] * max(0,
+                                                               end - first)
+        rows = self.line_rows[first:end]
+        row_lines = np.flatnonzero(rows >= 0)
+        rows = rows[row_lines]
+        type_names = np.array(self.type_names, dtype=object)
+        colors = np.array(self.colors, dtype=object)
+        for line_idx, figure in zip(row_lines.tolist(), map(
+                FigureInfo._make, zip(
+                    type_names[self.type_codes[rows]].tolist(),
+                    self.coords[rows].tolist(),
+                    self.border_sizes[rows].tolist(),
+                    colors[self.border_colors[rows]].tolist(),
+                    colors[self.fill_colors[rows]].tolist(),
+                    itertools.repeat('')))):
+            figures[line_idx] = figure
+        if self.other_figures:
+            for line_idx in range(first, end):
+                figure = self.other_figures.get(line_idx)
+                if figure is not None:
+                    figures[line_idx - first] = figure
+        return figures
+
+    def __iter__(self) -> t.Iterator[t.Optional[FigureInfo]]:
+        for first in range(0, self.line_count, ITER_LINES):
+            yield from self.line_figures(first, first + ITER_LINES)
+
+    def has_figure(self) -> np.ndarray:
+        ''' Which lines have a figure
+        '''
+        mask = self.line_rows >= 0
+        mask[list(self.other_figures)] = True
+        return mask
+
+
+class ParseResult(t.NamedTuple):
+    figures: ParsedFigures
+    errors: t.List[ParseError]
+
+
+def fast_figure_types() -> t.List[FigureType]:
+    ''' Types whose lines can be parsed in columns: two points
+    and the outlined parameters
+    '''
+    return [figure_type for figure_type in FIGURE_TYPES.values()
+            if figure_type.parse_params is parse_outlined_params and
+            figure_type.min_points <= 2 and
+            (figure_type.max_points is None or figure_type.max_points >= 2)]
+
+
+def parse_numbers(data: bytes) -> t.Optional[np.ndarray]:
+    ''' Numbers separated by whitespace, None if any of them is invalid.
+    NumPy reads finite numbers just as float() does, but not all of them
+    '''
+    try:
+        return np.fromstring(data, sep=' ')
+    except ValueError:
+        return None
+
+
+def parse_line_numbers(numbers: bytes, spans: np.ndarray,
+                       first: int, end: int, values: np.ndarray,
+                       is_parsed: np.ndarray):
+    ''' Parse the numbers of the lines first..end-1 at once,
+    halve the range on an invalid number to find its line
+    '''
+    line_values = parse_numbers(numbers[spans[first, 0]:spans[end - 1, 1]])
+    if line_values is not None and \
+       len(line_values) == FAST_LINE_NUMBERS * (end - first):
+        values[first:end] = line_values.reshape(-1, FAST_LINE_NUMBERS)
+        is_parsed[first:end] = True
+    elif end - first > 1:
+        middle = (first + end) // 2
+        parse_line_numbers(numbers, spans, first, middle, values, is_parsed)
+        parse_line_numbers(numbers, spans, middle, end, values, is_parsed)
+
+
+def parse_decimals(buf: np.ndarray, starts: np.ndarray,
+                   ends: np.ndarray) -> t.Tuple[np.ndarray, np.ndarray]:
+    ''' Parse the numbers like -123.45 between the starts and ends
+    of the padded bytes, the other numbers are left to parse_numbers.
+    Results:
+        The values and which of them are parsed
+    '''
+    lengths = ends - starts
+    row_count = -(-min(int(lengths.max(initial=1)),
+                       MAX_DECIMAL_LENGTH) // 4) * 4
+    rows = np.arange(row_count, dtype=np.uint8)[:, None]
+    # The numbers are aligned to the right, one number a column:
+    # a row holds the same position of all numbers. The bytes before
+    # them and the minus sign become zeros
+    windows = np.lib.stride_tricks.sliding_window_view(buf, row_count)
+    digits = np.ascontiguousarray(windows[ends - row_count].T)
+    digits -= np.uint8(ord('0'))
+    is_minus = buf[starts] == ord('-')
+    digits *= rows >= np.clip(row_count - lengths + is_minus, 0,
+                              row_count).astype(np.uint8)
+    are_dots = digits == DOT_DIGIT
+    are_digits = digits < 10
+    dot_counts = np.add.reduce(are_dots, axis=0, dtype=np.uint8)
+    fraction_digits = np.add.reduce(
+        are_dots * (np.uint8(row_count - 1) - rows), axis=0, dtype=np.uint8)
+    digit_counts = lengths - is_minus - dot_counts
+    is_parsed = (lengths <= MAX_DECIMAL_LENGTH) & \
+        np.logical_and.reduce(are_digits | are_dots, axis=0) & \
+        (dot_counts <= 1) & (digit_counts > 0) & \
+        (digit_counts <= MAX_DECIMAL_DIGITS)
+    # The digits before the dot move into its row,
+    # so the digits of the number follow each other
+    digits *= are_digits
+    shifted = np.zeros_like(digits)
+    shifted[1:] = digits[:-1]
+    digits = np.where(rows < (np.uint8(row_count) - fraction_digits) *
+                      (dot_counts > 0), shifted, digits)
+    pairs = digits[0::2] * np.uint8(10) + digits[1::2]
+    fours = pairs[0::2].astype(np.uint16) * np.uint16(100) + pairs[1::2]
+    mantissas = fours[0].astype(np.uint64)
+    for four_idx in range(1, len(fours)):
+        mantissas *= np.uint64(10000)
+        mantissas += fours[four_idx]
+    quotients = mantissas.astype(DECIMAL_FLOAT) / POWERS_OF_TEN[
+        np.minimum(fraction_digits, MAX_DECIMAL_DIGITS)]
+    values = quotients.astype(np.float64)
+    if IS_EXTENDED_PRECISION:
+        # The low 8 bytes of the extended number are its mantissa
+        is_parsed &= quotients.view(np.uint64)[0::2] & \
+            DOUBLE_DROPPED_BITS != HALFWAY_DROPPED_BITS
+    return np.where(is_minus, -values, values), is_parsed
+
+
+class FastLines(t.NamedTuple):
+    # Parsed lines of the data piece
+    lines: np.ndarray
+    # The columns of their figures
+    type_codes: np.ndarray
+    coords: np.ndarray
+    border_sizes: np.ndarray
+    border_colors: np.ndarray
+    fill_colors: np.ndarray
+
+
+def parse_fast_lines(buf: np.ndarray, figures: ParsedFigures) -> FastLines:
+    ''' Parse the lines written by text_from_figure for the fast types
+    together, every check is done for all lines at once.
+    The bytes end with a newline. The type names and colors are added
+    to the figures
+    '''
+    # Every special byte of the lines: the newlines, the brackets,
+    # the color marks and the whitespace, in their order.
+    # '<' and '>' differ only in the bit 2, one compare finds both
+    special_positions = np.flatnonzero(
+        (buf <= LAST_SPECIAL_LOW_BYTE) | ((buf | 2) == ord('>')))
+    kinds = BYTE_KINDS[buf[special_positions]]
+    is_newline = kinds == KIND_NEWLINE
+    line_ends = special_positions[is_newline]
+    line_count = len(line_ends)
+    line_starts = np.empty(line_count, dtype=np.intp)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    # Specials of the line end at its newline
+    specials_end = np.flatnonzero(is_newline) + 1
+    specials_start = np.empty(line_count, dtype=np.intp)
+    specials_start[0] = 0
+    specials_start[1:] = specials_end[:-1]
+    lines = np.flatnonzero(specials_end - specials_start ==
+                           len(FAST_LINE_KINDS))
+    # 'type <x y x y> size #color #color' has these specials in order
+    special_idx = specials_start[lines, None] + \
+        np.arange(len(FAST_LINE_KINDS))
+    is_fast = (kinds[special_idx] == FAST_LINE_KINDS).all(axis=1)
+    lines = lines[is_fast]
+    positions = special_positions[special_idx[is_fast]]
+    (type_end, coords_start, _, _, _, coords_end, size_start, size_end,
+     border_color, _, fill_color, line_end) = positions.T
+    # Empty tokens, spaces around the colors and color lengths
+    is_fast = (coords_start == type_end + 1) & \
+        (np.diff(positions[:, 1:6], axis=1) > 1).all(axis=1) & \
+        (size_start == coords_end + 1) & (size_end > size_start + 1) & \
+        (border_color == size_end + 1) & \
+        (fill_color == border_color + COLOR_LENGTH + 1) & \
+        (line_end == fill_color + COLOR_LENGTH)
+    type_codes = np.full(len(lines), -1, dtype=np.intp)
+    padding = np.zeros(PADDING_LENGTH, dtype=np.uint8)
+    padded_buf = np.concatenate([padding, buf, padding])
+    for figure_type in fast_figure_types():
+        name = figure_type.name.encode('ascii')
+        if len(name) > MAX_TYPE_NAME_LENGTH:
+            continue
+        name_start = line_starts[lines]
+        is_type = is_fast & (type_end - name_start == len(name))
+        for char_idx, char in enumerate(name):
+            is_type &= padded_buf[PADDING_LENGTH + name_start + char_idx] == \
+                char
+        type_codes[is_type] = figures.type_code(figure_type.name)
+    fast_idx = np.flatnonzero(is_fast & (type_codes >= 0))
+    # Colors are few, each distinct one is checked once. A color
+    # and the byte after it are compared as one 8-byte number
+    color_idx = np.concatenate([border_color[fast_idx],
+                                fill_color[fast_idx]])[:, None] + \
+        np.arange(COLOR_LENGTH + 1)
+    color_keys = np.ascontiguousarray(buf[color_idx]).view(np.uint64)
+    distinct_keys, color_codes = np.unique(color_keys, return_inverse=True)
+    color_map = np.full(len(distinct_keys), -1, dtype=np.int32)
+    distinct_texts = distinct_keys.view(f'S{COLOR_LENGTH + 1}').tolist()
+    for distinct_idx, color_text in enumerate(distinct_texts):
+        try:
+            color = parse_color(color_text[:COLOR_LENGTH].decode('ascii'))
+        except (UnicodeDecodeError, FigureSyntaxError):
+            continue
+        color_map[distinct_idx] = figures.color_code(color)
+    color_codes = color_map[color_codes.ravel()].reshape(2, -1)
+    are_colors = (color_codes >= 0).all(axis=0)
+    fast_idx = fast_idx[are_colors]
+    color_codes = color_codes[:, are_colors]
+    # Most numbers are plain decimals and parsed in columns, the lines
+    # with the others have their numbers put together, the brackets
+    # becoming the spaces between them, and read at once
+    number_starts = positions[fast_idx][:, NUMBER_STARTS] + \
+        (1 + PADDING_LENGTH)
+    number_ends = positions[fast_idx][:, NUMBER_ENDS] + PADDING_LENGTH
+    values, are_decimals = parse_decimals(padded_buf, number_starts.ravel(),
+                                          number_ends.ravel())
+    values = values.reshape(-1, FAST_LINE_NUMBERS)
+    are_numbers = are_decimals.reshape(-1, FAST_LINE_NUMBERS).all(axis=1)
+    other_idx = fast_idx[~are_numbers]
+    if len(other_idx):
+        span_starts = coords_start[other_idx]
+        span_lengths = size_end[other_idx] - span_starts
+        span_ends = np.cumsum(span_lengths)
+        spans = np.column_stack((span_ends - span_lengths, span_ends))
+        # Only the bytes of these lines are gathered
+        numbers = buf[np.arange(span_ends[-1]) +
+                      np.repeat(span_starts - spans[:, 0], span_lengths)]
+        numbers[spans[:, 0]] = ord(' ')
+        numbers[coords_end[other_idx] - span_starts + spans[:, 0]] = ord(' ')
+        other_values = np.zeros((len(other_idx), FAST_LINE_NUMBERS))
+        are_other_numbers = np.zeros(len(other_idx), dtype=bool)
+        parse_line_numbers(numbers.tobytes(), spans, 0, len(other_idx),
+                           other_values, are_other_numbers)
+        values[~are_numbers] = other_values
+        are_numbers[~are_numbers] = are_other_numbers
+    # float() takes inf and nan, parse_size rejects negative sizes
+    are_numbers &= np.isfinite(values).all(axis=1) & (values[:, 4] >= 0)
+    fast_idx = fast_idx[are_numbers]
+    values = values[are_numbers]
+    color_codes = color_codes[:, are_numbers]
+    return FastLines(lines[fast_idx], type_codes[fast_idx].astype(np.uint8),
+                     values[:, :4], values[:, 4], color_codes[0],
+                     color_codes[1])
+
+
+def parse_document(document: t.Union[str, t.Iterable[str]],
+                   first_line_idx: int = 1,
+                   part_size: int = PARSE_PART_SIZE) -> ParseResult:
+    ''' Parse the whole text or its lines.
+    Lines in the form text_from_figure writes for ovals and rectangles
+    are parsed in columns by pieces of about part_size bytes, the rest
+    line by line. Empty lines have no figure but are not errors
+    '''
+    if not isinstance(document, str):
+        document = '\n'.join(line.rstrip('\n') for line in document)
+    elif document.endswith('\n'):
+        document = document[:-1]
+    # Every line of the data ends with a newline
+    data = (document + '\n').encode('utf-8')
+    buf = np.frombuffer(data, dtype=np.uint8)
+    figures = ParsedFigures(data.count(b'\n'))
+    errors = []
+    pieces = []
+    part_start = 0
+    first_line = 0
+    while part_start < len(data):
+        part_end = data.find(b'\n', part_start + part_size - 1) + 1
+        if part_end == 0:
+            part_end = len(data)
+        part_lines = data.count(b'\n', part_start, part_end)
+        piece = parse_fast_lines(buf[part_start:part_end], figures)
+        pieces.append(piece._replace(lines=piece.lines + first_line))
+        if len(piece.lines) < part_lines:
+            is_parsed = np.zeros(part_lines, dtype=bool)
+            is_parsed[piece.lines] = True
+            lines = data[part_start:part_end].split(b'\n')
+            for part_line_idx in np.flatnonzero(~is_parsed).tolist():
+                line = lines[part_line_idx].decode('utf-8')
+                line_idx = first_line + part_line_idx
+                try:
+                    figures.other_figures[line_idx] = parse_figure(line)
+                except FigureSyntaxError as error:
+                    if line and not line.isspace():
+                        errors.append(ParseError(first_line_idx + line_idx,
+                                                 error.args[1],
+                                                 error.args[0]))
+        first_line += part_lines
+        part_start = part_end
+    # Columns of the pieces follow each other
+    fast_lines = np.concatenate([piece.lines for piece in pieces])
+    figures.line_rows[fast_lines] = np.arange(len(fast_lines))
+    figures.type_codes = np.concatenate([piece.type_codes
+                                         for piece in pieces])
+    figures.coords = np.concatenate([piece.coords for piece in pieces])
+    figures.border_sizes = np.concatenate([piece.border_sizes
+                                           for piece in pieces])
+    figures.border_colors = np.concatenate([piece.border_colors
+                                            for piece in pieces])
+    figures.fill_colors = np.concatenate([piece.fill_colors
+                                          for piece in pieces])
+    return ParseResult(figures, errors)
+
+
+def random_figure_line(rng: random.Random) -> str:
+    ''' A line of any figure type, its numbers written in the ways
+    the editor and people write them. Some lines are broken
+    '''
+    def number() -> str:
+        kind = rng.random()
+        if kind < 0.4:
+            # The editor divides by the zoom and writes repr
+            return repr(rng.uniform(-1000, 1000) / 1.25 ** rng.randint(-8, 8))
+        if kind < 0.7:
+            return repr(round(rng.uniform(-1000, 1000), rng.randint(0, 3)))
+        if kind < 0.8:
+            return str(rng.randint(-1000, 1000))
+        digits = ''.join(rng.choice('0123456789')
+                         for _ in range(rng.randint(1, 24)))
+        dot_idx = rng.randint(0, len(digits))
+        return rng.choice(['', '-', '+']) + digits[:dot_idx] + \
+            rng.choice(['.', '', 'e-5', '.e3']) + digits[dot_idx:]
+
+    def color() -> str:
+        return '#' + ''.join(rng.choice('0123456789abcdef') for _ in range(6))
+
+    figure_type = rng.choice(['oval', 'rectangle', 'oval', 'rectangle',
+                              'polygon', 'line', 'text'])
+    point_count = {'polygon': rng.randint(3, 5), 'line': rng.randint(2, 3),
+                   'text': 1}.get(figure_type, 2)
+    coords = ' '.join(number() for _ in range(2 * point_count))
+    size = repr(rng.uniform(0.5, 5)) if rng.random() < 0.9 else number()
+    params = {'line': f"{size} {color()}",
+              'text': f"{size} {color()} \"words\""}.get(
+                  figure_type, f"{size} {color()} {color()}")
+    line = f"{figure_type} <{coords}> {params}"
+    if rng.random() < 0.2:
+        chars = list(line)
+        for _ in range(rng.randint(1, 3)):
+            idx = rng.randrange(len(chars) + 1)
+            if rng.random() < 0.5 and idx < len(chars):
+                del chars[idx]
+            else:
+                chars.insert(idx, rng.choice(' <>#.-e\t\x0b\u00a0x19'))
+        line = ''.join(chars)
+    elif rng.random() < 0.05:
+        line = rng.choice(['', ' ', 'oval <inf 1 2 3> 1 #000000 #ffffff',
+                           'rectangle <1 2 3 4> nan #000000 #ffffff'])
+    return line
+
+
+def check_equivalence(line_count: int, seed: int,
+                      part_size: int = PARSE_PART_SIZE) -> bool:
+    ''' Parse a random document with parse_document and every line
+    with parse_figure, compare the figures bit for bit and the errors
+    '''
+    rng = random.Random(seed)
+    lines = [random_figure_line(rng) for _ in range(line_count)]
+    result = parse_document('\n'.join(lines), part_size=part_size)
+    expected_errors = []
+    for line_idx, (line, figure) in enumerate(zip(lines, result.figures)):
+        try:
+            expected = parse_figure(line)
+        except FigureSyntaxError as error:
+            if figure is not None:
+                return False
+            if line and not line.isspace():
+                expected_errors.append(ParseError(line_idx + 1,
+                                                  error.args[1],
+                                                  error.args[0]))
+            continue
+        # repr tells -0.0 from 0.0
+        if figure is None or repr(figure) != repr(expected):
+            return False
+    return len(result.figures) == len(lines) and \
+        result.errors == expected_errors
+
+
+def measure_throughput(line_count: int, seed: int) -> t.Tuple[float, float]:
+    ''' Results:
+        Seconds parse_document and parse_figure in a loop take to parse
+        the ovals written by the editor
+    '''
+    rng = random.Random(seed)
+    colors = ['#000000', '#ffffff', '#ff0000']
+    lines = [text_from_figure(FigureInfo(
+        'oval', [rng.uniform(0, 1000) / 1.25 ** rng.randint(-8, 8)
+                 for _ in range(4)], 1.0, rng.choice(colors),
+        rng.choice(colors))) for _ in range(line_count)]
+    document = '\n'.join(lines)
+    start = time.perf_counter()
+    parse_document(document)
+    document_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for line in lines:
+        parse_figure(line)
+    loop_time = time.perf_counter() - start
+    return document_time, loop_time
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Check and measure the document parser')
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    # Small parts put the part borders everywhere
+    for part_size in (PARSE_PART_SIZE, 64):
+        if not check_equivalence(min(args.lines, 20000), args.seed,
+                                 part_size):
+            print("parse_document differs from parse_figure")
+            return 1
+    document_time, loop_time = measure_throughput(args.lines, args.seed)
+    print(f"parse_document: {document_time:.3f} s, "
+          f"parse_figure loop: {loop_time:.3f} s, "
+          f"speedup {loop_time / document_time:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
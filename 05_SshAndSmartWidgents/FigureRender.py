@@ -0,0 +1,296 @@
+''' Render figure files to images without Tk.
+
+    python FigureRender.py drawings/ images/ --format png --jobs 4
+
+Every *.txt file of the input directory is parsed with FigureParser and
+rendered to an image of the same name in the output directory. Ovals
+and rectangles are drawn, the other figure types are skipped. The image
+covers the figures from the canvas origin, unless the size is given.
+The results are printed as JSON lines in the order the files finish.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import struct
+import time
+import typing as t
+import zlib
+
+import numpy as np
+
+from FigureParser import COLOR_PATTERN, FigureInfo, parse_document
+
+# The editor canvas color
+DEFAULT_BACKGROUND = '#854116'
+# Images larger than this are refused, so one bad file can't
+# take all the memory of a worker: 3 bytes per pixel, 96 MiB
+# for the default. There is a worker per CPU, --max-pixels changes it
+MAX_IMAGE_PIXELS = 1 << 25
+IMAGE_FORMATS = ('png', 'ppm')
+# The PNG rows are compressed in bands of about this many bytes,
+# so the image is never copied whole
+PNG_BAND_BYTES = 1 << 20
+
+
+def parse_rgb(color: str) -> t.Optional[t.Tuple[int, int, int]]:
+    ''' '#rrggbb' -> (r, g, b), None for the empty color
+    '''
+    if not color:
+        return None
+    return (int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16))
+
+
+def image_size(figures: t.Iterable[FigureInfo]) -> t.Tuple[int, int]:
+    ''' Width and height covering all figures from the origin
+    '''
+    width = height = 1
+    for figure in figures:
+        half_border = figure.border_size / 2
+        width = max(width, int(np.ceil(max(figure.coords[0::2]) +
+                                       half_border)))
+        height = max(height, int(np.ceil(max(figure.coords[1::2]) +
+                                         half_border)))
+    return width, height
+
+
+def pixel_window(image: np.ndarray, box: t.Sequence[float]) \
+        -> t.Optional[t.Tuple[slice, slice, np.ndarray, np.ndarray]]:
+    ''' Pixels whose centers may lie in the box.
+    Results:
+        (row slice, column slice, center x column, center y row)
+        or None if the box is outside the image
+    '''
+    height, width = image.shape[:2]
+    first_column = max(0, int(np.floor(box[0])))
+    first_row = max(0, int(np.floor(box[1])))
+    end_column = min(width, int(np.ceil(box[2])) + 1)
+    end_row = min(height, int(np.ceil(box[3])) + 1)
+    if first_column >= end_column or first_row >= end_row:
+        return None
+    center_x = np.arange(first_column, end_column, dtype=np.float32) + 0.5
+    center_y = np.arange(first_row, end_row, dtype=np.float32)[:, None] + 0.5
+    return (slice(first_row, end_row), slice(first_column, end_column),
+            center_x, center_y)
+
+
+def ellipse_distance(center_x: np.ndarray, center_y: np.ndarray,
+                     middle_x: float, middle_y: float,
+                     x_radius: float, y_radius: float) -> np.ndarray:
+    ''' Below 1 inside the ellipse
+    '''
+    x_distance = (center_x - middle_x) / max(x_radius, 1e-6)
+    y_distance = (center_y - middle_y) / max(y_radius, 1e-6)
+    return x_distance * x_distance + y_distance * y_distance
+
+
+def draw_oval(image: np.ndarray, figure: FigureInfo):
+    ''' The outline is centered on the ellipse inscribed in the box,
+    like on the Tk canvas
+    '''
+    left, right = sorted(figure.coords[0::2])
+    top, bottom = sorted(figure.coords[1::2])
+    half_border = figure.border_size / 2
+    window = pixel_window(image, (left - half_border, top - half_border,
+                                  right + half_border, bottom + half_border))
+    if window is None:
+        return
+    rows, columns, center_x, center_y = window
+    middle_x = (left + right) / 2
+    middle_y = (top + bottom) / 2
+    x_radius = (right - left) / 2
+    y_radius = (bottom - top) / 2
+    pixels = image[rows, columns]
+    inside = ellipse_distance(center_x, center_y, middle_x, middle_y,
+                              x_radius - half_border,
+                              y_radius - half_border) <= 1
+    fill = parse_rgb(figure.fill_color)
+    if fill is not None:
+        pixels[inside] = fill
+    outline = parse_rgb(figure.border_color)
+    if outline is not None and half_border > 0:
+        border = ellipse_distance(center_x, center_y, middle_x, middle_y,
+                                  x_radius + half_border,
+                                  y_radius + half_border) <= 1
+        pixels[border & ~inside] = outline
+
+
+def draw_rectangle(image: np.ndarray, figure: FigureInfo):
+    left, right = sorted(figure.coords[0::2])
+    top, bottom = sorted(figure.coords[1::2])
+    half_border = figure.border_size / 2
+    window = pixel_window(image, (left - half_border, top - half_border,
+                                  right + half_border, bottom + half_border))
+    if window is None:
+        return
+    rows, columns, center_x, center_y = window
+    pixels = image[rows, columns]
+    inside = ((center_x >= left + half_border) &
+              (center_x <= right - half_border)) & \
+        ((center_y >= top + half_border) & (center_y <= bottom - half_border))
+    fill = parse_rgb(figure.fill_color)
+    if fill is not None:
+        pixels[inside] = fill
+    outline = parse_rgb(figure.border_color)
+    if outline is not None and half_border > 0:
+        border = ((center_x >= left - half_border) &
+                  (center_x <= right + half_border)) & \
+            ((center_y >= top - half_border) &
+             (center_y <= bottom + half_border))
+        pixels[border & ~inside] = outline
+
+
+FIGURE_RENDERERS: t.Dict[str, t.Callable[[np.ndarray, FigureInfo], None]] = {
+    "oval": draw_oval,
+    "rectangle": draw_rectangle,
+}
+
+
+def render_figures(figures: t.Sequence[FigureInfo],
+                   size: t.Optional[t.Tuple[int, int]] = None,
+                   background: str = DEFAULT_BACKGROUND,
+                   max_pixels: int = MAX_IMAGE_PIXELS) -> np.ndarray:
+    ''' Draw the figures in their order, the later ones on top.
+    Results:
+        height x width x 3 RGB array
+    '''
+    width, height = size if size is not None else image_size(figures)
+    if width * height > max_pixels:
+        raise ValueError(f"{width}x{height} image is too large")
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = parse_rgb(background)
+    for figure in figures:
+        renderer = FIGURE_RENDERERS.get(figure.figure_type)
+        if renderer is not None:
+            renderer(image, figure)
+    return image
+
+
+def write_ppm(path: str, image: np.ndarray):
+    height, width = image.shape[:2]
+    with open(path, 'wb') as image_file:
+        image_file.write(f"P6\n{width} {height}\n255\n".encode('ascii'))
+        # The buffer is written as is, without a bytes copy
+        image_file.write(np.ascontiguousarray(image).data)
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + \
+        struct.pack('>I', zlib.crc32(kind + data))
+
+
+def write_png(path: str, image: np.ndarray):
+    ''' 8-bit RGB, no filtering: every row starts with the filter byte 0.
+    The rows go through the compressor band by band, every compressed
+    piece is its own IDAT chunk
+    '''
+    height, width = image.shape[:2]
+    row_bytes = width * 3 + 1
+    band_height = max(1, PNG_BAND_BYTES // row_bytes)
+    band = np.zeros((min(band_height, height), row_bytes), dtype=np.uint8)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    # Drawings are mostly flat colors, fast compression does well
+    compressor = zlib.compressobj(1)
+    with open(path, 'wb') as image_file:
+        image_file.write(b'\x89PNG\r\n\x1a\n')
+        image_file.write(png_chunk(b'IHDR', header))
+        for first_row in range(0, height, band_height):
+            band_rows = image[first_row:first_row + band_height]
+            rows = band[:len(band_rows)]
+            rows[:, 1:] = band_rows.reshape(len(band_rows), width * 3)
+            data = compressor.compress(rows.data)
+            if data:
+                image_file.write(png_chunk(b'IDAT', data))
+        image_file.write(png_chunk(b'IDAT', compressor.flush()))
+        image_file.write(png_chunk(b'IEND', b''))
+
+
+IMAGE_WRITERS = {'png': write_png, 'ppm': write_ppm}
+
+
+def export_file(task: t.Tuple[str, str, t.Dict[str, t.Any]]) \
+        -> t.Dict[str, t.Any]:
+    ''' Render one figure file, runs in the worker processes
+    '''
+    input_path, output_path, options = task
+    record = {'file': os.path.basename(input_path)}
+    start = time.perf_counter()
+    try:
+        with open(input_path, encoding='utf-8') as figure_file:
+            result = parse_document(figure_file.read())
+        figures = [figure for figure in result.figures if figure is not None]
+        image = render_figures(figures, options['size'],
+                               options['background'], options['max_pixels'])
+        IMAGE_WRITERS[options['format']](output_path, image)
+    # Huge coordinates overflow when the image size is computed
+    except (OSError, UnicodeDecodeError, ValueError,
+            ArithmeticError) as error:
+        record['status'] = 'error'
+        record['error'] = str(error)
+        return record
+    record['status'] = 'ok'
+    record['figures'] = len(figures)
+    record['invalid_lines'] = len(result.errors)
+    record['width'] = image.shape[1]
+    record['height'] = image.shape[0]
+    record['time'] = round(time.perf_counter() - start, 6)
+    return record
+
+
+def parse_size(text: str) -> t.Tuple[int, int]:
+    ''' "640x480" -> (640, 480)
+    '''
+    width, _, height = text.partition('x')
+    return int(width), int(height)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Render a directory of figure files to images')
+    parser.add_argument('input_directory')
+    parser.add_argument('output_directory')
+    parser.add_argument('--format', choices=IMAGE_FORMATS, default='png')
+    parser.add_argument('--size', type=parse_size, default=None,
+                        help='image size like 640x480, '
+                             'by default the figures are covered')
+    parser.add_argument('--background', default=DEFAULT_BACKGROUND,
+                        help='color like #854116')
+    parser.add_argument('--max-pixels', type=int, default=MAX_IMAGE_PIXELS,
+                        help='larger images are refused, '
+                             f'{MAX_IMAGE_PIXELS} by default')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes, all CPUs by default')
+    args = parser.parse_args(argv)
+    # Checked once here, not as the same error of every file
+    if args.size is not None and min(args.size) <= 0:
+        parser.error(f"--size {args.size[0]}x{args.size[1]} is empty")
+    if COLOR_PATTERN.fullmatch(args.background.lower()) is None:
+        parser.error(f"--background {args.background} is not a color")
+    if args.max_pixels <= 0:
+        parser.error("--max-pixels must be positive")
+
+    options = {
+        'size': args.size,
+        'background': args.background,
+        'format': args.format,
+        'max_pixels': args.max_pixels,
+    }
+    os.makedirs(args.output_directory, exist_ok=True)
+    tasks = []
+    for name in sorted(os.listdir(args.input_directory)):
+        if name.endswith('.txt'):
+            tasks.append((os.path.join(args.input_directory, name),
+                          os.path.join(args.output_directory,
+                                       f"{name[:-len('.txt')]}."
+                                       f"{args.format}"),
+                          options))
+    failed = False
+    with multiprocessing.Pool(args.jobs) as pool:
+        for record in pool.imap_unordered(export_file, tasks):
+            failed = failed or record['status'] != 'ok'
+            print(json.dumps(record), flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,566 @@
+''' Column store of the figures.
+
+Every figure takes a slot, and every figure field is a column:
+a NumPy array indexed by the slot. Colors and type names are stored
+once and referenced by their numbers. Slots of the removed figures are
+reused, the slot number is the figure key.
+
+Ovals and rectangles keep their two points in the coords column.
+Figures with another number of points keep their bounding box there
+and the points in a side table, so the box and the translation stay
+vectorized for all figures. Texts are kept in a side table too.
+
+The store lists the keys it changed, so the pyramid built on it is
+updated for them instead of being built again after every edit.
+'''
+import typing as t
+
+import numpy as np
+
+from FigureParser import FigureInfo, ParsedFigures, name_code
+
+INITIAL_CAPACITY = 1024
+# More changed keys than this are not listed, the pyramid is rebuilt
+MAX_TRACKED_CHANGES = 1 << 12
+# Pyramid cell row and column are packed to one number of these halves.
+# Farther cells are clamped to the border ones
+CELL_POSITION_BITS = 32
+CELL_POSITION_LIMIT = 1 << (CELL_POSITION_BITS - 1)
+
+
+class FigureStore():
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self.coords = np.zeros((capacity, 4))
+        self.border_sizes = np.zeros(capacity)
+        self.border_colors = np.zeros(capacity, dtype=np.int32)
+        self.fill_colors = np.zeros(capacity, dtype=np.int32)
+        self.type_codes = np.zeros(capacity, dtype=np.uint8)
+        self.alive = np.zeros(capacity, dtype=bool)
+        # Figures of the later lines have the larger orders. The editor
+        # keeps them, the store only moves them with the other columns
+        self.line_orders = np.zeros(capacity)
+        # Slot -> points of the figures without exactly two points
+        self.points: t.Dict[int, t.List[float]] = {}
+        self.texts: t.Dict[int, str] = {}
+        self.colors: t.List[str] = []
+        self.color_codes: t.Dict[str, int] = {}
+        self.type_names: t.List[str] = []
+        self.type_name_codes: t.Dict[str, int] = {}
+        # Slots below end_slot that are free
+        self.free_slots: t.List[int] = []
+        self.end_slot = 0
+        self.count = 0
+        # Changes on every change of the figures
+        self.version = 0
+        # Keys changed since take_changes, None if there are too many
+        self.changed_keys: t.Optional[t.Set[int]] = set()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, key: int) -> bool:
+        return 0 <= key < self.end_slot and bool(self.alive[key])
+
+    def __iter__(self) -> t.Iterator[int]:
+        return iter(self.keys().tolist())
+
+    def keys(self) -> np.ndarray:
+        return np.flatnonzero(self.alive[:self.end_slot])
+
+    def color_code(self, color: str) -> int:
+        return name_code(self.colors, self.color_codes, color)
+
+    def type_code(self, type_name: str) -> int:
+        code = name_code(self.type_names, self.type_name_codes, type_name)
+        assert(code <= np.iinfo(self.type_codes.dtype).max)
+        return code
+
+    def reserve(self, capacity: int):
+        ''' Grow the columns, at least doubling them
+        '''
+        old_capacity = len(self.alive)
+        if capacity <= old_capacity:
+            return
+        capacity = max(capacity, 2 * old_capacity)
+        for name in ('coords', 'border_sizes', 'border_colors',
+                     'fill_colors', 'type_codes', 'alive', 'line_orders'):
+            old_column = getattr(self, name)
+            column = np.zeros((capacity,) + old_column.shape[1:],
+                              dtype=old_column.dtype)
+            column[:old_capacity] = old_column
+            setattr(self, name, column)
+
+    def take_slots(self, count: int) -> np.ndarray:
+        first_reused = len(self.free_slots) - min(count,
+                                                  len(self.free_slots))
+        reused = self.free_slots[first_reused:]
+        del self.free_slots[first_reused:]
+        new_count = count - len(reused)
+        self.reserve(self.end_slot + new_count)
+        slots = np.concatenate([
+            np.array(reused, dtype=np.intp),
+            np.arange(self.end_slot, self.end_slot + new_count,
+                      dtype=np.intp)])
+        self.end_slot += new_count
+        self.count += count
+        self.version += 1
+        self.note_changes(slots)
+        self.alive[slots] = True
+        return slots
+
+    def note_changes(self, keys: t.Sequence[int]):
+        ''' List the changed keys until there are too many of them
+        '''
+        if self.changed_keys is None:
+            return
+        if len(keys) + len(self.changed_keys) > MAX_TRACKED_CHANGES:
+            self.changed_keys = None
+            return
+        self.changed_keys.update(np.asarray(keys, dtype=np.intp).tolist())
+
+    def take_changes(self) -> t.Optional[np.ndarray]:
+        ''' Results:
+            Keys added, changed or removed since the last call, None if
+            there were too many to list or the store was cleared
+        '''
+        changed_keys = self.changed_keys
+        self.changed_keys = set()
+        if changed_keys is None:
+            return None
+        return np.fromiter(changed_keys, dtype=np.intp,
+                           count=len(changed_keys))
+
+    def set_figure(self, slot: int, figure: FigureInfo):
+        self.version += 1
+        self.note_changes([slot])
+        if len(figure.coords) == 4:
+            self.coords[slot] = figure.coords
+            self.points.pop(slot, None)
+        else:
+            x_coords = figure.coords[0::2]
+            y_coords = figure.coords[1::2]
+            self.coords[slot] = (min(x_coords), min(y_coords),
+                                 max(x_coords), max(y_coords))
+            self.points[slot] = list(figure.coords)
+        self.border_sizes[slot] = figure.border_size
+        self.border_colors[slot] = self.color_code(figure.border_color)
+        self.fill_colors[slot] = self.color_code(figure.fill_color)
+        self.type_codes[slot] = self.type_code(figure.figure_type)
+        if figure.text:
+            self.texts[slot] = figure.text
+        else:
+            self.texts.pop(slot, None)
+
+    def append(self, figure: FigureInfo) -> int:
+        ''' Results:
+            The key of the figure
+        '''
+        slot = int(self.take_slots(1)[0])
+        self.set_figure(slot, figure)
+        return slot
+
+    def extend(self, figures: t.Sequence[FigureInfo]) -> np.ndarray:
+        ''' Add many figures filling the columns at once.
+        Results:
+            The keys of the figures in their order
+        '''
+        slots = self.take_slots(len(figures))
+        if not figures:
+            return slots
+        color_code = self.color_code
+        type_code = self.type_code
+        self.border_sizes[slots] = [figure.border_size for figure in figures]
+        self.border_colors[slots] = [color_code(figure.border_color)
+                                     for figure in figures]
+        self.fill_colors[slots] = [color_code(figure.fill_color)
+                                   for figure in figures]
+        self.type_codes[slots] = [type_code(figure.figure_type)
+                                  for figure in figures]
+        two_points = np.array([len(figure.coords) == 4
+                               for figure in figures])
+        if two_points.any():
+            self.coords[slots[two_points]] = [
+                figure.coords for figure in figures if len(figure.coords) == 4]
+        for slot, figure in zip(slots.tolist(), figures):
+            if len(figure.coords) != 4:
+                self.set_figure(slot, figure)
+            elif figure.text:
+                self.texts[slot] = figure.text
+        return slots
+
+    def extend_parsed(self, parsed: ParsedFigures) \
+            -> t.Tuple[np.ndarray, np.ndarray]:
+        ''' Add the figures of the parsed lines, the columns parsed
+        together are copied without making the figures.
+        Results:
+            The keys of the figures and the lines they are on
+        '''
+        row_lines = np.flatnonzero(parsed.line_rows >= 0)
+        rows = parsed.line_rows[row_lines]
+        slots = self.take_slots(len(rows))
+        # Codes of the parsed columns -> codes of the store
+        color_map = np.array([self.color_code(color)
+                              for color in parsed.colors], dtype=np.int32)
+        type_map = np.array([self.type_code(type_name)
+                             for type_name in parsed.type_names],
+                            dtype=np.uint8)
+        if len(rows):
+            self.coords[slots] = parsed.coords[rows]
+            self.border_sizes[slots] = parsed.border_sizes[rows]
+            self.border_colors[slots] = color_map[parsed.border_colors[rows]]
+            self.fill_colors[slots] = color_map[parsed.fill_colors[rows]]
+            self.type_codes[slots] = type_map[parsed.type_codes[rows]]
+        other_lines = sorted(parsed.other_figures)
+        other_slots = self.extend([parsed.other_figures[line_idx]
+                                   for line_idx in other_lines])
+        return (np.concatenate([slots, other_slots]),
+                np.concatenate([row_lines,
+                                np.array(other_lines, dtype=np.intp)]))
+
+    def __getitem__(self, key: int) -> FigureInfo:
+        ''' The figure is made of the columns on every call,
+        changing it doesn't change the store
+        '''
+        if key not in self:
+            raise KeyError(key)
+        points = self.points.get(key)
+        return FigureInfo(
+            self.type_names[self.type_codes[key]],
+            list(points) if points is not None else self.coords[key].tolist(),
+            float(self.border_sizes[key]),
+            self.colors[self.border_colors[key]],
+            self.colors[self.fill_colors[key]],
+            self.texts.get(key, ''))
+
+    def get(self, key: int, default=None) -> t.Optional[FigureInfo]:
+        return self[key] if key in self else default
+
+    def __setitem__(self, key: int, figure: FigureInfo):
+        if key not in self:
+            raise KeyError(key)
+        self.set_figure(key, figure)
+
+    def __delitem__(self, key: int):
+        if key not in self:
+            raise KeyError(key)
+        self.alive[key] = False
+        self.points.pop(key, None)
+        self.texts.pop(key, None)
+        self.free_slots.append(key)
+        self.count -= 1
+        self.version += 1
+        self.note_changes([key])
+
+    def clear(self):
+        ''' Remove all figures, the columns keep their capacity
+        '''
+        version = self.version
+        self.__init__(len(self.alive))
+        self.version = version + 1
+        self.changed_keys = None
+
+    def translate(self, keys: t.Sequence[int], x_offset: float,
+                  y_offset: float):
+        ''' Move the figures by the offset
+        '''
+        keys = np.asarray(keys, dtype=np.intp)
+        self.coords[keys] += (x_offset, y_offset, x_offset, y_offset)
+        self.version += 1
+        self.note_changes(keys)
+        if self.points:
+            for key in keys.tolist():
+                points = self.points.get(key)
+                if points is not None:
+                    points[0::2] = [coord + x_offset
+                                    for coord in points[0::2]]
+                    points[1::2] = [coord + y_offset
+                                    for coord in points[1::2]]
+
+    def bounding_boxes(self, keys: t.Optional[t.Sequence[int]] = None) \
+            -> np.ndarray:
+        ''' Left, top, right, bottom of every figure, the outline included.
+        All figures if no keys are given
+        '''
+        if keys is None:
+            keys = self.keys()
+        coords = self.coords[keys]
+        half_borders = self.border_sizes[keys] / 2
+        return np.column_stack((
+            np.minimum(coords[:, 0], coords[:, 2]) - half_borders,
+            np.minimum(coords[:, 1], coords[:, 3]) - half_borders,
+            np.maximum(coords[:, 0], coords[:, 2]) + half_borders,
+            np.maximum(coords[:, 1], coords[:, 3]) + half_borders))
+
+    def dot_color_codes(self, keys: t.Sequence[int]) -> np.ndarray:
+        ''' Color of every figure shown as a dot: the fill color,
+        the outline color for the figures without the fill
+        '''
+        color_codes = self.fill_colors[keys]
+        no_fill_code = self.color_codes.get('')
+        if no_fill_code is not None:
+            color_codes = np.where(color_codes == no_fill_code,
+                                   self.border_colors[keys], color_codes)
+        return color_codes
+
+    def contain_point(self, keys: t.Sequence[int],
+                      point_x: t.Union[float, np.ndarray],
+                      point_y: t.Union[float, np.ndarray]) -> np.ndarray:
+        ''' Which of the figures contain the point, or their own point
+        if arrays of one point per figure are given.
+        Ovals are tested against the ellipse, others against their box
+        '''
+        keys = np.asarray(keys, dtype=np.intp)
+        boxes = self.bounding_boxes(keys)
+        in_box = (boxes[:, 0] <= point_x) & (point_x <= boxes[:, 2]) & \
+            (boxes[:, 1] <= point_y) & (point_y <= boxes[:, 3])
+        oval_code = self.type_name_codes.get("oval")
+        if oval_code is None:
+            return in_box
+        x_radii = (boxes[:, 2] - boxes[:, 0]) / 2
+        y_radii = (boxes[:, 3] - boxes[:, 1]) / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_distances = (point_x - boxes[:, 0] - x_radii) / x_radii
+            y_distances = (point_y - boxes[:, 1] - y_radii) / y_radii
+            in_oval = x_distances * x_distances + \
+                y_distances * y_distances <= 1
+        is_oval = self.type_codes[keys] == oval_code
+        return np.where(is_oval, in_oval & in_box, in_box)
+
+    def intersect_box(self, keys: t.Sequence[int],
+                      box: t.Sequence[float]) -> np.ndarray:
+        ''' Which of the figures touch the box. The point of the box
+        closest to the figure center is tested: an ellipse is a scaled
+        circle, and scaling keeps the box a box
+        '''
+        keys = np.asarray(keys, dtype=np.intp)
+        boxes = self.bounding_boxes(keys)
+        closest_x = np.clip((boxes[:, 0] + boxes[:, 2]) / 2, box[0], box[2])
+        closest_y = np.clip((boxes[:, 1] + boxes[:, 3]) / 2, box[1], box[3])
+        return self.contain_point(keys, closest_x, closest_y)
+
+    def figures_at(self, point_x: float, point_y: float) -> np.ndarray:
+        ''' Keys of all figures containing the point
+        '''
+        keys = self.keys()
+        return keys[self.contain_point(keys, point_x, point_y)]
+
+
+class PyramidCells(t.NamedTuple):
+    # Occupied cells sorted by the row, then by the column
+    rows: np.ndarray
+    columns: np.ndarray
+    # Dot color of one figure in every cell
+    color_codes: np.ndarray
+
+
+class PyramidLevel(t.NamedTuple):
+    # Packed positions of the occupied cells, sorted like the cells
+    cell_codes: np.ndarray
+    # Figures in every cell and the one giving it the color
+    figure_counts: np.ndarray
+    color_keys: np.ndarray
+    # Cell of every figure by the key, stale for the absent keys
+    key_cells: np.ndarray
+    cells: PyramidCells
+
+
+def cell_codes(centers: np.ndarray, level: int) -> np.ndarray:
+    ''' Packed positions of the level cells the points fall into.
+    The row is in the high half, so the codes sort by the row first
+    '''
+    positions = np.clip(np.floor(centers / 2.0 ** level),
+                        -CELL_POSITION_LIMIT, CELL_POSITION_LIMIT - 1)
+    positions = positions.astype(np.int64) + CELL_POSITION_LIMIT
+    return (positions[:, 1] << CELL_POSITION_BITS) | positions[:, 0]
+
+
+def cells_of_codes(cell_codes: np.ndarray, color_codes: np.ndarray) \
+        -> PyramidCells:
+    return PyramidCells(
+        (cell_codes >> CELL_POSITION_BITS) - CELL_POSITION_LIMIT,
+        (cell_codes & ((1 << CELL_POSITION_BITS) - 1)) - CELL_POSITION_LIMIT,
+        color_codes)
+
+
+class FigurePyramid():
+    ''' Far zoomed out views of the store without a look at every figure.
+    Figure centers fall into the square cells of a level, the cells
+    of the level n are 2**n long, and an occupied cell keeps the dot color
+    of one of its figures. The figures are also kept sorted by size,
+    so the ones large enough for their own items come first.
+    All is built from the columns on the first use, the levels on the
+    first use of each. After that only the figures the store lists
+    as changed are taken out and put back
+    '''
+    def __init__(self, store: FigureStore):
+        self.store = store
+        self.version = None
+        # Keys from the largest figure to the smallest
+        self.keys = np.zeros(0, dtype=np.intp)
+        self.sizes = np.zeros(0)
+        # Which keys are in the pyramid, their centers and dot colors
+        self.is_present = np.zeros(0, dtype=bool)
+        self.centers = np.zeros((0, 2))
+        self.color_codes = np.zeros(0, dtype=np.int32)
+        self.levels: t.Dict[int, PyramidLevel] = {}
+
+    def refresh(self):
+        store = self.store
+        if self.version == store.version:
+            return
+        changed_keys = store.take_changes()
+        if self.version is None or changed_keys is None:
+            self.rebuild()
+        else:
+            self.update(changed_keys)
+        self.version = store.version
+
+    def rebuild(self):
+        store = self.store
+        keys = store.keys()
+        boxes = store.bounding_boxes(keys)
+        sizes = np.maximum(boxes[:, 2] - boxes[:, 0],
+                           boxes[:, 3] - boxes[:, 1])
+        order = np.argsort(-sizes, kind='stable')
+        self.keys = keys[order]
+        self.sizes = sizes[order]
+        capacity = len(store.alive)
+        self.is_present = np.zeros(capacity, dtype=bool)
+        self.is_present[keys] = True
+        self.centers = np.zeros((capacity, 2))
+        self.centers[keys] = (boxes[:, :2] + boxes[:, 2:]) / 2
+        self.color_codes = np.zeros(capacity, dtype=np.int32)
+        self.color_codes[keys] = store.dot_color_codes(keys)
+        self.levels = {}
+
+    def update(self, changed_keys: np.ndarray):
+        ''' Take the changed figures out, put the alive ones back
+        '''
+        store = self.store
+        capacity = len(store.alive)
+        if len(self.is_present) < capacity:
+            old_capacity = len(self.is_present)
+            self.is_present = np.concatenate(
+                [self.is_present, np.zeros(capacity - old_capacity, bool)])
+            self.centers = np.concatenate(
+                [self.centers, np.zeros((capacity - old_capacity, 2))])
+            self.color_codes = np.concatenate(
+                [self.color_codes,
+                 np.zeros(capacity - old_capacity, dtype=np.int32)])
+        old_keys = changed_keys[self.is_present[changed_keys]]
+        new_keys = changed_keys[store.alive[changed_keys]]
+        is_changed = np.zeros(capacity, dtype=bool)
+        is_changed[changed_keys] = True
+        is_kept = ~is_changed[self.keys]
+        keys = self.keys[is_kept]
+        sizes = self.sizes[is_kept]
+        boxes = store.bounding_boxes(new_keys)
+        new_sizes = np.maximum(boxes[:, 2] - boxes[:, 0],
+                               boxes[:, 3] - boxes[:, 1])
+        order = np.argsort(-new_sizes, kind='stable')
+        positions = np.searchsorted(-sizes, -new_sizes[order], side='right')
+        self.keys = np.insert(keys, positions, new_keys[order])
+        self.sizes = np.insert(sizes, positions, new_sizes[order])
+        self.is_present[old_keys] = False
+        self.is_present[new_keys] = True
+        self.centers[new_keys] = (boxes[:, :2] + boxes[:, 2:]) / 2
+        self.color_codes[new_keys] = store.dot_color_codes(new_keys)
+        for level, pyramid_level in list(self.levels.items()):
+            self.levels[level] = self.update_level(level, pyramid_level,
+                                                   old_keys, new_keys)
+
+    def build_level(self, level: int) -> PyramidLevel:
+        keys = np.flatnonzero(self.is_present)
+        codes = cell_codes(self.centers[keys], level)
+        key_cells = np.zeros(len(self.is_present), dtype=np.int64)
+        key_cells[keys] = codes
+        codes, first_idx, counts = np.unique(codes, return_index=True,
+                                             return_counts=True)
+        color_keys = keys[first_idx]
+        cells = cells_of_codes(codes, self.color_codes[color_keys])
+        return PyramidLevel(codes, counts, color_keys, key_cells, cells)
+
+    def update_level(self, level: int, pyramid_level: PyramidLevel,
+                     old_keys: np.ndarray, new_keys: np.ndarray) \
+            -> PyramidLevel:
+        ''' Move the changed figures between the cells. A cell losing
+        the figure of its color takes the color of another one
+        '''
+        codes, counts, color_keys, key_cells, _ = pyramid_level
+        counts = counts.copy()
+        color_keys = color_keys.copy()
+        if len(key_cells) < len(self.is_present):
+            key_cells = np.concatenate(
+                [key_cells,
+                 np.zeros(len(self.is_present) - len(key_cells),
+                          dtype=np.int64)])
+        np.subtract.at(counts, np.searchsorted(codes, key_cells[old_keys]), 1)
+        is_color_lost = np.isin(color_keys, old_keys)
+        new_codes = cell_codes(self.centers[new_keys], level)
+        key_cells[new_keys] = new_codes
+        new_codes, first_idx, new_counts = np.unique(
+            new_codes, return_index=True, return_counts=True)
+        positions = np.searchsorted(codes, new_codes)
+        is_old = positions < len(codes)
+        is_old[is_old] = codes[positions[is_old]] == new_codes[is_old]
+        # Figures joining the occupied cells, one of them gives
+        # the color if the cell has lost it
+        old_positions = positions[is_old]
+        counts[old_positions] += new_counts[is_old]
+        color_keys[old_positions] = np.where(
+            is_color_lost[old_positions], new_keys[first_idx[is_old]],
+            color_keys[old_positions])
+        is_color_lost[old_positions] = False
+        is_kept = counts > 0
+        lost_codes = codes[is_color_lost & is_kept]
+        codes = codes[is_kept]
+        counts = counts[is_kept]
+        color_keys = color_keys[is_kept]
+        # The cells occupied now
+        positions = np.searchsorted(codes, new_codes[~is_old])
+        codes = np.insert(codes, positions, new_codes[~is_old])
+        counts = np.insert(counts, positions, new_counts[~is_old])
+        color_keys = np.insert(color_keys, positions,
+                               new_keys[first_idx[~is_old]])
+        if len(lost_codes):
+            # Other figures of these cells are only found
+            # by looking at all of them
+            keys = np.flatnonzero(self.is_present)
+            keys = keys[np.isin(key_cells[keys], lost_codes)]
+            lost_codes, first_idx = np.unique(key_cells[keys],
+                                              return_index=True)
+            color_keys[np.searchsorted(codes, lost_codes)] = keys[first_idx]
+        cells = cells_of_codes(codes, self.color_codes[color_keys])
+        return PyramidLevel(codes, counts, color_keys, key_cells, cells)
+
+    def large_figures(self, min_size: float) -> np.ndarray:
+        ''' Keys of the figures at least this large, the largest first
+        '''
+        self.refresh()
+        return self.keys[:np.searchsorted(-self.sizes, -min_size,
+                                          side='right')]
+
+    def level_cells(self, level: int) -> PyramidCells:
+        self.refresh()
+        pyramid_level = self.levels.get(level)
+        if pyramid_level is None:
+            pyramid_level = self.build_level(level)
+            self.levels[level] = pyramid_level
+        return pyramid_level.cells
+
+    def cells_in_box(self, level: int, box: t.Sequence[float]) \
+            -> PyramidCells:
+        ''' Occupied cells of the level touching the box.
+        Only the rows of the box are looked at
+        '''
+        cells = self.level_cells(level)
+        cell_size = 2.0 ** level
+        first_row = np.searchsorted(cells.rows, np.floor(box[1] / cell_size))
+        end_row = np.searchsorted(cells.rows, np.floor(box[3] / cell_size),
+                                  side='right')
+        columns = cells.columns[first_row:end_row]
+        is_inside = (columns >= np.floor(box[0] / cell_size)) & \
+            (columns <= np.floor(box[2] / cell_size))
+        return PyramidCells(cells.rows[first_row:end_row][is_inside],
+                            columns[is_inside],
+                            cells.color_codes[first_row:end_row][is_inside])
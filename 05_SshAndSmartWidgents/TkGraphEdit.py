@@ -1,61 +1,176 @@
-import re
+import base64
+import math
+import os
+import queue
+import stat
+import tempfile
+import threading
 import time
 import tkinter as tk
 import typing as t
+from tkinter import filedialog
 
+import numpy as np
 
-class FigureInfo(t.NamedTuple):
-    figure_type: str
-    # Two points coordinates:
-    # The left and the right corner
-    coords: t.List[float]
-    border_size: float
-    border_color: str
-    fill_color: str
+from FigureIndex import BoundingBox, GridIndex, normalized_box
+from FigureParser import (FigureInfo, ParsedFigures, figure_from_text,
+                          parse_document, text_from_figure)
+from FigureStore import FigurePyramid, FigureStore
 
 
-def figure_from_text(line: str) -> FigureInfo:
-    line = line.strip()
-    figure_regex = re.compile(".*oval[\s]+(<.*>)"
-                              "[\s]+([0-9]+[.]*[0-9]*)[\s]+"
-                              "(#[0-9a-f]{6})[\s]+(#[0-9a-f]{6})")
-    figure_match = figure_regex.match(line)
-    if figure_match is None:
-        return None
-    coords_str = figure_match.group(1).strip('<').strip('>')
-    coords_lst = coords_str.split()
-    if len(coords_lst) != 4:
-        return None
+# Background of the canvas and of the image with the dots
+CANVAS_BACKGROUND = '#854116'
+# Figure lines are tracked with text marks named with this prefix
+FIGURE_MARK_PREFIX = "figure"
+# File is read and parsed by pieces of this size. A piece is added
+# to the widgets at once, about a thousand lines take a few ms,
+# so the frame time is kept
+LOAD_PIECE_SIZE = 1 << 16
+# Parsed pieces waiting for the widgets, bounds the memory in use
+LOAD_QUEUE_SIZE = 128
+# The saved file is written by blocks of this size
+SAVE_BUFFER_SIZE = 1 << 20
+# How often the loaded pieces are taken and how long they may be added
+LOAD_POLL_MS = 10
+LOAD_FRAME_MS = 30
+# Figure marks are listed by this many lines at once while saving
+SAVE_DUMP_LINES = 10000
+# Pointer motion is shown at most once in this period, about a frame
+MOTION_FRAME_MS = 16
+# Share of the view size around it that gets the items too,
+# so short pans need no new items
+VIEW_MARGIN = 0.25
+# Figures smaller than this on the screen are drawn as dots
+# of one image instead of getting the items
+LOD_PIXELS = 3
+MIN_ZOOM = 1 / 64
+MAX_ZOOM = 64
+# Zoom change of one mouse wheel click
+ZOOM_STEP = 1.25
+# Pixels scrolled by one wheel click or scroll bar arrow
+SCROLL_UNIT = 20
+# Larger views take the figures and the dots from the pyramid
+# instead of the grid cells
+MAX_INDEX_QUERY_CELLS = 4096
+# The dots are redrawn once the edits pause for this long
+LOD_UPDATE_MS = 250
+# Hidden items kept for reuse, per item type
+MAX_POOLED_ITEMS = 10000
+# More figures in the view than this are too many items for Tk,
+# the smallest of them are drawn as dots too
+MAX_SHOWN_ITEMS = 20000
+# Canvas tag of the figure items, they are moved together on pans
+FIGURE_ITEM_TAG = "figures"
+# Event state bits of the modifier keys
+SHIFT_MASK = 0x1
+CONTROL_MASK = 0x4
+
+
+def figure_box(figure: FigureInfo) -> BoundingBox:
+    ''' Bounding box of the figure, the outline included
+    '''
+    x_coords = figure.coords[0::2]
+    y_coords = figure.coords[1::2]
+    left, top, right, bottom = (min(x_coords), min(y_coords),
+                                max(x_coords), max(y_coords))
+    half_border = figure.border_size / 2
+    return (left - half_border, top - half_border,
+            right + half_border, bottom + half_border)
+
+
+# Figure types drawn with the canvas item of the same name
+CANVAS_ITEM_TYPES = ("oval", "rectangle", "polygon", "line", "text")
+
+
+def figure_item_options(figure: FigureInfo,
+                        zoom: float = 1.0) -> t.Dict[str, t.Any]:
+    ''' Canvas item options showing the figure
+    '''
+    if figure.figure_type == "line":
+        return {"fill": figure.border_color,
+                "width": figure.border_size * zoom}
+    if figure.figure_type == "text":
+        return {"fill": figure.border_color, "text": figure.text,
+                "anchor": tk.NW,
+                "font": ("Helvetica",
+                         max(1, round(figure.border_size * zoom)))}
+    return {"fill": figure.fill_color, "outline": figure.border_color,
+            "width": figure.border_size * zoom}
+
+
+def color_palette(colors: t.Sequence[str], empty_color: str) -> np.ndarray:
+    ''' '#rrggbb' colors -> (len(colors), 3) bytes, the empty color
+    is drawn with empty_color
+    '''
+    hex_digits = ''.join((color or empty_color)[1:] for color in colors)
+    return np.frombuffer(bytes.fromhex(hex_digits),
+                         dtype=np.uint8).reshape(-1, 3)
+
+
+def saved_file_mode(path: str) -> int:
+    ''' Permission bits of the existing file,
+    the ones a new file would get otherwise
+    '''
     try:
-        coords = [float(coord) for coord in coords_lst]
-        border_size = float(figure_match.group(2))
-    except ValueError:
-        return None
-    border_color = figure_match.group(3)
-    fill_color = figure_match.group(4)
-    return FigureInfo(figure_type="oval", coords=coords,
-                      border_size=border_size,
-                      border_color=border_color,
-                      fill_color=fill_color)
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        # The umask can only be read by setting it
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
 
+class LoadBatch(t.NamedTuple):
+    # Lines of the piece, the last one ends with the newline
+    # unless it is the end of the file
+    text: str
+    # Parsed figure of every line, None for the invalid ones
+    figures: ParsedFigures
+    # Bytes read so far
+    position: int
 
-def text_from_figure(figure: FigureInfo) -> str:
-    ''' Print a figure to the text
+
+def read_figure_batches(path: str, batches: queue.Queue,
+                        stop_event: threading.Event):
+    ''' Read the file by pieces ending at line boundaries and parse them.
+    Runs on the loader thread, the pieces are put to the queue,
+    then None. An error is put instead of the piece it happened in
     '''
-    return f"{figure.figure_type} <{figure.coords[0]} {figure.coords[1]} " +\
-           f"{figure.coords[2]} {figure.coords[3]}> {figure.border_size} " +\
-           f"{figure.border_color} {figure.fill_color}"
+    def put(item) -> bool:
+        # The queue is bounded, wait for the room unless cancelled
+        while not stop_event.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
+    def parse(data: bytes, position: int) -> LoadBatch:
+        # Newline byte never occurs inside a multibyte UTF-8 character
+        text = data.decode('utf-8')
+        return LoadBatch(text, parse_document(text).figures, position)
 
-def is_point_in_rectangle(point_x: float, point_y: float,
-                          coords: t.List[float]) -> bool:
-    # Get the top left and bottom right rectangle corners
-    if coords[0] > coords[2]:
-        coords[0], coords[2] = coords[2], coords[0]
-    if coords[1] > coords[3]:
-        coords[1], coords[3] = coords[3], coords[1]
-    return (point_x >= coords[0] and point_x <= coords[2]
-            and point_y >= coords[1] and point_y <= coords[3])
+    try:
+        with open(path, 'rb') as figure_file:
+            position = 0
+            tail = b''
+            while not stop_event.is_set():
+                chunk = figure_file.read(LOAD_PIECE_SIZE)
+                if not chunk:
+                    break
+                position += len(chunk)
+                chunk = tail + chunk
+                line_end = chunk.rfind(b'\n') + 1
+                tail = chunk[line_end:]
+                if line_end and not put(parse(chunk[:line_end], position)):
+                    return
+            if tail and not put(parse(tail, position)):
+                return
+    except (OSError, UnicodeDecodeError) as error:
+        put(error)
+        return
+    put(None)
 
 
 class GraphEditorFrame(tk.Frame):
@@ -63,8 +178,54 @@ class GraphEditorFrame(tk.Frame):
     def __init__(self, master=None):
         super().__init__(master)
         self.new_coord = []
-        self.figures_lst = []
         self.is_dragged_figure = False
+        # Parsed figure of every valid line, kept in columns.
+        # The line is marked with the text mark named after the figure
+        # key, so Tk keeps track of the line position while the text
+        # is edited. Keys of the removed figures are reused
+        self.line_figures = FigureStore()
+        # Canvas item of every shown figure and back. Only the figures
+        # near the view have the items, in the canvas coordinates
+        self.figure_items = {}
+        self.item_figures = {}
+        # Hidden items of every item type ready for reuse
+        self.item_pool = {}
+        # Figures to redraw and to delete
+        self.changed_figures = set()
+        self.removed_figures = set()
+        # Figure point shown in the top left canvas corner and the scale
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.zoom = 1.0
+        # The view the items are placed for
+        self.shown_view = (0.0, 0.0, 1.0)
+        self.view_job = None
+        # Bounds of the figures added so far, for the scroll bars
+        self.scene_box = None
+        # Image with the figures too small for their own items
+        self.lod_image = None
+        # Color list of the store and its decoded part, colors
+        # are only appended until the store is cleared
+        self.palette_colors = None
+        self.palette = np.zeros((0, 3), dtype=np.uint8)
+        self.lod_item = None
+        self.lod_job = None
+        # Bounding boxes of the figures for the hit tests
+        self.figure_index = GridIndex()
+        self.figure_pyramid = FigurePyramid(self.line_figures)
+        self.text_change_job = None
+        # Figures added by the edits, they get the line orders
+        # once the edited lines are parsed
+        self.unordered_figures = set()
+        # Pointer position shown by the next motion frame
+        self.pointer_coords = (0, 0)
+        self.motion_job = None
+        self.filename = None
+        # Loader thread state while a file is being loaded
+        self.load_batches = None
+        self.load_stop_event = None
+        self.load_size = 0
+        self.load_job = None
         self.grid(sticky=tk.N+tk.S+tk.E+tk.W)
         self.create_widgets()
 
@@ -122,20 +283,41 @@ class GraphEditorFrame(tk.Frame):
                               columnspan=TEXTEDITOR_COLUMNSPAN,
                               sticky=tk.N+tk.S+tk.E+tk.W)
         self.text_editor.tag_configure("red", foreground="#ff0000")
-        # Update the image after the release of any key
-        self.text_editor.bind("<KeyRelease>", self.on_text_changed)
-        self.graph_editor = tk.Canvas(self, bg='#854116',
+        # Lines changed since the last update of the image
+        self.text_editor.tag_configure("dirty")
+        self.redirect_text_editor()
+        self.graph_editor = tk.Canvas(self, bg=CANVAS_BACKGROUND,
                                       width=GRAPHEDITOR_WIDTH,
                                       height=GRAPHEDITOR_HEIGHT)
         self.graph_editor.grid(row=2, column=TEXTEDITOR_COLUMNSPAN,
-                               columnspan=GRAPHEDITOR_COLUMNSPAN,
+                               columnspan=GRAPHEDITOR_COLUMNSPAN - 1,
                                rowspan=TEXTEDITOR_ROWSPAN - 1,
                                sticky=tk.N+tk.S+tk.E+tk.W)
+        # The canvas has no scroll region: only the figures near the view
+        # have items, the scroll bars are driven by the view position
+        self.y_scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL,
+                                        command=self.on_scroll_y)
+        self.y_scrollbar.grid(row=2, column=TEXTEDITOR_COLUMNSPAN +
+                              GRAPHEDITOR_COLUMNSPAN - 1,
+                              rowspan=TEXTEDITOR_ROWSPAN - 1,
+                              sticky=tk.N+tk.S)
+        self.x_scrollbar = tk.Scrollbar(self, orient=tk.HORIZONTAL,
+                                        command=self.on_scroll_x)
+        self.x_scrollbar.grid(row=TEXTEDITOR_ROWSPAN + 1,
+                              column=TEXTEDITOR_COLUMNSPAN,
+                              columnspan=GRAPHEDITOR_COLUMNSPAN - 1,
+                              sticky=tk.E+tk.W)
 
         # Track the mouse to enable creating new ovals and dragging figures
         self.graph_editor.bind("<Button-1>", self.on_mouse_click)
         self.graph_editor.bind("<Motion>", self.on_mouse_motion)
         self.graph_editor.bind("<ButtonRelease-1>", self.on_mouse_release)
+        # Wheel scrolls, with Shift horizontally, with Control zooms
+        self.graph_editor.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.graph_editor.bind("<Button-4>", self.on_mouse_wheel)
+        self.graph_editor.bind("<Button-5>", self.on_mouse_wheel)
+        self.graph_editor.bind("<Configure>",
+                               lambda event: self.schedule_view_update())
         # Add empty space to fix the first row buttons
         self.columnconfigure(TEXTEDITOR_COLUMNSPAN + 5,
                              minsize=GRAPHEDITOR_WIDTH - 5 * BUTTON_WIDTH,
@@ -161,15 +343,15 @@ class GraphEditorFrame(tk.Frame):
     def on_mouse_click(self, event):
         ''' Draw new oval or drag existing
         '''
+        if self.load_job is not None:
+            # The text is not editable until it is loaded
+            return
         # Does the cursor lie on the existing figure
         # If so, drag it
-        self.is_dragged_figure = False
-        for figure_idx in range(len(self.figures_lst)):
-            figure = self.figures_lst[figure_idx]
-            if is_point_in_rectangle(event.x, event.y, figure.coords):
-                self.is_dragged_figure = True
-                # Drag this figure
-                self.dragged_figure_idx = figure_idx
+        key = self.figure_at(*self.to_world(event.x, event.y))
+        self.is_dragged_figure = key is not None
+        if self.is_dragged_figure:
+            self.dragged_figure_key = key
         if not self.is_dragged_figure:
             self.new_coord = [event.x, event.y]
             self.new_oval = self.graph_editor.create_oval(
@@ -179,129 +361,896 @@ class GraphEditorFrame(tk.Frame):
         else:
             # From which point the dragging started
             self.drag_start_coords = (event.x, event.y)
+            # How far the item is already moved
+            self.drag_shown_offset = (0, 0)
+        self.pointer_coords = (event.x, event.y)
 
     def on_mouse_motion(self, event):
-        ''' Resize the new oval, or drag existing
+        ''' Resize the new oval, or drag existing.
+        Motion events come faster than the screen is redrawn,
+        only the last position is shown once per frame
+        '''
+        self.pointer_coords = (event.x, event.y)
+        if (len(self.new_coord) == 2 or self.is_dragged_figure) and \
+           self.motion_job is None:
+            self.motion_job = self.after(MOTION_FRAME_MS, self.show_motion)
+
+    def show_motion(self):
+        ''' Bring the edited item to the last pointer position
         '''
+        self.motion_job = None
+        pointer_x, pointer_y = self.pointer_coords
         if len(self.new_coord) == 2:
             # The new oval is being created
             self.graph_editor.coords(self.new_oval,
                                      self.new_coord[0], self.new_coord[1],
-                                     event.x, event.y)
+                                     pointer_x, pointer_y)
         elif self.is_dragged_figure:
             # Currently dragging the figure
-            x_offset = event.x - self.drag_start_coords[0]
-            y_offset = event.y - self.drag_start_coords[1]
-            figure = self.figures_lst[self.dragged_figure_idx]
-            self.graph_editor.coords(
-                self.canvas_figures[self.dragged_figure_idx],
-                figure.coords[0] + x_offset,
-                figure.coords[1] + y_offset,
-                figure.coords[2] + x_offset,
-                figure.coords[3] + y_offset
-             )
+            x_offset = pointer_x - self.drag_start_coords[0]
+            y_offset = pointer_y - self.drag_start_coords[1]
+            item = self.figure_items.get(self.dragged_figure_key)
+            if item is not None:
+                # Move by the distance since the last frame
+                self.graph_editor.move(item,
+                                       x_offset - self.drag_shown_offset[0],
+                                       y_offset - self.drag_shown_offset[1])
+            self.drag_shown_offset = (x_offset, y_offset)
 
     def on_mouse_release(self, event):
         ''' Save changes in the image to text
         '''
+        if self.motion_job is not None:
+            # The release position is final, the pending frame is stale
+            self.after_cancel(self.motion_job)
+            self.motion_job = None
         if len(self.new_coord) == 2:
             # Create new oval
             self.new_coord.append(event.x)
             self.new_coord.append(event.y)
-            self.graph_editor.coords(self.new_oval,
-                                     self.new_coord[0], self.new_coord[1],
-                                     event.x, event.y)
+            # The figure gets its own item once its line is parsed
+            self.graph_editor.delete(self.new_oval)
             assert(len(self.new_coord) == 4)
+            # The oval is drawn on the canvas, the figure is on the plane
+            coords = [*self.to_world(*self.new_coord[:2]),
+                      *self.to_world(*self.new_coord[2:])]
             new_figure = FigureInfo(figure_type="oval",
-                                    coords=self.new_coord,
+                                    coords=coords,
                                     border_size=1.0,
                                     border_color="#000000",
                                     fill_color="#ffffff")
             self.text_editor.insert(tk.END,
                                     text_from_figure(new_figure) + '\n')
-        elif self.is_dragged_figure:
-            # Delete existing entry and create new
-            line_start = f"{self.dragged_figure_idx + 1}.0"
-            line_end = f"{self.dragged_figure_idx + 1}.end+1c"
-            self.text_editor.delete(line_start, line_end)
+        elif self.is_dragged_figure and \
+                self.dragged_figure_key in self.line_figures:
+            figure = self.line_figures[self.dragged_figure_key]
             # Update the coordinates
-            figure = self.figures_lst[self.dragged_figure_idx]
-            new_coords = self.figures_lst[self.dragged_figure_idx].coords
             x_offset = event.x - self.drag_start_coords[0]
             y_offset = event.y - self.drag_start_coords[1]
-            new_coords[0] += x_offset
-            new_coords[1] += y_offset
-            new_coords[2] += x_offset
-            new_coords[3] += y_offset
-            # Insert new figure
-            new_figure = FigureInfo(figure_type=figure.figure_type,
-                                    coords=new_coords,
-                                    border_size=figure.border_size,
-                                    border_color=figure.border_color,
-                                    fill_color=figure.fill_color)
-            self.text_editor.insert(tk.END,
-                                    text_from_figure(new_figure) + '\n')
-        self.create_figures_lst()
-        self.draw_figures()
+            item = self.figure_items.get(self.dragged_figure_key)
+            if item is not None:
+                self.graph_editor.move(item,
+                                       x_offset - self.drag_shown_offset[0],
+                                       y_offset - self.drag_shown_offset[1])
+            # The figure moves less than the pointer when zoomed in
+            x_offset /= self.zoom
+            y_offset /= self.zoom
+            if x_offset != 0 or y_offset != 0:
+                new_coords = [coord + (y_offset if coord_idx % 2 else x_offset)
+                              for coord_idx, coord
+                              in enumerate(figure.coords)]
+                new_figure = figure._replace(coords=new_coords)
+                # Rewrite the figure line in place, the mark follows
+                # the figure whatever lines are above it
+                line_idx = self.line_of(
+                    f"{FIGURE_MARK_PREFIX}{self.dragged_figure_key}")
+                self.text_editor.replace(f"{line_idx}.0", f"{line_idx}.end",
+                                         text_from_figure(new_figure))
+        # Apply the text changes right away, only the changed line
+        # is parsed and only its item is updated
+        self.on_text_changed()
         self.is_dragged_figure = False
 
-    def on_text_changed(self, event):
+    def redirect_text_editor(self):
+        ''' Route the Tcl command of the text widget through
+        on_text_command, so every insert and delete is seen,
+        whether it comes from typing, pasting or the program
+        '''
+        widget_name = str(self.text_editor)
+        self.text_editor_command = widget_name + "_orig"
+        self.tk.call("rename", widget_name, self.text_editor_command)
+        self.tk.createcommand(widget_name, self.on_text_command)
+
+    def text_call(self, *args):
+        ''' Call the text widget bypassing the change tracking
+        '''
+        return self.tk.call((self.text_editor_command,) + args)
+
+    def line_of(self, index) -> int:
+        return int(str(self.text_call("index", index)).split('.')[0])
+
+    def on_text_command(self, operation, *args):
+        ''' Run the text widget command, mark the lines it changed.
+        The loaded lines are inserted bypassing it, the edits are
+        ignored until the loading is over
+        '''
+        if self.load_job is not None and \
+           operation in ("insert", "delete", "replace"):
+            return ""
+        if operation == "insert":
+            first_line = self.line_of(args[0])
+            result = self.text_call(operation, *args)
+            # Arguments are: index, chars, tags, chars, tags...
+            inserted_lines = ''.join(args[1::2]).count('\n')
+            self.mark_lines_dirty(first_line, first_line + inserted_lines)
+        elif operation == "delete":
+            lines = [self.line_of(index) for index in args]
+            result = self.text_call(operation, *args)
+            # A single range joins into its first line, several ranges
+            # are rare, so their whole span is updated
+            last_line = max(lines) if len(args) > 2 else min(lines)
+            self.mark_lines_dirty(min(lines), last_line)
+        elif operation == "replace":
+            first_line = self.line_of(args[0])
+            result = self.text_call(operation, *args)
+            inserted_lines = ''.join(args[2::2]).count('\n')
+            self.mark_lines_dirty(first_line, first_line + inserted_lines)
+        else:
+            result = self.text_call(operation, *args)
+        return result
+
+    def mark_lines_dirty(self, first_line: int, last_line: int):
+        ''' Tag the lines, Tk moves the tag along with later edits.
+        The update is coalesced: it runs once the burst of edits is over
+        '''
+        text_last_line = self.line_of("end-1c")
+        first_line = min(first_line, text_last_line)
+        last_line = min(last_line, text_last_line)
+        # Include the newline, so even an empty line is tagged
+        self.text_call("tag", "add", "dirty", f"{first_line}.0",
+                       f"{last_line}.end+1c")
+        if self.text_change_job is None:
+            self.text_change_job = self.after_idle(self.on_text_changed)
+
+    def figure_keys_at(self, line_idx: int) -> t.List[int]:
+        ''' Keys of the figure marks on the line
+        '''
+        dump = self.text_call("dump", "-mark", f"{line_idx}.0",
+                              f"{line_idx}.end+1c")
+        keys = []
+        # The dump is a flat list of (kind, mark name, index) triples
+        for mark_name in dump[1::3]:
+            mark_name = str(mark_name)
+            if mark_name.startswith(FIGURE_MARK_PREFIX):
+                keys.append(int(mark_name[len(FIGURE_MARK_PREFIX):]))
+        return keys
+
+    def remove_figure(self, key: int):
+        self.text_call("mark", "unset", f"{FIGURE_MARK_PREFIX}{key}")
+        del self.line_figures[key]
+        self.figure_index.remove(key)
+        self.changed_figures.discard(key)
+        self.unordered_figures.discard(key)
+        self.removed_figures.add(key)
+
+    def update_line(self, line_idx: int):
+        ''' Parse the line again and highlight it if it is invalid.
+        Deleted lines leave their marks on the line they joined,
+        the extra marks are removed
+        '''
+        line_start = f"{line_idx}.0"
+        line_end = f"{line_idx}.end"
+        figure = figure_from_text(str(self.text_call("get", line_start,
+                                                     line_end)))
+        keys = self.figure_keys_at(line_idx)
+        if figure is None:
+            self.text_call("tag", "add", "red", line_start, line_end)
+            for key in keys:
+                self.remove_figure(key)
+            return
+        self.text_call("tag", "remove", "red", line_start, line_end)
+        if keys:
+            # Keep the key of the same figure if it is still here
+            kept_key = keys[0]
+            for key in keys:
+                if self.line_figures[key] == figure:
+                    kept_key = key
+            for key in keys:
+                if key != kept_key:
+                    self.remove_figure(key)
+            if self.line_figures[kept_key] != figure:
+                self.line_figures[kept_key] = figure
+                self.figure_index.update(kept_key, figure_box(figure))
+                self.extend_scene(figure_box(figure))
+                self.changed_figures.add(kept_key)
+            self.text_call("mark", "set", f"{FIGURE_MARK_PREFIX}{kept_key}",
+                           line_start)
+        else:
+            self.add_figure(line_idx, figure)
+
+    def on_text_changed(self, event=None):
         ''' When text in the widger changes,
-        update the figure list and highlights
-        '''
-        # Get input from the text widget
-        # Get adds a newline, so delete it
-        editor_input = self.text_editor.get("1.0", "end-1c")
-        lines = editor_input.split('\n')
-        tk_idx = tk.IntVar()
-        self.figures_lst = []
-        for line, line_idx in zip(lines, range(len(lines))):
-            line_start = f"{line_idx+1}.0"
-            line_end = f"{line_idx+1}.end"
-            figure = figure_from_text(line)
-            if figure is None:
-                self.text_editor.tag_add("red", line_start, line_end)
-            else:
-                self.text_editor.tag_remove("red", line_start, line_end)
-                self.figures_lst.append(figure)
+        update the figure list and highlights.
+        Only the lines tagged dirty are parsed again
+        '''
+        if self.text_change_job is not None:
+            # Called directly, the scheduled update isn't needed
+            self.after_cancel(self.text_change_job)
+            self.text_change_job = None
+        dirty_ranges = self.text_call("tag", "ranges", "dirty")
+        for range_start, range_end in zip(dirty_ranges[0::2],
+                                          dirty_ranges[1::2]):
+            end_line, end_column = str(range_end).split('.')
+            last_line = int(end_line)
+            if end_column == '0':
+                # The range ends with the newline of the previous line
+                last_line -= 1
+            for line_idx in range(self.line_of(range_start), last_line + 1):
+                self.update_line(line_idx)
+        self.text_call("tag", "remove", "dirty", "1.0", "end")
+        self.order_new_figures()
         self.draw_figures()
 
-    def create_figures_lst(self):
-        ''' Create list of figures
+    def neighbor_figure_key(self, index: str,
+                            direction: str) -> t.Optional[int]:
+        ''' Key of the first figure mark after the index for "next",
+        before it for "previous". Only the few other marks are skipped
+        '''
+        mark_name = self.text_call("mark", direction, index)
+        while mark_name:
+            mark_name = str(mark_name)
+            if mark_name.startswith(FIGURE_MARK_PREFIX):
+                return int(mark_name[len(FIGURE_MARK_PREFIX):])
+            mark_name = self.text_call("mark", direction, mark_name)
+        return None
+
+    def renumber_lines(self):
+        ''' Line orders of all figures from the text
+        '''
+        keys = np.fromiter(self.ordered_figure_keys(), dtype=np.intp)
+        self.line_figures.line_orders[keys] = np.arange(len(keys))
+
+    def order_new_figures(self):
+        ''' Give the added figures the line orders between the ones
+        of the figures around them. Lines added together get evenly
+        spaced orders, all are renumbered when there is no room left
+        '''
+        if not self.unordered_figures:
+            return
+        orders = self.line_figures.line_orders
+        new_lines = sorted(
+            (self.line_of(f"{FIGURE_MARK_PREFIX}{key}"), key)
+            for key in self.unordered_figures)
+        self.unordered_figures = set()
+        # Runs of the new figures without old ones between them
+        runs = []
+        for _, key in new_lines:
+            if runs and self.neighbor_figure_key(
+                    f"{FIGURE_MARK_PREFIX}{key}", "previous") == runs[-1][-1]:
+                runs[-1].append(key)
+            else:
+                runs.append([key])
+        for run in runs:
+            previous_key = self.neighbor_figure_key(
+                f"{FIGURE_MARK_PREFIX}{run[0]}", "previous")
+            next_key = self.neighbor_figure_key(
+                f"{FIGURE_MARK_PREFIX}{run[-1]}", "next")
+            steps = np.arange(1, len(run) + 1)
+            if previous_key is None and next_key is None:
+                run_orders = steps - 1.0
+            elif next_key is None:
+                run_orders = orders[previous_key] + steps
+            elif previous_key is None:
+                run_orders = orders[next_key] - steps[::-1]
+            else:
+                low = orders[previous_key]
+                high = orders[next_key]
+                run_orders = low + (high - low) * steps / (len(run) + 1)
+                if not (low < run_orders[0] and run_orders[-1] < high and
+                        np.all(np.diff(run_orders) > 0)):
+                    # Too many lines were put between these two
+                    self.renumber_lines()
+                    return
+            orders[run] = run_orders
+
+    def topmost_figure(self, keys: t.Iterable[int]) -> t.Optional[int]:
+        ''' The figure of the lowest line, it is drawn on top
+        '''
+        keys = np.fromiter(keys, dtype=np.intp)
+        if not len(keys):
+            return None
+        return int(keys[np.argmax(self.line_figures.line_orders[keys])])
+
+    def figure_at(self, point_x: float, point_y: float) -> t.Optional[int]:
+        ''' Key of the topmost figure under the point
         '''
-        # Get input from the text widget
-        # Get adds a newline, so delete it
-        editor_input = self.text_editor.get("1.0", "end-1c")
-        lines = editor_input.split('\n')
-        self.figures_lst = []
-        for line in lines:
-            figure = figure_from_text(line)
-            if figure is not None:
-                self.figures_lst.append(figure)
+        keys = self.figure_index.query_point(point_x, point_y)
+        if not keys:
+            return None
+        hits = self.line_figures.contain_point(keys, point_x, point_y)
+        return self.topmost_figure(key for key, is_hit in zip(keys, hits)
+                                   if is_hit)
+
+    def figures_in_rectangle(self, coords: t.List[float]) -> t.List[int]:
+        ''' Keys of the figures touching the rectangle, in any order
+        '''
+        box = normalized_box(coords)
+        keys = list(self.figure_index.query_box(box))
+        if not keys:
+            return []
+        hits = self.line_figures.intersect_box(keys, box)
+        return [key for key, is_hit in zip(keys, hits) if is_hit]
 
     def draw_figures(self):
-        ''' Draw figures from the figure list
-        '''
-        # Clear all previously drawn solution
-        # Not optimal, better update them
-        self.graph_editor.delete("all")
-        self.canvas_figures = []
-        for figure in self.figures_lst:
-            if figure.figure_type == "oval":
-                self.canvas_figures.append(
-                    self.graph_editor.create_oval(
-                        figure.coords[0], figure.coords[1],
-                        figure.coords[2], figure.coords[3],
-                        fill=figure.fill_color, outline=figure.border_color,
-                        width=figure.border_size
-                    )
-                )
+        ''' Bring the canvas in line with the figures changed
+        since the last call. Only their items are touched, the view
+        is not looked at again, so an edit costs the same whatever
+        the number of figures
+        '''
+        if self.view_job is not None:
+            # The items are placed for the view, bring it up first
+            self.update_view()
+        # Removed and changed figures may have been the dots
+        is_lod_changed = bool(self.removed_figures)
+        for key in self.removed_figures:
+            self.hide_figure(key)
+        self.removed_figures = set()
+        keys = np.fromiter(self.changed_figures, dtype=np.intp,
+                           count=len(self.changed_figures))
+        self.changed_figures = set()
+        boxes = self.line_figures.bounding_boxes(keys)
+        view_box = self.view_box(VIEW_MARGIN)
+        is_near = (boxes[:, 0] <= view_box[2]) & \
+            (view_box[0] <= boxes[:, 2]) & \
+            (boxes[:, 1] <= view_box[3]) & (view_box[1] <= boxes[:, 3])
+        is_shown = is_near & ~self.small_figures(keys, boxes)
+        for key in keys[~is_shown].tolist():
+            is_lod_changed = True
+            self.hide_figure(key)
+        new_keys = []
+        for key in keys[is_shown].tolist():
+            figure = self.line_figures[key]
+            item = self.figure_items.get(key)
+            if item is not None and \
+               self.graph_editor.type(item) != figure.figure_type:
+                # The line holds a figure of another type now
+                self.hide_figure(key)
+                item = None
+            if item is not None:
+                self.graph_editor.coords(item,
+                                         *self.canvas_coords(figure.coords))
+                self.graph_editor.itemconfigure(
+                    item, **figure_item_options(figure, self.zoom))
+                continue
+            is_lod_changed = True
+            if len(self.figure_items) < MAX_SHOWN_ITEMS and \
+               self.show_figure(key, figure) is not None:
+                new_keys.append(key)
+        self.stack_items(new_keys)
+        if is_lod_changed:
+            self.schedule_lod_update()
+        self.update_scrollbars()
+
+    def to_world(self, canvas_x: float, canvas_y: float) \
+            -> t.Tuple[float, float]:
+        ''' Figure coordinates of the canvas point
+        '''
+        return (self.view_x + canvas_x / self.zoom,
+                self.view_y + canvas_y / self.zoom)
+
+    def canvas_coords(self, coords: t.List[float]) -> t.List[float]:
+        return [(coord - (self.view_y if coord_idx % 2 else self.view_x)) *
+                self.zoom for coord_idx, coord in enumerate(coords)]
+
+    def view_size(self) -> t.Tuple[int, int]:
+        ''' Canvas size in pixels, the requested one until it is mapped
+        '''
+        width = self.graph_editor.winfo_width()
+        height = self.graph_editor.winfo_height()
+        if width <= 1 or height <= 1:
+            width = int(self.graph_editor['width'])
+            height = int(self.graph_editor['height'])
+        return width, height
+
+    def view_box(self, margin: float = 0.0) -> BoundingBox:
+        ''' Visible part of the figure plane, grown by the share
+        of its size on every side
+        '''
+        width, height = self.view_size()
+        width /= self.zoom
+        height /= self.zoom
+        return (self.view_x - margin * width, self.view_y - margin * height,
+                self.view_x + (1 + margin) * width,
+                self.view_y + (1 + margin) * height)
+
+    def extend_scene(self, box: BoundingBox):
+        if self.scene_box is None:
+            self.scene_box = tuple(box)
+        else:
+            self.scene_box = (min(self.scene_box[0], box[0]),
+                              min(self.scene_box[1], box[1]),
+                              max(self.scene_box[2], box[2]),
+                              max(self.scene_box[3], box[3]))
+
+    def show_figure(self, key: int, figure: FigureInfo) -> t.Optional[int]:
+        ''' Give the figure an item, a hidden one if there is any.
+        Results:
+            The item or None if the figure type has no item
+        '''
+        if figure.figure_type not in CANVAS_ITEM_TYPES:
+            return None
+        coords = self.canvas_coords(figure.coords)
+        options = figure_item_options(figure, self.zoom)
+        pool = self.item_pool.get(figure.figure_type)
+        if pool:
+            item = pool.pop()
+            self.graph_editor.coords(item, *coords)
+            self.graph_editor.itemconfigure(item, state=tk.NORMAL, **options)
+        else:
+            create_item = getattr(self.graph_editor,
+                                  f"create_{figure.figure_type}")
+            item = create_item(*coords, tags=FIGURE_ITEM_TAG, **options)
+        self.figure_items[key] = item
+        self.item_figures[item] = key
+        return item
+
+    def hide_figure(self, key: int):
+        ''' Take the item from the figure, keep it for reuse
+        '''
+        item = self.figure_items.pop(key, None)
+        if item is None:
+            return
+        del self.item_figures[item]
+        pool = self.item_pool.setdefault(self.graph_editor.type(item), [])
+        if len(pool) < MAX_POOLED_ITEMS:
+            self.graph_editor.itemconfigure(item, state=tk.HIDDEN)
+            pool.append(item)
+        else:
+            self.graph_editor.delete(item)
+
+    def small_figures(self, keys: np.ndarray,
+                      boxes: np.ndarray) -> np.ndarray:
+        ''' Which of the figures are too small for their own items
+        '''
+        store = self.line_figures
+        sizes = np.maximum(boxes[:, 2] - boxes[:, 0],
+                           boxes[:, 3] - boxes[:, 1]) * self.zoom
+        is_small = sizes < LOD_PIXELS
+        text_code = store.type_name_codes.get("text")
+        if text_code is not None:
+            # Text boxes are not known, texts always get the items
+            is_small &= store.type_codes[keys] != text_code
+        return is_small
+
+    def is_view_far(self) -> bool:
+        ''' Too many grid cells in the view, the pyramid shows it
+        '''
+        first_column, first_row, last_column, last_row = \
+            self.figure_index.cell_range(self.view_box(VIEW_MARGIN))
+        return (last_column - first_column + 1) * \
+            (last_row - first_row + 1) > MAX_INDEX_QUERY_CELLS
+
+    def visible_figures(self) -> t.Tuple[t.List[int],
+                                         t.Optional[np.ndarray]]:
+        ''' Figures near the view.
+        Results:
+            (keys of the figures to show with items,
+             keys of the figures too small for them, None if the view
+             is far zoomed out and the dots come from the pyramid)
+        '''
+        box = self.view_box(VIEW_MARGIN)
+        store = self.line_figures
+        if self.is_view_far():
+            # Zoomed out far: only the figures large enough on the screen
+            # are tested against the view, the largest first
+            keys = self.figure_pyramid.large_figures(LOD_PIXELS / self.zoom)
+            boxes = store.bounding_boxes(keys)
+            is_near = (boxes[:, 0] <= box[2]) & (box[0] <= boxes[:, 2]) & \
+                (boxes[:, 1] <= box[3]) & (box[1] <= boxes[:, 3])
+            return keys[is_near][:MAX_SHOWN_ITEMS].tolist(), None
+        keys = np.fromiter(self.figure_index.query_box(box), dtype=np.intp)
+        boxes = store.bounding_boxes(keys)
+        is_small = self.small_figures(keys, boxes)
+        if np.count_nonzero(~is_small) > MAX_SHOWN_ITEMS:
+            sizes = np.maximum(boxes[:, 2] - boxes[:, 0],
+                               boxes[:, 3] - boxes[:, 1])
+            is_small[np.argsort(-sizes, kind='stable')[MAX_SHOWN_ITEMS:]] = \
+                True
+        return keys[~is_small].tolist(), keys[is_small]
+
+    def schedule_view_update(self):
+        ''' Pan and zoom events are coalesced like the pointer motion
+        '''
+        if self.view_job is None:
+            self.view_job = self.after(MOTION_FRAME_MS, self.update_view)
+
+    def update_view(self):
+        ''' Give the items to the figures near the view, take them
+        from the figures far from it, redraw the small figures
+        '''
+        if self.view_job is not None:
+            self.after_cancel(self.view_job)
+            self.view_job = None
+        shown_x, shown_y, shown_zoom = self.shown_view
+        self.shown_view = (self.view_x, self.view_y, self.zoom)
+        item_keys, small_keys = self.visible_figures()
+        shown_keys = set(item_keys)
+        for key in [key for key in self.figure_items
+                    if key not in shown_keys]:
+            self.hide_figure(key)
+        if shown_zoom != self.zoom:
+            for key, item in self.figure_items.items():
+                figure = self.line_figures[key]
+                self.graph_editor.coords(item,
+                                         *self.canvas_coords(figure.coords))
+                self.graph_editor.itemconfigure(
+                    item, **figure_item_options(figure, self.zoom))
+        elif shown_x != self.view_x or shown_y != self.view_y:
+            # One call moves all the items, the hidden ones too
+            self.graph_editor.move(FIGURE_ITEM_TAG,
+                                   (shown_x - self.view_x) * self.zoom,
+                                   (shown_y - self.view_y) * self.zoom)
+        new_keys = [key for key in item_keys
+                    if key not in self.figure_items and
+                    self.show_figure(key, self.line_figures[key]) is not None]
+        self.stack_items(new_keys)
+        self.draw_small_figures(small_keys)
+        self.update_scrollbars()
+
+    def stack_items(self, new_keys: t.List[int]):
+        ''' Later lines are drawn on top. The shown figures are sorted
+        by their line orders, and every new item goes right under
+        the item of the next one. Top items are placed first, so that
+        one is already in place
+        '''
+        if not new_keys:
+            return
+        shown_keys = np.fromiter(self.figure_items, dtype=np.intp,
+                                 count=len(self.figure_items))
+        shown_keys = shown_keys[np.argsort(
+            self.line_figures.line_orders[shown_keys], kind='stable')]
+        new_positions = np.flatnonzero(np.isin(shown_keys, new_keys))
+        shown_keys = shown_keys.tolist()
+        for position in reversed(new_positions.tolist()):
+            item = self.figure_items[shown_keys[position]]
+            if position + 1 == len(shown_keys):
+                self.graph_editor.tag_raise(item)
+            else:
+                self.graph_editor.tag_lower(
+                    item, self.figure_items[shown_keys[position + 1]])
+
+    def schedule_lod_update(self):
+        ''' The dots are redrawn once the edits pause
+        '''
+        if self.lod_job is not None:
+            self.after_cancel(self.lod_job)
+        self.lod_job = self.after(LOD_UPDATE_MS, self.update_lod)
+
+    def update_lod(self):
+        self.lod_job = None
+        if self.is_view_far():
+            self.draw_small_figures(None)
+            return
+        _, small_keys = self.visible_figures()
+        self.draw_small_figures(small_keys)
+
+    def draw_small_figures(self, keys: t.Optional[np.ndarray]):
+        ''' One pixel per figure in an image under all items.
+        Without the keys the view is far zoomed out, and every occupied
+        pyramid cell of about a pixel is a dot instead
+        '''
+        if self.lod_job is not None:
+            self.after_cancel(self.lod_job)
+            self.lod_job = None
+        store = self.line_figures
+        width, height = self.view_size()
+        if keys is None:
+            # The smallest cells not less than a pixel
+            level = max(0, math.ceil(math.log2(1 / self.zoom)))
+            cells = self.figure_pyramid.cells_in_box(level, self.view_box())
+            cell_size = 2.0 ** level
+            canvas_x = np.floor((cells.columns * cell_size - self.view_x) *
+                                self.zoom).astype(np.intp)
+            canvas_y = np.floor((cells.rows * cell_size - self.view_y) *
+                                self.zoom).astype(np.intp)
+            color_codes = cells.color_codes
+            dot_size = math.ceil(cell_size * self.zoom)
+        else:
+            coords = store.coords[keys]
+            canvas_x = (((coords[:, 0] + coords[:, 2]) / 2 - self.view_x) *
+                        self.zoom).astype(np.intp)
+            canvas_y = (((coords[:, 1] + coords[:, 3]) / 2 - self.view_y) *
+                        self.zoom).astype(np.intp)
+            color_codes = store.dot_color_codes(keys)
+            dot_size = 1
+        if len(color_codes) == 0:
+            if self.lod_item is not None:
+                self.graph_editor.itemconfigure(self.lod_item,
+                                                state=tk.HIDDEN)
+            return
+        if self.palette_colors is not store.colors:
+            # The store was cleared, its codes are new
+            self.palette_colors = store.colors
+            self.palette = np.zeros((0, 3), dtype=np.uint8)
+        if len(self.palette) < len(store.colors):
+            self.palette = np.concatenate([
+                self.palette,
+                color_palette(store.colors[len(self.palette):],
+                              CANVAS_BACKGROUND)])
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = color_palette([CANVAS_BACKGROUND], CANVAS_BACKGROUND)
+        for x_offset in range(dot_size):
+            for y_offset in range(dot_size):
+                dot_x = canvas_x + x_offset
+                dot_y = canvas_y + y_offset
+                is_shown = (dot_x >= 0) & (dot_x < width) & \
+                    (dot_y >= 0) & (dot_y < height)
+                image[dot_y[is_shown], dot_x[is_shown]] = \
+                    self.palette[color_codes[is_shown]]
+        ppm = f"P6\n{width} {height}\n255\n".encode('ascii') + \
+            image.tobytes()
+        # Keep the reference, Tk doesn't
+        self.lod_image = tk.PhotoImage(master=self, format='PPM',
+                                       data=base64.b64encode(ppm))
+        if self.lod_item is None:
+            self.lod_item = self.graph_editor.create_image(
+                0, 0, anchor=tk.NW, image=self.lod_image)
+        else:
+            self.graph_editor.itemconfigure(self.lod_item,
+                                            image=self.lod_image,
+                                            state=tk.NORMAL)
+        self.graph_editor.tag_lower(self.lod_item)
+
+    def scroll_range(self, axis: int) -> t.Tuple[float, float, float]:
+        ''' Figure coordinates the scroll bar spans and the view length
+        along the axis: 0 for x, 1 for y
+        '''
+        view_box = self.view_box()
+        scene_box = self.scene_box if self.scene_box is not None \
+            else view_box
+        return (min(scene_box[axis], view_box[axis]),
+                max(scene_box[axis + 2], view_box[axis + 2]),
+                view_box[axis + 2] - view_box[axis])
+
+    def update_scrollbars(self):
+        for axis, scrollbar in enumerate((self.x_scrollbar,
+                                          self.y_scrollbar)):
+            low, high, view_length = self.scroll_range(axis)
+            start = (self.view_x, self.view_y)[axis]
+            scrollbar.set((start - low) / (high - low),
+                          (start + view_length - low) / (high - low))
+
+    def on_scroll_x(self, *args):
+        self.scroll_view(0, *args)
+
+    def on_scroll_y(self, *args):
+        self.scroll_view(1, *args)
+
+    def scroll_view(self, axis: int, operation: str, amount: str,
+                    unit: t.Optional[str] = None):
+        ''' Handle the scroll bar command: moveto fraction
+        or scroll count units/pages
+        '''
+        low, high, view_length = self.scroll_range(axis)
+        start = (self.view_x, self.view_y)[axis]
+        if operation == "moveto":
+            start = low + float(amount) * (high - low)
+        elif unit == "pages":
+            start += int(amount) * view_length * 0.9
+        else:
+            start += int(amount) * SCROLL_UNIT / self.zoom
+        if axis == 0:
+            self.view_x = start
+        else:
+            self.view_y = start
+        self.schedule_view_update()
+
+    def on_mouse_wheel(self, event):
+        if event.num == 4 or (event.num != 5 and event.delta > 0):
+            direction = 1
+        else:
+            direction = -1
+        if event.state & CONTROL_MASK:
+            self.zoom_at(event.x, event.y, ZOOM_STEP ** direction)
+        elif event.state & SHIFT_MASK:
+            self.view_x -= direction * SCROLL_UNIT / self.zoom
+            self.schedule_view_update()
+        else:
+            self.view_y -= direction * SCROLL_UNIT / self.zoom
+            self.schedule_view_update()
+
+    def zoom_at(self, canvas_x: float, canvas_y: float, factor: float):
+        ''' Zoom keeping the figure point under the canvas point
+        '''
+        world_x, world_y = self.to_world(canvas_x, canvas_y)
+        self.zoom = min(MAX_ZOOM, max(MIN_ZOOM, self.zoom * factor))
+        self.view_x = world_x - canvas_x / self.zoom
+        self.view_y = world_y - canvas_y / self.zoom
+        self.schedule_view_update()
+
+    def ordered_figure_keys(self) -> t.Iterator[int]:
+        ''' Figure keys in the text order.
+        Marks are listed by a few lines at once to keep the lists short
+        '''
+        last_line = self.line_of("end")
+        for first_line in range(1, last_line + 1, SAVE_DUMP_LINES):
+            dump = self.text_call("dump", "-mark", f"{first_line}.0",
+                                  f"{first_line + SAVE_DUMP_LINES}.0")
+            for mark_name in dump[1::3]:
+                mark_name = str(mark_name)
+                if mark_name.startswith(FIGURE_MARK_PREFIX):
+                    yield int(mark_name[len(FIGURE_MARK_PREFIX):])
 
     def save_text(self):
-        pass
+        ''' Write the figures in the text order.
+        Lines that are not figures are not saved.
+        The file is replaced only when it is written completely
+        '''
+        if self.load_job is not None:
+            return
+        path = filedialog.asksaveasfilename(
+            parent=self, initialfile=self.filename_label['text'],
+            defaultextension='.txt')
+        if not path:
+            return
+        # Pending edits go to the figures first
+        self.on_text_changed()
+        directory, name = os.path.split(os.path.abspath(path))
+        try:
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                                prefix=f".{name}.",
+                                                suffix='.tmp')
+        except OSError:
+            self.filename_label['text'] = f"Can't save {name}"
+            return
+        try:
+            # The file object owns the descriptor from now on,
+            # it is closed whatever fails next
+            with open(tmp_fd, 'w', encoding='utf-8', newline='\n',
+                      buffering=SAVE_BUFFER_SIZE) as figure_file:
+                # The temporary file is private, the saved one gets
+                # the mode of the file it replaces
+                os.chmod(tmp_path, saved_file_mode(path))
+                for key in self.ordered_figure_keys():
+                    figure_file.write(text_from_figure(self.line_figures[key]))
+                    figure_file.write('\n')
+                figure_file.flush()
+                os.fsync(figure_file.fileno())
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            self.filename_label['text'] = f"Can't save {name}"
+            return
+        self.filename = path
+        self.filename_label['text'] = name
+
+    def clear_document(self):
+        ''' Remove all the text, the figures and their items
+        '''
+        for key in list(self.line_figures):
+            self.remove_figure(key)
+        self.text_call("delete", "1.0", "end")
+        if self.text_change_job is not None:
+            self.after_cancel(self.text_change_job)
+            self.text_change_job = None
+        self.changed_figures = set()
+        self.scene_box = None
+        self.draw_figures()
 
     def load_text(self):
-        pass
+        ''' Start loading the file on the loader thread.
+        The document is replaced piece by piece, the window keeps
+        responding meanwhile
+        '''
+        path = filedialog.askopenfilename(parent=self)
+        if not path:
+            return
+        self.stop_loading()
+        try:
+            self.load_size = os.path.getsize(path)
+        except OSError:
+            self.filename_label['text'] = "Can't open " + \
+                                          os.path.basename(path)
+            return
+        self.clear_document()
+        self.filename = path
+        self.load_batches = queue.Queue(LOAD_QUEUE_SIZE)
+        self.load_stop_event = threading.Event()
+        threading.Thread(target=read_figure_batches,
+                         args=(path, self.load_batches, self.load_stop_event),
+                         daemon=True).start()
+        self.show_load_progress(0)
+        self.load_job = self.after(LOAD_POLL_MS, self.poll_loading)
+
+    def stop_loading(self):
+        if self.load_job is not None:
+            self.after_cancel(self.load_job)
+            self.load_job = None
+        if self.load_stop_event is not None:
+            self.load_stop_event.set()
+            self.load_stop_event = None
+        self.load_batches = None
+
+    def show_load_progress(self, position: int):
+        name = os.path.basename(self.filename)
+        if self.load_size:
+            name += f" {100 * position // self.load_size}%"
+        self.filename_label['text'] = name
+
+    def poll_loading(self):
+        ''' Add the parsed pieces for a frame time, then let Tk
+        handle the events
+        '''
+        self.load_job = None
+        start = time.perf_counter()
+        is_added = False
+        while time.perf_counter() - start < LOAD_FRAME_MS / 1000:
+            try:
+                batch = self.load_batches.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None or isinstance(batch, Exception):
+                self.stop_loading()
+                if is_added:
+                    self.draw_figures()
+                if batch is None:
+                    self.filename_label['text'] = \
+                        os.path.basename(self.filename)
+                else:
+                    self.filename_label['text'] = \
+                        f"Can't load {os.path.basename(self.filename)}"
+                return
+            self.add_loaded_batch(batch)
+            is_added = True
+            self.show_load_progress(batch.position)
+        if is_added:
+            # The items of all the pieces are made at once
+            self.draw_figures()
+        self.load_job = self.after(LOAD_POLL_MS, self.poll_loading)
+
+    def add_figure(self, line_idx: int, figure: FigureInfo):
+        ''' Register the figure of the line which has none yet
+        '''
+        key = self.line_figures.append(figure)
+        self.figure_index.insert(key, figure_box(figure))
+        self.extend_scene(figure_box(figure))
+        self.changed_figures.add(key)
+        self.unordered_figures.add(key)
+        self.text_call("mark", "set", f"{FIGURE_MARK_PREFIX}{key}",
+                       f"{line_idx}.0")
+
+    def add_loaded_batch(self, batch: LoadBatch):
+        ''' Append the piece to the text. Its lines are already parsed,
+        so the change tracking is bypassed. The caller draws the figures
+        '''
+        first_line = self.line_of("end-1c")
+        last_key = self.neighbor_figure_key("end", "previous")
+        first_order = 0.0 if last_key is None else \
+            self.line_figures.line_orders[last_key] + 1
+        self.text_call("insert", "end-1c", batch.text)
+        invalid_lines = np.flatnonzero(~batch.figures.has_figure())
+        for line_idx in (invalid_lines + first_line).tolist():
+            self.text_call("tag", "add", "red", f"{line_idx}.0",
+                           f"{line_idx}.end")
+        # The columns and the boxes are filled at once,
+        # the figures are not made one by one
+        keys, figure_lines = self.line_figures.extend_parsed(batch.figures)
+        # The piece goes after all the lines, so do its orders
+        self.line_figures.line_orders[keys] = first_order + figure_lines
+        keys = keys.tolist()
+        figure_lines = (figure_lines + first_line).tolist()
+        boxes = self.line_figures.bounding_boxes(keys)
+        if len(boxes):
+            self.extend_scene((*boxes[:, :2].min(axis=0),
+                               *boxes[:, 2:].max(axis=0)))
+        for key, line_idx, box in zip(keys, figure_lines, boxes.tolist()):
+            self.figure_index.insert(key, tuple(box))
+            self.changed_figures.add(key)
+            self.text_call("mark", "set", f"{FIGURE_MARK_PREFIX}{key}",
+                           f"{line_idx}.0")
 
 
 if __name__ == "__main__":
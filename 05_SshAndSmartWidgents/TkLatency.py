@@ -0,0 +1,405 @@
+''' Event handler latency of the Tk applications.
+
+    python TkLatency.py run TkGraphEdit.py --overlay --record session.jsonl
+    python TkLatency.py replay TkGraphEdit.py session.jsonl -o stats.json
+    python TkLatency.py run ../03_ThreeWayAndTkinter/15Puzzle.py
+
+The application is loaded from its file and its handlers are wrapped
+before the frame is created, the application itself is not changed.
+Run without this tool, it has no instrumentation at all. Every call of
+a wrapped handler is timed into a histogram of power of two buckets,
+nested calls are counted by every handler they pass, so the time of
+draw_figures is also a part of on_text_changed.
+
+run starts the application as usual, optionally recording the input
+events to a JSON lines file. replay creates the application with the
+same random seed and generates the recorded events again, with their
+original timing or faster, so two versions of the code can be compared
+on the same input. Both print the statistics as JSON at the end.
+'''
+import argparse
+import functools
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+import tkinter as tk
+import typing as t
+
+# Handlers wrapped in every known application frame class
+APP_HANDLERS = {
+    'GraphEditorFrame': ('on_text_changed', 'on_mouse_click',
+                         'on_mouse_motion', 'on_mouse_release',
+                         'draw_figures'),
+    'GameFrame': ('on_click_game_button', 'generate_board'),
+}
+# Bucket i holds the calls of [2 ** (i - 1), 2 ** i) microseconds,
+# the last one everything longer
+HISTOGRAM_BUCKETS = 28
+DEFAULT_SEED = 15
+# How often the overlay window is refreshed
+OVERLAY_REFRESH_MS = 500
+# Timers started by the last replayed events get this long to fire
+REPLAY_SETTLE_S = 0.5
+# Recorded events: Tk event type -> the fields kept
+RECORDED_EVENTS = {
+    'ButtonPress': ('num', 'x', 'y', 'state'),
+    'ButtonRelease': ('num', 'x', 'y', 'state'),
+    'Motion': ('x', 'y', 'state'),
+    'MouseWheel': ('delta', 'x', 'y', 'state'),
+    'KeyPress': ('keysym', 'state'),
+    'KeyRelease': ('keysym', 'state'),
+}
+
+
+class HandlerStats():
+    ''' Call count, time and latency histogram of one handler
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        bucket_idx = int(elapsed * 1e6).bit_length()
+        self.buckets[min(bucket_idx, HISTOGRAM_BUCKETS - 1)] += 1
+
+    def percentile(self, share: float) -> float:
+        ''' Upper bound of the bucket the share of the calls fits in,
+        in seconds
+        '''
+        needed = share * self.count
+        seen = 0
+        for bucket_idx, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= needed and bucket_count:
+                return min(2 ** bucket_idx / 1e6, self.max_time)
+        return self.max_time
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        return {
+            'count': self.count,
+            'total_s': self.total_time,
+            'mean_s': self.total_time / self.count if self.count else 0.0,
+            'p50_s': self.percentile(0.5),
+            'p90_s': self.percentile(0.9),
+            'p99_s': self.percentile(0.99),
+            'max_s': self.max_time,
+            # Upper bucket bounds in microseconds -> call count
+            'histogram_us': {str(2 ** bucket_idx): bucket_count
+                             for bucket_idx, bucket_count
+                             in enumerate(self.buckets) if bucket_count},
+        }
+
+
+class LatencyStats():
+    ''' Statistics of all wrapped handlers. Timing is skipped
+    while enabled is false, a wrapped call costs one check then
+    '''
+    def __init__(self):
+        self.enabled = True
+        self.handlers: t.Dict[str, HandlerStats] = {}
+
+    def handler(self, name: str) -> HandlerStats:
+        handler_stats = self.handlers.get(name)
+        if handler_stats is None:
+            handler_stats = HandlerStats()
+            self.handlers[name] = handler_stats
+        return handler_stats
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        return {name: handler_stats.to_dict()
+                for name, handler_stats in sorted(self.handlers.items())}
+
+    def summary_lines(self) -> t.List[str]:
+        lines = [f"{'handler':40} {'calls':>7} {'p50 ms':>8} "
+                 f"{'p99 ms':>8} {'max ms':>8}"]
+        for name, handler_stats in sorted(self.handlers.items()):
+            lines.append(f"{name:40} {handler_stats.count:7} "
+                         f"{handler_stats.percentile(0.5) * 1e3:8.2f} "
+                         f"{handler_stats.percentile(0.99) * 1e3:8.2f} "
+                         f"{handler_stats.max_time * 1e3:8.2f}")
+        return lines
+
+
+def timed_handler(name: str, method: t.Callable,
+                  stats: LatencyStats) -> t.Callable:
+    handler_stats = stats.handler(name)
+    perf_counter = time.perf_counter
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not stats.enabled:
+            return method(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            handler_stats.add(perf_counter() - start)
+
+    wrapper.timed_method = method
+    return wrapper
+
+
+def instrument(frame_class: type, handler_names: t.Iterable[str],
+               stats: LatencyStats):
+    ''' Replace the handlers of the class with the timed ones.
+    Frames created afterwards bind the timed handlers, the calls
+    of one handler from another are timed too
+    '''
+    for handler_name in handler_names:
+        method = getattr(frame_class, handler_name)
+        # Instrumenting twice would count every call twice
+        assert(not hasattr(method, 'timed_method'))
+        setattr(frame_class, handler_name,
+                timed_handler(f"{frame_class.__name__}.{handler_name}",
+                              method, stats))
+
+
+def load_app_module(path: str):
+    ''' Application files are scripts, some of them can't be imported
+    by name. Their own modules are imported from their directory
+    '''
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(f"app_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def find_frame_class(module) -> t.Tuple[type, t.Tuple[str, ...]]:
+    for class_name, handler_names in APP_HANDLERS.items():
+        frame_class = getattr(module, class_name, None)
+        if frame_class is not None:
+            return frame_class, handler_names
+    raise ValueError(f"{module.__file__} has none of the frame classes "
+                     f"{', '.join(APP_HANDLERS)}")
+
+
+class LatencyOverlay():
+    ''' Small always-on-top window with the statistics,
+    refreshed while the application runs
+    '''
+    def __init__(self, master: tk.Misc, stats: LatencyStats):
+        self.stats = stats
+        self.window = tk.Toplevel(master)
+        self.window.title('Handler latency')
+        self.window.attributes('-topmost', True)
+        self.label = tk.Label(self.window, font='TkFixedFont',
+                              justify=tk.LEFT, anchor=tk.NW)
+        self.label.pack(fill=tk.BOTH, expand=True)
+        # Timing can be paused to measure only a part of the session
+        self.enabled_var = tk.BooleanVar(self.window, value=stats.enabled)
+        tk.Checkbutton(self.window, text='Timing',
+                       variable=self.enabled_var,
+                       command=self.on_toggle_timing).pack(anchor=tk.W)
+        self.refresh()
+
+    def on_toggle_timing(self):
+        self.stats.enabled = self.enabled_var.get()
+
+    def refresh(self):
+        self.label['text'] = '\n'.join(self.stats.summary_lines())
+        self.window.after(OVERLAY_REFRESH_MS, self.refresh)
+
+
+class EventRecorder():
+    ''' Collect the input events of all widgets of the application
+    '''
+    def __init__(self, root: tk.Tk, ignored_window: t.Optional[tk.Misc]):
+        self.events: t.List[t.Dict[str, t.Any]] = []
+        # The overlay isn't a part of the application
+        self.ignored_prefix = str(ignored_window) \
+            if ignored_window is not None else None
+        self.start = time.perf_counter()
+        for event_type in RECORDED_EVENTS:
+            root.bind_all(f"<{event_type}>", self.on_event, add='+')
+
+    def on_event(self, event):
+        event_type = getattr(event.type, 'name', str(event.type))
+        fields = RECORDED_EVENTS.get(event_type)
+        widget_name = str(event.widget)
+        if fields is None or (self.ignored_prefix is not None and
+                              widget_name.startswith(self.ignored_prefix)):
+            return
+        record = {'time': round(time.perf_counter() - self.start, 6),
+                  'type': event_type, 'widget': widget_name}
+        for field in fields:
+            value = getattr(event, field)
+            # Tk gives '??' for the fields the event doesn't have
+            if value != '??':
+                record[field] = value
+        self.events.append(record)
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as events_file:
+            for record in self.events:
+                events_file.write(json.dumps(record))
+                events_file.write('\n')
+
+
+def load_events(path: str) -> t.List[t.Dict[str, t.Any]]:
+    with open(path, encoding='utf-8') as events_file:
+        return [json.loads(line) for line in events_file if line.strip()]
+
+
+def event_sequence(record: t.Dict[str, t.Any]) -> str:
+    if record['type'] in ('ButtonPress', 'ButtonRelease'):
+        return f"<{record['type']}-{record['num']}>"
+    return f"<{record['type']}>"
+
+
+def generate_event(root: tk.Tk, record: t.Dict[str, t.Any]) -> bool:
+    ''' Send the recorded event to its widget.
+    Results:
+        False if the widget doesn't exist
+    '''
+    try:
+        widget = root.nametowidget(record['widget'])
+    except KeyError:
+        return False
+    options = {field: record[field]
+               for field in ('x', 'y', 'delta', 'keysym')
+               if field in record}
+    # Key events go to the focus widget
+    if record['type'] in ('KeyPress', 'KeyRelease'):
+        widget.focus_force()
+    state = record.get('state')
+    if isinstance(state, int):
+        options['state'] = state
+    widget.event_generate(event_sequence(record), **options)
+    return True
+
+
+def replay_events(root: tk.Tk, events: t.Sequence[t.Dict[str, t.Any]],
+                  speed: float) -> int:
+    ''' Generate the events at their recorded times divided by speed,
+    or back to back if speed is 0. The handlers run inside
+    event_generate, the timers and idle jobs between the events.
+    Results:
+        Number of the events sent
+    '''
+    sent = 0
+    start = time.perf_counter()
+    for record in events:
+        if speed > 0:
+            due = start + record['time'] / speed
+            while time.perf_counter() < due:
+                root.update()
+                time.sleep(0.001)
+        if generate_event(root, record):
+            sent += 1
+        root.update()
+    settle_end = time.perf_counter() + REPLAY_SETTLE_S
+    while time.perf_counter() < settle_end:
+        root.update()
+        time.sleep(0.001)
+    return sent
+
+
+def create_app(app_path: str, stats: LatencyStats, seed: int) \
+        -> t.Tuple[tk.Tk, tk.Frame]:
+    module = load_app_module(app_path)
+    frame_class, handler_names = find_frame_class(module)
+    instrument(frame_class, handler_names, stats)
+    # New games are random, the replayed session must start
+    # from the same board
+    random.seed(seed)
+    root = tk.Tk()
+    frame = frame_class(root)
+    root.title(f"{os.path.basename(app_path)} (latency)")
+    return root, frame
+
+
+def close_app(root: tk.Tk):
+    ''' Destroy the window unless the application already did
+    '''
+    try:
+        root.destroy()
+    except tk.TclError:
+        pass
+
+
+def write_report(path: str, report: t.Dict[str, t.Any]):
+    if path == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Measure the event handler latency of a Tk application')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser(
+        'run', help='use the application interactively')
+    run_parser.add_argument('--record', default=None,
+                            help='JSON lines file for the input events')
+    run_parser.add_argument('--overlay', action='store_true',
+                            help='show the statistics in a window')
+    replay_parser = subparsers.add_parser(
+        'replay', help='generate the recorded input events')
+    # The positionals go in the order they are added, the application
+    # comes first in both commands
+    for subparser in (run_parser, replay_parser):
+        subparser.add_argument('app', help='application file')
+        subparser.add_argument('-o', '--output', default='-',
+                               help='JSON statistics file, "-" for stdout')
+        subparser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    replay_parser.add_argument('events', help='JSON lines file '
+                                              'written by run --record')
+    replay_parser.add_argument('--speed', type=float, default=1.0,
+                               help='time scale of the recording, '
+                                    '0 sends the events back to back')
+    replay_parser.add_argument('--repeats', type=int, default=1,
+                               help='replay in new application windows '
+                                    'this many times')
+    args = parser.parse_args(argv)
+
+    stats = LatencyStats()
+    report = {'app': os.path.basename(args.app), 'seed': args.seed}
+    if args.command == 'run':
+        root, frame = create_app(args.app, stats, args.seed)
+        overlay = LatencyOverlay(root, stats) if args.overlay else None
+        recorder = EventRecorder(
+            root, overlay.window if overlay is not None else None) \
+            if args.record else None
+        # Closing the window ends the main loop like the Quit button,
+        # so the events and the report are saved either way
+        if not root.protocol("WM_DELETE_WINDOW"):
+            root.protocol("WM_DELETE_WINDOW", root.quit)
+        frame.mainloop()
+        if recorder is not None:
+            recorder.save(args.record)
+            report['events'] = len(recorder.events)
+        close_app(root)
+    else:
+        events = load_events(args.events)
+        for _ in range(args.repeats):
+            # Every repeat loads the application anew, so the repeats
+            # don't share the caches of the application modules
+            root, frame = create_app(args.app, stats, args.seed)
+            report['events'] = replay_events(root, events, args.speed)
+            close_app(root)
+        report['repeats'] = args.repeats
+        report['speed'] = args.speed
+    report['handlers'] = stats.to_dict()
+    write_report(args.output, report)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())